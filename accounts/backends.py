@@ -0,0 +1,73 @@
+"""
+Usuario de la sesión desde la caché.
+
+Sin esto cada petición autenticada consulta auth_user y, con
+hasattr(user, "patient_profile"), también patients_patient. El backend guarda
+en la caché el User ya con su perfil de paciente (o la marca de que no tiene,
+vía select_related), así request.user y hasattr(user, "patient_profile") no
+tocan la base.
+
+Las señales (accounts.signals) borran la entrada cuando se guarda o borra el
+User o su Patient. QuerySet.update() no dispara señales: quien desactive o
+cambie usuarios así (p. ej. update(is_active=False)) debe llamar a
+forget_users(); si no, el usuario sigue con sesión hasta USER_CACHE_TIMEOUT.
+Solo se usa la caché con settings.AUTH_USER_CACHE (caché compartida, Redis):
+con locmem cada proceso tiene la suya y los demás workers no se enterarían
+de un usuario desactivado o de un cambio de contraseña.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+USER_CACHE_TIMEOUT = 15 * 60
+# Subir el sufijo si cambia lo que se guarda (campos, select_related)
+KEY_PREFIX = "auth_user:v1"
+
+
+def user_key(user_id):
+    return f"{KEY_PREFIX}:{user_id}"
+
+
+def load_user(user_id):
+    """
+    User con patient_profile ya resuelto, desde la caché o la base.
+    Retorna None si no existe.
+    """
+    qs = get_user_model().objects.select_related("patient_profile").filter(pk=user_id)
+    if not settings.AUTH_USER_CACHE:
+        return qs.first()
+
+    key = user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = qs.first()
+        if user is not None:
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+    return user
+
+
+def forget_user(user_id):
+    forget_users([user_id])
+
+
+def forget_users(user_ids):
+    """
+    Borra de la caché los usuarios indicados (para cambios hechos con
+    update() / bulk_update(), que no pasan por las señales).
+    """
+    keys = [user_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Otra petición podría volver a guardar la versión vieja antes del commit
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend que carga el usuario de la sesión con load_user().
+    """
+
+    def get_user(self, user_id):
+        user = load_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,127 @@
+"""
+Rol del usuario de la petición.
+
+RoleMiddleware deja en request.role un Role (paciente, doctor o admin, con el
+id del Patient si es paciente), resuelto una sola vez y solo si alguien lo
+usa. Las vistas, las plantillas ({{ request.role.is_patient }}) y los
+decoradores doctor_required / patient_required leen de ahí en vez de llamar
+a hasattr(user, "patient_profile") cada vez.
+
+Es paciente quien tiene perfil de paciente; si no, admin si es superusuario
+y doctor en cualquier otro caso.
+"""
+from functools import wraps
+
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.shortcuts import redirect
+from django.utils.functional import SimpleLazyObject
+
+from patients.models import Patient
+
+ANONYMOUS = "anonymous"
+PATIENT = "patient"
+DOCTOR = "doctor"
+ADMIN = "admin"
+
+
+class Role:
+    def __init__(self, kind, user_id=None, patient_id=None):
+        self.kind = kind
+        self.user_id = user_id
+        self.patient_id = patient_id
+
+    @property
+    def is_patient(self):
+        return self.kind == PATIENT
+
+    @property
+    def is_doctor(self):
+        # El admin trabaja como doctor (agenda propia, recetas, archivos)
+        return self.kind in (DOCTOR, ADMIN)
+
+    @property
+    def is_admin(self):
+        return self.kind == ADMIN
+
+    def __repr__(self):
+        return f"<Role {self.kind} user={self.user_id} patient={self.patient_id}>"
+
+
+def _patient_id(user):
+    # El usuario de la sesión trae patient_profile ya resuelto (ver
+    # accounts.backends); si no, una consulta por el id.
+    related = get_user_model().patient_profile.related
+    if related.is_cached(user):
+        profile = related.get_cached_value(user)
+        return profile.pk if profile else None
+    return Patient.objects.filter(user_id=user.pk).values_list("pk", flat=True).first()
+
+
+def role_for(user):
+    if not user.is_authenticated:
+        return Role(ANONYMOUS)
+
+    patient_id = _patient_id(user)
+    if patient_id:
+        return Role(PATIENT, user.pk, patient_id)
+    return Role(ADMIN if user.is_superuser else DOCTOR, user.pk)
+
+
+def get_role(request):
+    """
+    request.role, o lo resuelve si la petición no pasó por el middleware.
+    """
+    role = getattr(request, "role", None)
+    if role is None:
+        role = request.role = role_for(request.user)
+    return role
+
+
+class RoleMiddleware:
+    """
+    Va después de AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = SimpleLazyObject(lambda: role_for(request.user))
+        return self.get_response(request)
+
+
+# ---------------------------
+# Decoradores
+# ---------------------------
+
+def _role_required(check, message, redirect_to):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not check(get_role(request)):
+                if message:
+                    messages.error(request, message)
+                return redirect(redirect_to)
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def doctor_required(view=None, *, message=None, redirect_to="my_appointments"):
+    """
+    Solo doctor o admin; al paciente lo redirige (con `message` si se da).
+    Va debajo de @login_required.
+    """
+    decorator = _role_required(lambda role: role.is_doctor, message, redirect_to)
+    return decorator(view) if view else decorator
+
+
+def patient_required(view=None, *, message=None, redirect_to="doctor_dashboard"):
+    """
+    Solo pacientes. Va debajo de @login_required.
+    """
+    decorator = _role_required(lambda role: role.is_patient, message, redirect_to)
+    return decorator(view) if view else decorator
@@ -1,3 +1,163 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from patients.models import Patient
+
+from .backends import CachedModelBackend, forget_users, load_user, user_key
+from .roles import ADMIN, ANONYMOUS, DOCTOR, PATIENT, doctor_required, get_role, patient_required, role_for
+
+
+@override_settings(AUTH_USER_CACHE=True)
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("pat", password="x")
+        Patient.objects.create(user=self.user)
+        cache.clear()
+
+    def test_hit_skips_the_database(self):
+        with self.assertNumQueries(1):
+            first = load_user(self.user.pk)
+        with self.assertNumQueries(0):
+            again = load_user(self.user.pk)
+            self.assertIsNotNone(again.patient_profile)
+        self.assertEqual(again, first)
+
+    def test_missing_user_is_not_cached(self):
+        self.assertIsNone(CachedModelBackend().get_user(self.user.pk + 100))
+        self.assertIsNone(cache.get(user_key(self.user.pk + 100)))
+
+    def test_save_drops_deactivated_user(self):
+        backend = CachedModelBackend()
+        self.assertIsNotNone(backend.get_user(self.user.pk))
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    def test_update_needs_forget_users(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNotNone(backend.get_user(self.user.pk))
+
+        forget_users([self.user.pk])
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    def test_password_change_ends_cached_session(self):
+        doctor = User.objects.create_user("doc", password="x")
+        self.client.force_login(doctor)
+        url = reverse("doctor_dashboard")
+        self.assertEqual(self.client.get(url, secure=True).status_code, 200)
+
+        doctor.set_password("nueva")
+        doctor.save()
+
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("login"), response["Location"])
+
+
+@override_settings(AUTH_USER_CACHE=False)
+class UncachedUserTests(TestCase):
+    def test_without_shared_cache_every_load_hits_the_database(self):
+        user = User.objects.create_user("doc", password="x")
+        cache.clear()
+
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(load_user(user.pk), user)
+        self.assertIsNone(cache.get(user_key(user.pk)))
+
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        self.assertIsNone(CachedModelBackend().get_user(user.pk))
+
+
+class RoleTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.admin = User.objects.create_superuser("admin", password="x")
+        self.patient_user = User.objects.create_user("pat", password="x")
+        self.patient = Patient.objects.create(user=self.patient_user)
+
+    def test_role_for(self):
+        role = role_for(self.patient_user)
+        self.assertEqual((role.kind, role.user_id, role.patient_id), (PATIENT, self.patient_user.pk, self.patient.pk))
+        self.assertTrue(role.is_patient)
+        self.assertFalse(role.is_doctor)
+
+        role = role_for(self.doctor)
+        self.assertEqual((role.kind, role.patient_id), (DOCTOR, None))
+        self.assertTrue(role.is_doctor)
+        self.assertFalse(role.is_admin)
+
+        role = role_for(self.admin)
+        self.assertEqual(role.kind, ADMIN)
+        self.assertTrue(role.is_doctor and role.is_admin)
+
+        role = role_for(AnonymousUser())
+        self.assertEqual(role.kind, ANONYMOUS)
+        self.assertFalse(role.is_patient or role.is_doctor)
+
+    def test_superuser_with_patient_profile_is_a_patient(self):
+        Patient.objects.create(user=self.admin)
+        self.assertTrue(role_for(User.objects.get(pk=self.admin.pk)).is_patient)
+
+    def test_get_role_without_middleware(self):
+        request = RequestFactory().get("/")
+        request.user = self.doctor
+        self.assertEqual(get_role(request).kind, DOCTOR)
+        self.assertIs(get_role(request), request.role)
+
+    def test_decorators_reject_the_wrong_role(self):
+        def view(request):
+            return HttpResponse("ok")
+
+        cases = [
+            (doctor_required(view), self.patient_user, reverse("my_appointments")),
+            (doctor_required(redirect_to="home")(view), self.patient_user, reverse("home")),
+            (patient_required(view), self.doctor, reverse("doctor_dashboard")),
+            (patient_required(view), self.admin, reverse("doctor_dashboard")),
+        ]
+        for decorated, user, location in cases:
+            request = RequestFactory().get("/")
+            request.user = user
+            response = decorated(request)
+            self.assertEqual((response.status_code, response["Location"]), (302, location))
+
+        for decorated, user in ((doctor_required(view), self.admin), (patient_required(view), self.patient_user)):
+            request = RequestFactory().get("/")
+            request.user = user
+            self.assertEqual(decorated(request).content, b"ok")
+
+    def test_views_redirect_the_wrong_role(self):
+        self.client.force_login(self.patient_user)
+        response = self.client.get(reverse("appointment_create"), secure=True)
+        self.assertRedirects(response, reverse("my_appointments"), fetch_redirect_response=False)
+        self.assertEqual(
+            [str(m) for m in get_messages(response.wsgi_request)], ["No tienes permiso para crear citas."]
+        )
+
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse("patient_history"), secure=True)
+        self.assertRedirects(response, reverse("doctor_dashboard"), fetch_redirect_response=False)
+
+    def test_templates_show_doctor_links_by_role(self):
+        agenda = f'href="{reverse("doctor_agenda")}"'
+        create = f'href="{reverse("appointment_create")}"'
+
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse("my_appointments"), secure=True)
+        self.assertContains(response, agenda)
+        self.assertContains(response, create)
+
+        self.client.force_login(self.patient_user)
+        response = self.client.get(reverse("my_appointments"), secure=True)
+        self.assertNotContains(response, agenda)
+        self.assertNotContains(response, create)
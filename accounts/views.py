@@ -5,6 +5,7 @@ from django.urls import reverse_lazy
 from django.shortcuts import redirect, render
 
 from .forms import LoginForm, PatientCreateForm
+from .roles import doctor_required
 
 
 class CustomLoginView(LoginView):
@@ -28,12 +29,8 @@ class CustomLoginView(LoginView):
 
 
 @login_required
+@doctor_required(message="No tienes permiso para crear pacientes.")
 def patient_create(request):
-    # ✅ Solo Doctor/Admin: si el user NO es paciente
-    if hasattr(request.user, "patient_profile"):
-        messages.error(request, "No tienes permiso para crear pacientes.")
-        return redirect("my_appointments")
-
     if request.method == "POST":
         form = PatientCreateForm(request.POST)
         if form.is_valid():
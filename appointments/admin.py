@@ -1,4 +1,74 @@
-from django.contrib import admin
-from .models import Appointment
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.http import HttpResponseRedirect
 
-admin.site.register(Appointment)
+from .booking import OVERLAP_ERROR, OverlapError, overlapping, save_appointment
+from .models import Appointment, AppointmentSeries, AuditEvent, OutboundEmail, WorkingHours
+from .pagination import KeysetPaginationMixin
+
+
+class AppointmentAdminForm(forms.ModelForm):
+    class Meta:
+        model = Appointment
+        fields = "__all__"
+
+    def clean(self):
+        cleaned = super().clean()
+        doctor, start, end = cleaned.get("doctor"), cleaned.get("start_time"), cleaned.get("end_time")
+        if doctor and start and end and cleaned.get("status") != "CANCELLED":
+            if overlapping(doctor.pk, start, end, self.instance.pk).exists():
+                raise ValidationError(OVERLAP_ERROR)
+        return cleaned
+
+
+@admin.register(Appointment)
+class AppointmentAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    form = AppointmentAdminForm
+    list_display = ("id", "start_time", "patient", "doctor", "status")
+    list_filter = ("status",)
+    list_select_related = ("patient__user", "doctor")
+    search_fields = ("reason", "patient__user__username", "doctor__username")
+
+    def save_model(self, request, obj, form, change):
+        # Misma regla que las vistas: el choque se revisa (o lo rechaza
+        # PostgreSQL) dentro de la transacción del guardado
+        save_appointment(obj)
+
+    def changeform_view(self, request, *args, **kwargs):
+        # Una reserva que entró entre clean() y el guardado: mensaje en vez de 500
+        try:
+            return super().changeform_view(request, *args, **kwargs)
+        except OverlapError:
+            self.message_user(request, OVERLAP_ERROR, messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+
+@admin.register(AppointmentSeries)
+class AppointmentSeriesAdmin(admin.ModelAdmin):
+    list_display = ("id", "start_time", "frequency", "count", "until", "patient", "doctor")
+    list_filter = ("frequency",)
+    list_select_related = ("patient__user", "doctor")
+
+
+@admin.register(WorkingHours)
+class WorkingHoursAdmin(admin.ModelAdmin):
+    list_display = ("doctor", "weekday", "start", "end")
+    list_filter = ("weekday",)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = "created_at"
+    list_display = ("id", "to", "subject", "status", "attempts", "created_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("to", "subject")
+
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = "created_at"
+    list_display = ("created_at", "actor", "action", "object_type", "object_id", "appointment", "message")
+    list_filter = ("action", "object_type")
+    list_select_related = ("actor", "appointment__patient__user")
+    raw_id_fields = ("actor", "appointment")
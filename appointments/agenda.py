@@ -0,0 +1,131 @@
+"""
+Agenda por semana y por mes.
+
+Todo el rango se trae en una sola consulta (índice doctor + start_time) y se
+agrupa por día en Python. ETag / Last-Modified salen de AgendaMarker, que las
+señales de Appointment actualizan en cada cambio: si nada cambió, la vista
+responde 304 sin consultar las citas ni renderizar.
+"""
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.contrib.messages import get_messages
+from django.utils import timezone
+
+from accounts.roles import get_role
+
+from .models import AgendaMarker, Appointment
+from .utils import parse_date_or_none
+
+WEEK = "week"
+MONTH = "month"
+
+
+def touch_agenda(doctor_ids, when=None):
+    when = when or timezone.now()
+    AgendaMarker.objects.bulk_create(
+        [AgendaMarker(doctor_id=doctor_id, changed_at=when) for doctor_id in doctor_ids if doctor_id],
+        update_conflicts=True,
+        unique_fields=["doctor"],
+        update_fields=["changed_at"],
+    )
+
+
+def agenda_range(period, date_str=None):
+    """
+    Retorna (primer día, último día) de la semana (lunes a domingo) o del
+    mes que contiene la fecha indicada.
+    """
+    selected = parse_date_or_none(date_str) or timezone.localdate()
+
+    if period == WEEK:
+        first = selected - timedelta(days=selected.weekday())
+        return first, first + timedelta(days=6)
+
+    first = selected.replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    return first, next_month - timedelta(days=1)
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def appointments_by_day(doctor_id, first, last):
+    """
+    {día: [citas]} para cada día del rango, con una sola consulta.
+    """
+    days = {first + timedelta(days=i): [] for i in range((last - first).days + 1)}
+
+    qs = (
+        Appointment.objects.filter(
+            doctor_id=doctor_id,
+            start_time__gte=_aware(first),
+            start_time__lt=_aware(last + timedelta(days=1)),
+        )
+        .select_related("patient__user")
+        .order_by("start_time", "id")
+    )
+    for appt in qs:
+        days[timezone.localtime(appt.start_time).date()].append(appt)
+    return days
+
+
+def calendar_weeks(days, first, last):
+    """
+    Filas de 7 días (lunes a domingo) para la vista de mes. Los días fuera
+    del rango van como (día, None).
+    """
+    start = first - timedelta(days=first.weekday())
+    end = last + timedelta(days=6 - last.weekday())
+
+    weeks, week = [], []
+    day = start
+    while day <= end:
+        week.append((day, days.get(day)))
+        if len(week) == 7:
+            weeks.append(week)
+            week = []
+        day += timedelta(days=1)
+    return weeks
+
+
+# ---------------------------
+# Conditional GET
+# ---------------------------
+
+def _conditional_state(request):
+    """
+    Retorna (habilitado, marcador). Se calcula una vez por petición porque
+    @condition llama a la función del ETag y a la de Last-Modified.
+    """
+    if not hasattr(request, "_agenda_state"):
+        enabled = get_role(request).is_doctor
+        # Un mensaje pendiente (messages framework) obliga a renderizar
+        if enabled and len(get_messages(request)):
+            enabled = False
+
+        marker = None
+        if enabled:
+            marker = (
+                AgendaMarker.objects.filter(doctor_id=request.user.id)
+                .values_list("changed_at", flat=True)
+                .first()
+            )
+        request._agenda_state = (enabled, marker)
+    return request._agenda_state
+
+
+def agenda_last_modified(request, period):
+    enabled, marker = _conditional_state(request)
+    return marker if enabled else None
+
+
+def agenda_etag(request, period):
+    enabled, marker = _conditional_state(request)
+    if not enabled:
+        return None
+
+    first, _ = agenda_range(period, request.GET.get("date"))
+    raw = f"{request.user.id}:{period}:{first}:{marker.isoformat() if marker else '-'}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
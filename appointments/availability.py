@@ -0,0 +1,216 @@
+"""
+Motor de disponibilidad por doctor.
+
+Cada día se representa como un entero de 288 bits (un bit por bloque de
+5 minutos desde la medianoche local). El horario de trabajo sale de
+WorkingHours y la ocupación de DoctorDayAvailability, que se construye a
+partir de las citas y se refresca por señales cuando una cita cambia.
+
+Buscar huecos es pura aritmética de bits sobre unos pocos enteros: no se
+recorre la tabla de citas.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Appointment, DoctorDayAvailability, WorkingHours
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = SLOTS_PER_DAY // 8
+
+# Si el doctor no tiene WorkingHours: lunes a viernes de 08:00 a 17:00
+DEFAULT_WORKING_HOURS = {weekday: [(time(8), time(17))] for weekday in range(5)}
+
+
+# ---------------------------
+# Bits
+# ---------------------------
+
+def span_mask(first, last):
+    """Bits [first, last)."""
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def to_bytes(mask):
+    return mask.to_bytes(BITMAP_BYTES, "little")
+
+
+def from_bytes(raw):
+    return int.from_bytes(bytes(raw), "little")
+
+
+def _runs(free, length):
+    """
+    Bit j queda en 1 si los bloques j .. j+length-1 están libres.
+    """
+    mask, span = free, 1
+    while span < length:
+        step = min(span, length - span)
+        mask &= mask >> step
+        span += step
+    return mask
+
+
+def _minute_slot(t, round_up=False):
+    seconds = (t.hour * 60 + t.minute) * 60 + t.second
+    slot, rest = divmod(seconds, SLOT_MINUTES * 60)
+    if round_up and (rest or t.microsecond):
+        slot += 1
+    return slot
+
+
+# ---------------------------
+# Días
+# ---------------------------
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def local_days(start, end):
+    """Días locales que toca el intervalo [start, end)."""
+    first = timezone.localtime(start).date()
+    last = timezone.localtime(end - timedelta(microseconds=1)).date()
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def _interval_mask(day, start, end):
+    begin = day_start(day)
+    finish = begin + timedelta(days=1)
+    start, end = max(start, begin), min(end, finish)
+    if end <= start:
+        return 0
+
+    first = _minute_slot(timezone.localtime(start))
+    last = SLOTS_PER_DAY if end == finish else _minute_slot(timezone.localtime(end), round_up=True)
+    return span_mask(first, last)
+
+
+def working_masks(doctor_id):
+    """
+    {weekday: bitmap} con el horario de trabajo del doctor.
+    """
+    hours = {}
+    for weekday, start, end in WorkingHours.objects.filter(doctor_id=doctor_id).values_list(
+        "weekday", "start", "end"
+    ):
+        hours.setdefault(weekday, []).append((start, end))
+
+    masks = {}
+    for weekday, ranges in (hours or DEFAULT_WORKING_HOURS).items():
+        mask = 0
+        for start, end in ranges:
+            mask |= span_mask(_minute_slot(start), _minute_slot(end, round_up=True))
+        masks[weekday] = mask
+    return masks
+
+
+# ---------------------------
+# Ocupación
+# ---------------------------
+
+def build_booked(doctor_id, days):
+    """
+    Calcula desde las citas el bitmap de ocupación de cada día (una consulta).
+    """
+    days = sorted(set(days))
+    if not days:
+        return {}
+
+    masks = {day: 0 for day in days}
+    rows = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        start_time__lt=day_start(days[-1] + timedelta(days=1)),
+        end_time__gt=day_start(days[0]),
+    ).exclude(status="CANCELLED").values_list("start_time", "end_time")
+
+    for start, end in rows:
+        for day in local_days(start, end):
+            if day in masks:
+                masks[day] |= _interval_mask(day, start, end)
+    return masks
+
+
+def refresh_days(doctor_id, days):
+    """
+    Recalcula y guarda la ocupación de los días indicados.
+    """
+    masks = build_booked(doctor_id, days)
+    DoctorDayAvailability.objects.bulk_create(
+        [
+            DoctorDayAvailability(doctor_id=doctor_id, day=day, booked=to_bytes(mask))
+            for day, mask in masks.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["doctor", "day"],
+        update_fields=["booked"],
+    )
+    return masks
+
+
+def booked_masks(doctor_id, date_from, date_to):
+    """
+    {day: bitmap} de ocupación. Los días que aún no existen se construyen
+    desde las citas y se guardan.
+    """
+    masks = {
+        day: from_bytes(raw)
+        for day, raw in DoctorDayAvailability.objects.filter(
+            doctor_id=doctor_id, day__range=(date_from, date_to)
+        ).values_list("day", "booked")
+    }
+
+    total = (date_to - date_from).days + 1
+    missing = [
+        date_from + timedelta(days=i)
+        for i in range(total)
+        if date_from + timedelta(days=i) not in masks
+    ]
+    if missing:
+        masks.update(refresh_days(doctor_id, missing))
+    return masks
+
+
+# ---------------------------
+# Búsqueda
+# ---------------------------
+
+def find_free_slots(doctor_id, date_from, date_to, length_minutes, limit=10, now=None):
+    """
+    Primeros `limit` huecos libres (sin solaparse entre sí) de
+    `length_minutes` para el doctor entre date_from y date_to (inclusive).
+    Retorna una lista de (inicio, fin) con datetimes aware.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    length = -(-length_minutes // SLOT_MINUTES)
+    if length <= 0 or length > SLOTS_PER_DAY:
+        return []
+
+    date_from = max(date_from, today)
+    if date_to < date_from:
+        return []
+
+    working = working_masks(doctor_id)
+    booked = booked_masks(doctor_id, date_from, date_to)
+
+    slots = []
+    day = date_from
+    while day <= date_to and len(slots) < limit:
+        free = working.get(day.weekday(), 0) & ~booked.get(day, 0)
+        if day == today:
+            free &= ~span_mask(0, _minute_slot(timezone.localtime(now), round_up=True))
+
+        starts = _runs(free, length)
+        begin = day_start(day)
+        while starts and len(slots) < limit:
+            first = (starts & -starts).bit_length() - 1
+            start = begin + timedelta(minutes=first * SLOT_MINUTES)
+            slots.append((start, start + timedelta(minutes=length_minutes)))
+            starts &= ~span_mask(0, first + length)
+
+        day += timedelta(days=1)
+    return slots
@@ -0,0 +1,141 @@
+"""
+Reserva de citas sin choques de horario.
+
+En PostgreSQL la regla la hace cumplir la base de datos con una restricción
+de exclusión (ver migraciones 0003 y 0014): se inserta directo y un choque
+llega como IntegrityError, en un solo viaje. En otros motores se bloquea la fila del
+doctor (select_for_update) y se revisa antes de guardar, dentro de la misma
+transacción. En SQLite el bloqueo lo da transaction_mode=IMMEDIATE en settings.
+
+Para lotes (find_conflicts) se trae de una vez todo el rango que cubre el
+lote y los choques se buscan en memoria con un barrido ordenado por inicio.
+"""
+import heapq
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+
+from .models import Appointment
+
+OVERLAP_CONSTRAINT = "appt_no_overlap"
+OVERLAP_ERROR = "Ya existe una cita que se cruza con ese horario."
+
+# Con qué choca cada intervalo en find_conflicts()
+APPOINTMENT = "appointment"
+ROW = "row"
+
+
+class OverlapError(Exception):
+    pass
+
+
+def db_enforces_overlap():
+    return connection.vendor == "postgresql"
+
+
+def overlapping(doctor_id, start, end, exclude_pk=None):
+    qs = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        start_time__lt=end,
+        end_time__gt=start,
+    ).exclude(status="CANCELLED")
+
+    if exclude_pk:
+        qs = qs.exclude(pk=exclude_pk)
+    return qs
+
+
+def _set_overlap_mode(mode):
+    if db_enforces_overlap():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET CONSTRAINTS {OVERLAP_CONSTRAINT} {mode}")
+
+
+def defer_overlap_check():
+    """
+    PostgreSQL: en esta transacción la restricción se revisa al final (en
+    check_overlap_now() o el COMMIT) y no fila por fila. Un UPDATE que corre
+    varias citas de una serie un periodo o más las cruza entre sí a mitad de
+    camino aunque el resultado final no choque.
+    """
+    _set_overlap_mode("DEFERRED")
+
+
+def check_overlap_now():
+    """
+    Revisa ya lo pendiente desde defer_overlap_check(); un choque llega aquí
+    como IntegrityError y no en el COMMIT.
+    """
+    _set_overlap_mode("IMMEDIATE")
+
+
+def lock_doctor(doctor_id):
+    """
+    Serializa las reservas del mismo doctor hasta el fin de la transacción.
+    """
+    list(get_user_model().objects.select_for_update().filter(pk=doctor_id).values_list("pk", flat=True))
+
+
+def find_conflicts(doctor_id, intervals, exclude_pks=()):
+    """
+    Choques de un lote: entre sus intervalos y con las citas no canceladas
+    del doctor (salvo `exclude_pks`). `intervals`: [(clave, start, end)].
+
+    Una sola consulta (citas entre el primer inicio y el último fin del lote)
+    y un barrido: ordenados por inicio, cada intervalo choca con los que
+    siguen abiertos (fin > su inicio). Retorna {clave: [(APPOINTMENT, pk) o
+    (ROW, clave)]} solo con las claves que chocan.
+    """
+    if not intervals:
+        return {}
+
+    first = min(start for _, start, _ in intervals)
+    last = max(end for _, _, end in intervals)
+    existing = overlapping(doctor_id, first, last)
+    if exclude_pks:
+        existing = existing.exclude(pk__in=list(exclude_pks))
+
+    events = [(start, end, ROW, key) for key, start, end in intervals]
+    events += [(start, end, APPOINTMENT, pk) for pk, start, end in existing.values_list("pk", "start_time", "end_time")]
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    conflicts = {}
+    active = []  # heap por fin: (end, orden, tipo, clave)
+    for order, (start, end, kind, key) in enumerate(events):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+
+        for _, _, other_kind, other in active:
+            if kind == ROW:
+                conflicts.setdefault(key, []).append((other_kind, other))
+            if other_kind == ROW:
+                conflicts.setdefault(other, []).append((kind, key))
+
+        heapq.heappush(active, (end, order, kind, key))
+    return conflicts
+
+
+def save_appointment(appt, **save_kwargs):
+    """
+    Guarda la cita. Lanza OverlapError si se cruza con otra cita no cancelada
+    del mismo doctor.
+    """
+    if db_enforces_overlap():
+        try:
+            with transaction.atomic():
+                appt.save(**save_kwargs)
+        except IntegrityError as exc:
+            if OVERLAP_CONSTRAINT in str(exc):
+                raise OverlapError() from exc
+            raise
+        return appt
+
+    with transaction.atomic():
+        if appt.status != "CANCELLED":
+            lock_doctor(appt.doctor_id)
+
+            if overlapping(appt.doctor_id, appt.start_time, appt.end_time, appt.pk).exists():
+                raise OverlapError()
+
+        appt.save(**save_kwargs)
+    return appt
@@ -0,0 +1,398 @@
+"""
+Citas por lote (API JSON de appointments).
+
+create_appointments() valida todas las filas, busca los choques de todo el
+lote con una consulta por rango y un barrido en memoria
+(booking.find_conflicts) y guarda las válidas con un solo bulk_create.
+update_statuses() cambia estados con un UPDATE por estado destino.
+transition() es el cambio masivo de la agenda: un solo UPDATE ... WHERE id IN
+(...) AND status IN (estados de origen permitidos). rollover() cierra las
+citas de días ya pasados por lotes (tarea rollover_past_appointments).
+
+bulk_create y update() no disparan las señales de Appointment, así que aquí
+mismo se actualiza lo que ellas mantienen: ocupación (availability), conteos
+del dashboard (stats), marcador de la agenda, versión de los fragmentos e
+índice de búsqueda.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from patients.models import Patient
+
+from . import availability, search, stats
+from .agenda import touch_agenda
+from .booking import APPOINTMENT, OVERLAP_CONSTRAINT, OverlapError, find_conflicts, lock_doctor
+from .models import ACTIVE_STATUSES, Appointment, AuditEvent
+from .utils import parse_date_or_none
+
+MAX_ROWS = 500
+STATUSES = {code for code, _ in Appointment.STATUS_CHOICES}
+
+READ_FIELDS = ("id", "patient_id", "doctor_id", "start_time", "end_time", "status", "reason")
+
+
+class BulkError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _rows(data, key):
+    rows = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(rows, list) or not rows:
+        raise BulkError(f"Falta la lista '{key}'.")
+    if len(rows) > MAX_ROWS:
+        raise BulkError(f"Máximo {MAX_ROWS} filas por lote.")
+    return rows
+
+
+def _datetime(value):
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        # Bien escrita pero imposible (2024-02-30T10:00)
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _conflict_messages(found):
+    return [
+        f"Se cruza con la cita #{key}." if kind == APPOINTMENT else f"Se cruza con la fila {key}."
+        for kind, key in found
+    ]
+
+
+def errors_list(errors):
+    return [{"row": row, "errors": messages} for row, messages in sorted(errors.items())]
+
+
+# ---------------------------
+# Lo que mantienen las señales
+# ---------------------------
+
+def sync_derived(changes):
+    """
+    changes: [(doctor_id, start, end, estado anterior, estado nuevo)]. None
+    como estado anterior es una cita nueva y como estado nuevo, una que deja
+    ese horario (una cita movida son dos cambios: sale y entra).
+    """
+    changes = [change for change in changes if change[3] != change[4]]
+    if not changes:
+        return
+
+    counts = Counter()
+    days = defaultdict(set)
+    for doctor_id, start, end, old_status, new_status in changes:
+        if old_status:
+            counts[stats.stats_key(doctor_id, start, old_status)] -= 1
+        if new_status:
+            counts[stats.stats_key(doctor_id, start, new_status)] += 1
+        # La ocupación solo cambia al entrar o salir de CANCELLED (o del horario)
+        if None in (old_status, new_status) or (old_status == "CANCELLED") != (new_status == "CANCELLED"):
+            days[doctor_id].update(availability.local_days(start, end))
+
+    for doctor_id, doctor_days in days.items():
+        availability.refresh_days(doctor_id, doctor_days)
+    stats.apply_counts(counts)
+    touch_agenda({change[0] for change in changes})
+
+
+# ---------------------------
+# Alta
+# ---------------------------
+
+def _clean_row(row):
+    """
+    Retorna (datos, errores) de una fila de create_appointments().
+    """
+    if not isinstance(row, dict):
+        return None, ["La fila debe ser un objeto."]
+
+    errors = []
+    patient_id = _int(row.get("patient"))
+    start = _datetime(row.get("start"))
+    end = _datetime(row.get("end"))
+    status = row.get("status") or "PENDING"
+    reason = row.get("reason") or ""
+
+    if not patient_id:
+        errors.append("Paciente inválido.")
+    if start is None or end is None:
+        errors.append("Fechas inválidas (ISO 8601).")
+    elif end <= start:
+        errors.append("La hora de fin debe ser mayor que la hora de inicio.")
+    if status not in STATUSES:
+        errors.append("Estado inválido.")
+    if not isinstance(reason, str) or len(reason) > 255:
+        errors.append("Motivo inválido (máximo 255 caracteres).")
+
+    if errors:
+        return None, errors
+    return {"patient_id": patient_id, "start_time": start, "end_time": end, "status": status, "reason": reason}, []
+
+
+def create_appointments(doctor_id, data):
+    """
+    data: {"appointments": [{patient, start, end, reason?, status?}], "atomic": bool}.
+    Con atomic, una sola fila con error hace que no se guarde ninguna.
+    Retorna (creadas [(fila, cita)], errores {fila: [mensajes]}).
+    """
+    rows = _rows(data, "appointments")
+    atomic = bool(data.get("atomic"))
+
+    valid, errors = {}, {}
+    for index, row in enumerate(rows):
+        cleaned, row_errors = _clean_row(row)
+        if row_errors:
+            errors[index] = row_errors
+        else:
+            valid[index] = cleaned
+
+    patient_ids = {cleaned["patient_id"] for cleaned in valid.values()}
+    existing_patients = set(Patient.objects.filter(pk__in=patient_ids).values_list("pk", flat=True))
+    for index, cleaned in list(valid.items()):
+        if cleaned["patient_id"] not in existing_patients:
+            errors[index] = ["El paciente no existe."]
+            del valid[index]
+
+    with transaction.atomic():
+        lock_doctor(doctor_id)
+
+        conflicts = find_conflicts(
+            doctor_id,
+            [(index, c["start_time"], c["end_time"]) for index, c in valid.items() if c["status"] != "CANCELLED"],
+        )
+        for index, found in conflicts.items():
+            errors[index] = _conflict_messages(found)
+            del valid[index]
+
+        if not valid or (atomic and errors):
+            return [], errors
+
+        rows_created = list(valid)
+        try:
+            with transaction.atomic():
+                created = Appointment.objects.bulk_create(
+                    [Appointment(doctor_id=doctor_id, **valid[index]) for index in rows_created]
+                )
+        except IntegrityError as exc:
+            # PostgreSQL: otra reserva entró entre la consulta y el INSERT
+            if OVERLAP_CONSTRAINT in str(exc):
+                raise OverlapError() from exc
+            raise
+
+        sync_derived([(doctor_id, a.start_time, a.end_time, None, a.status) for a in created])
+        search.index_appointments(created)
+
+    return list(zip(rows_created, created)), errors
+
+
+# ---------------------------
+# Cambios de estado
+# ---------------------------
+
+def update_statuses(doctor_id, data):
+    """
+    data: {"updates": [{id, status}]}. Solo citas del doctor. Retorna
+    (actualizadas [(id, estado anterior, estado nuevo)], errores {fila: [mensajes]}).
+    """
+    rows = _rows(data, "updates")
+
+    wanted, errors, seen = {}, {}, set()
+    for index, row in enumerate(rows):
+        pk = _int(row.get("id")) if isinstance(row, dict) else None
+        status = row.get("status") if isinstance(row, dict) else None
+        if not pk:
+            errors[index] = ["Id inválido."]
+        elif status not in STATUSES:
+            errors[index] = ["Estado inválido."]
+        elif pk in seen:
+            errors[index] = ["La cita está repetida en el lote."]
+        else:
+            wanted[index] = (pk, status)
+            seen.add(pk)
+
+    with transaction.atomic():
+        lock_doctor(doctor_id)
+
+        current = {
+            pk: (start, end, status)
+            for pk, start, end, status in Appointment.objects.filter(
+                doctor_id=doctor_id, pk__in=[pk for pk, _ in wanted.values()]
+            ).values_list("pk", "start_time", "end_time", "status")
+        }
+        for index, (pk, _) in list(wanted.items()):
+            if pk not in current:
+                errors[index] = ["La cita no existe o no es tuya."]
+                del wanted[index]
+
+        # Reactivar una cita cancelada puede chocar; las que se cancelan en
+        # este mismo lote ya no cuentan
+        cancelling = [pk for pk, status in wanted.values() if status == "CANCELLED"]
+        reactivating = {
+            pk: index
+            for index, (pk, status) in wanted.items()
+            if current[pk][2] == "CANCELLED" and status != "CANCELLED"
+        }
+        conflicts = find_conflicts(
+            doctor_id,
+            [(pk, current[pk][0], current[pk][1]) for pk in reactivating],
+            exclude_pks=cancelling,
+        )
+        for pk, found in conflicts.items():
+            index = reactivating[pk]
+            # Aquí las claves del lote también son ids de cita
+            errors[index] = _conflict_messages((APPOINTMENT, key) for _, key in found)
+            del wanted[index]
+
+        by_status = defaultdict(list)
+        for pk, status in wanted.values():
+            if current[pk][2] != status:
+                by_status[status].append(pk)
+
+        for status, pks in by_status.items():
+            Appointment.objects.filter(pk__in=pks).update(status=status, cache_version=F("cache_version") + 1)
+
+        sync_derived([(doctor_id, *current[pk], status) for pk, status in wanted.values()])
+
+    return [(pk, current[pk][2], status) for pk, status in wanted.values()], errors
+
+
+# ---------------------------
+# Transiciones masivas
+# ---------------------------
+
+# Estado destino: estados desde los que se permite llegar
+TRANSITIONS = {
+    "CONFIRMED": ("PENDING",),
+    "DONE": ("PENDING", "CONFIRMED"),
+    "CANCELLED": ("PENDING", "CONFIRMED"),
+}
+
+# Cierre de días pasados (todas las de ACTIVE_STATUSES): lo confirmado se da
+# por atendido y lo que nunca se confirmó, por cancelado
+ROLLOVER = {
+    "CONFIRMED": "DONE",
+    "PENDING": "CANCELLED",
+}
+ROLLOVER_BATCH_SIZE = 2000
+
+
+def transition(doctor_id, ids, status):
+    """
+    Pasa a `status` las citas `ids` del doctor que están en un estado de
+    origen permitido (TRANSITIONS). Retorna (cambiadas [(id, estado anterior)],
+    ids omitidos).
+    """
+    allowed_from = TRANSITIONS[status]
+    ids = set(ids)
+
+    with transaction.atomic():
+        # Desde cancelada no se llega a un estado activo, así que no hay
+        # choques que revisar; el bloqueo solo fija el estado anterior
+        qs = Appointment.objects.filter(doctor_id=doctor_id, pk__in=ids, status__in=allowed_from)
+        rows = list(qs.select_for_update().values_list("pk", "start_time", "end_time", "status"))
+        if rows:
+            qs.update(status=status, cache_version=F("cache_version") + 1)
+            sync_derived([(doctor_id, start, end, old, status) for _, start, end, old in rows])
+
+    changed = [(pk, old) for pk, _, _, old in rows]
+    return changed, ids - {pk for pk, _ in changed}
+
+
+def rollover_cutoff(now=None):
+    """
+    Inicio del día local de hoy: se cierran las citas de días anteriores.
+    """
+    return availability.day_start(timezone.localdate(now))
+
+
+def rollover_batch(cutoff, batch_size=ROLLOVER_BATCH_SIZE):
+    """
+    Cierra hasta `batch_size` citas activas que empiezan antes de `cutoff`
+    (índice parcial appt_active_start_idx) y deja un AuditEvent por cita,
+    todo en la misma transacción. Retorna cuántas cerró.
+    """
+    with transaction.atomic():
+        rows = list(
+            Appointment.objects.select_for_update()
+            .filter(status__in=ACTIVE_STATUSES, start_time__lt=cutoff)
+            .order_by("start_time", "id")
+            .values_list("pk", "doctor_id", "start_time", "end_time", "status")[:batch_size]
+        )
+
+        by_status = defaultdict(list)
+        for pk, _, _, _, old in rows:
+            by_status[old].append(pk)
+        for old, pks in by_status.items():
+            Appointment.objects.filter(pk__in=pks, status=old).update(
+                status=ROLLOVER[old], cache_version=F("cache_version") + 1
+            )
+
+        sync_derived([(doctor_id, start, end, old, ROLLOVER[old]) for _, doctor_id, start, end, old in rows])
+
+        now = timezone.now()
+        AuditEvent.objects.bulk_create(
+            [
+                AuditEvent(
+                    appointment_id=pk,
+                    action="STATUS",
+                    object_type="Appointment",
+                    object_id=pk,
+                    message=f"Cierre automático: {old} -> {ROLLOVER[old]}",
+                    created_at=now,
+                )
+                for pk, _, _, _, old in rows
+            ]
+        )
+
+    return len(rows)
+
+
+# ---------------------------
+# Lectura
+# ---------------------------
+
+def read_appointments(role, params):
+    """
+    Citas del doctor (o del paciente) por ?ids=1,2,3 o por ?from=&to=
+    (fechas locales, ambas incluidas). Máximo MAX_ROWS.
+    """
+    qs = Appointment.objects.order_by("start_time", "id")
+    if role.is_patient:
+        qs = qs.filter(patient_id=role.patient_id)
+    else:
+        qs = qs.filter(doctor_id=role.user_id)
+
+    ids = params.get("ids")
+    if ids:
+        pks = [_int(pk) for pk in ids.split(",")]
+        if not all(pks) or len(pks) > MAX_ROWS:
+            raise BulkError("Ids inválidos.")
+        qs = qs.filter(pk__in=pks)
+    else:
+        date_from = parse_date_or_none(params.get("from"))
+        date_to = parse_date_or_none(params.get("to")) or date_from
+        if date_from is None or date_to < date_from:
+            raise BulkError("Indica ids o un rango from/to válido.")
+        qs = qs.filter(
+            start_time__gte=availability.day_start(date_from),
+            start_time__lt=availability.day_start(date_to + timedelta(days=1)),
+        )
+
+    rows = list(qs.values(*READ_FIELDS)[:MAX_ROWS + 1])
+    return rows[:MAX_ROWS], len(rows) > MAX_ROWS
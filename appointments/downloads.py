@@ -0,0 +1,163 @@
+"""
+Entrega de archivos subidos (AppointmentFile / MedicalFile) después de
+validar permisos en la vista.
+
+Con MEDIA_ACCEL configurado, la vista solo responde headers y el servidor
+de adelante envía el archivo:
+- "nginx": X-Accel-Redirect a MEDIA_ACCEL_PREFIX + nombre en el storage
+  (location internal apuntando a MEDIA_ROOT).
+- "sendfile": X-Sendfile con la ruta absoluta (Apache / lighttpd).
+
+Sin MEDIA_ACCEL se usa FileResponse, que con gunicorn termina en
+os.sendfile(); los pedidos Range (un solo rango) responden 206 con solo esos
+bytes.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _RangeFile:
+    """
+    Lee solo `length` bytes desde la posición actual. Expone fileno() para
+    que el servidor WSGI use sendfile (respeta Content-Length).
+    """
+
+    def __init__(self, fh, length):
+        self.fh = fh
+        self.remaining = length
+        self.name = getattr(fh, "name", "")
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def close(self):
+        self.fh.close()
+
+
+def _content_disposition(filename, as_attachment):
+    kind = "attachment" if as_attachment else "inline"
+    return f"{kind}; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_range(header, size):
+    """
+    (inicio, fin) inclusivo para un header Range de un solo rango, None si
+    no aplica (se responde el archivo completo) o "invalid" si no se puede
+    satisfacer.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: los últimos N bytes
+        length = int(last)
+        if length == 0:
+            return "invalid"
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "invalid"
+    return start, end
+
+
+def _if_range_matches(request, etag, modified):
+    value = request.headers.get("If-Range")
+    if not value:
+        return True
+    if value.startswith(('"', "W/")):
+        return value == etag
+    since = parse_http_date_safe(value)
+    return since is not None and int(modified) <= since
+
+
+def serve_file(request, fieldfile, filename, etag=None, as_attachment=False):
+    storage = fieldfile.storage
+    name = fieldfile.name
+    mode = getattr(settings, "MEDIA_ACCEL", "")
+
+    if mode:
+        response = HttpResponse(content_type="")
+        del response["Content-Type"]  # lo pone el servidor de adelante
+        if mode == "nginx":
+            prefix = getattr(settings, "MEDIA_ACCEL_PREFIX", "/protected-media/")
+            response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(name)
+        else:
+            response["X-Sendfile"] = storage.path(name)
+        response["Content-Disposition"] = _content_disposition(filename, as_attachment)
+        response["Cache-Control"] = "private, max-age=0"
+        return response
+
+    size = fieldfile.size
+    try:
+        modified = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, OSError):
+        modified = None
+    etag = etag or f'"{size:x}-{int(modified or 0):x}"'
+
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+        response["ETag"] = etag
+        return response
+
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    byte_range = None
+    if modified is not None and _if_range_matches(request, etag, modified):
+        byte_range = parse_range(request.headers.get("Range", ""), size)
+
+    if byte_range == "invalid":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    fh = storage.open(name, "rb")
+    if byte_range:
+        start, end = byte_range
+        fh.seek(start)
+        response = FileResponse(_RangeFile(fh, end - start + 1), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        response = FileResponse(fh, content_type=content_type)
+        response["Content-Length"] = str(size)
+
+    response["Content-Disposition"] = _content_disposition(filename, as_attachment)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, max-age=0"
+    if modified is not None:
+        response["Last-Modified"] = http_date(modified)
+    return response
+
+
+def download_filename(obj):
+    """
+    Nombre para el navegador: el título con la extensión del archivo
+    (los blobs se guardan con su hash como nombre).
+    """
+    root, ext = os.path.splitext(os.path.basename(obj.file.name))
+    base = (obj.title or "").strip() or ("archivo" if obj.blob_id else root)
+    return f"{base}{ext}"
@@ -0,0 +1,166 @@
+"""
+Exportación del historial de citas en CSV o NDJSON.
+
+Las filas se leen con .iterator(chunk_size=...) y se escriben una a una en un
+StreamingHttpResponse, así la memoria no crece con el número de citas.
+"""
+import csv
+import json
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from prescriptions.models import Prescription
+
+from .search import filter_by_reason
+from .utils import parse_date_or_none
+
+EXPORT_CHUNK_SIZE = 2000
+
+CSV = "csv"
+NDJSON = "ndjson"
+CONTENT_TYPES = {
+    CSV: "text/csv; charset=utf-8",
+    NDJSON: "application/x-ndjson; charset=utf-8",
+}
+
+COLUMNS = [
+    "id",
+    "start_time",
+    "end_time",
+    "status",
+    "reason",
+    "patient_id",
+    "patient",
+    "patient_email",
+    "doctor_id",
+    "doctor",
+    "prescriptions",
+]
+
+ALLOWED_STATUS = {"PENDING", "CONFIRMED", "CANCELLED", "DONE"}
+
+# Excel / LibreOffice evalúan como fórmula una celda que empieza así
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def history_filters(request):
+    """
+    Filtros GET del historial: status, q, from, to.
+    """
+    return {
+        "status": (request.GET.get("status") or "").upper().strip(),
+        "q": (request.GET.get("q") or "").strip(),
+        "from": request.GET.get("from", ""),
+        "to": request.GET.get("to", ""),
+    }
+
+
+def apply_history_filters(qs, filters):
+    date_from = parse_date_or_none(filters["from"])
+    date_to = parse_date_or_none(filters["to"])
+
+    if filters["status"] in ALLOWED_STATUS:
+        qs = qs.filter(status=filters["status"])
+
+    if filters["q"]:
+        qs = filter_by_reason(qs, filters["q"])
+
+    if date_from:
+        qs = qs.filter(start_time__date__gte=date_from)
+
+    if date_to:
+        qs = qs.filter(start_time__date__lte=date_to)
+
+    return qs
+
+
+def export_queryset(qs):
+    """
+    Citas con paciente, doctor y número de recetas. El conteo va como
+    subconsulta para no agrupar por todas las columnas del JOIN.
+    """
+    rx_count = (
+        Prescription.objects.filter(appointment=OuterRef("pk"))
+        .order_by()
+        .values("appointment")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    return (
+        qs.select_related("patient__user", "doctor")
+        .only(
+            "id",
+            "start_time",
+            "end_time",
+            "status",
+            "reason",
+            "patient__id",
+            "patient__user__username",
+            "patient__user__first_name",
+            "patient__user__last_name",
+            "patient__user__email",
+            "doctor__id",
+            "doctor__username",
+            "doctor__first_name",
+            "doctor__last_name",
+        )
+        .annotate(rx_count=Coalesce(Subquery(rx_count, output_field=IntegerField()), 0))
+        .order_by("start_time", "id")
+    )
+
+
+def _row(appt):
+    return {
+        "id": appt.id,
+        "start_time": timezone.localtime(appt.start_time).isoformat(),
+        "end_time": timezone.localtime(appt.end_time).isoformat(),
+        "status": appt.status,
+        "reason": appt.reason,
+        "patient_id": appt.patient_id,
+        "patient": str(appt.patient),
+        "patient_email": appt.patient.user.email,
+        "doctor_id": appt.doctor_id,
+        "doctor": appt.doctor.get_full_name() or appt.doctor.username,
+        "prescriptions": appt.rx_count,
+    }
+
+
+class _Echo:
+    """
+    "Archivo" para csv.writer que retorna la línea en vez de guardarla.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    """
+    Texto libre (motivo, nombres) con un apóstrofo delante si la hoja de
+    cálculo lo tomaría como fórmula.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    # BOM para que Excel abra bien los acentos
+    yield "\ufeff" + writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([csv_cell(row[column]) for column in COLUMNS])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def stream_rows(qs, fmt):
+    rows = (_row(appt) for appt in export_queryset(qs).iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if fmt == NDJSON:
+        return _ndjson_lines(rows)
+    return _csv_lines(rows)
@@ -1,6 +1,9 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Appointment
+from django.utils import timezone
+from .booking import OVERLAP_ERROR, OverlapError, save_appointment
+from .models import Appointment, AppointmentSeries
+from .series import MAX_OCCURRENCES
 
 class AppointmentForm(forms.ModelForm):
     class Meta:
@@ -26,19 +29,78 @@ class AppointmentForm(forms.ModelForm):
         if end <= start:
             raise ValidationError("La hora de fin debe ser mayor que la hora de inicio.")
 
-        # Validar choques SOLO para el doctor (si lo pasamos)
+        # Los choques con otras citas se validan al guardar (save_booking),
+        # dentro de la misma transacción que el INSERT/UPDATE.
+        return cleaned
+
+    def save_booking(self):
+        """
+        Guarda la cita para self.doctor. Si se cruza con otra cita agrega el
+        error al formulario y retorna None.
+        """
+        appt = self.save(commit=False)
         if self.doctor:
-            overlaps = Appointment.objects.filter(
-                doctor=self.doctor,
-                start_time__lt=end,
-                end_time__gt=start,
-            )
+            appt.doctor = self.doctor
+
+        try:
+            return save_appointment(appt)
+        except OverlapError:
+            self.add_error(None, OVERLAP_ERROR)
+            return None
+
+
+class AppointmentSeriesForm(forms.ModelForm):
+    """
+    Serie de citas: la primera ocurrencia y la regla (frecuencia, y cantidad
+    o fecha límite). Las citas se crean con series.create_series.
+    """
+
+    skip_conflicts = forms.BooleanField(
+        label="Omitir fechas que chocan",
+        required=False,
+        help_text="Crea solo las ocurrencias libres en vez de rechazar la serie.",
+    )
+
+    class Meta:
+        model = AppointmentSeries
+        fields = ["patient", "start_time", "end_time", "frequency", "count", "until", "reason"]
+        widgets = {
+            "start_time": forms.DateTimeInput(attrs={"type": "datetime-local"}),
+            "end_time": forms.DateTimeInput(attrs={"type": "datetime-local"}),
+            "until": forms.DateInput(attrs={"type": "date"}),
+        }
+
+    def clean(self):
+        cleaned = super().clean()
+        start = cleaned.get("start_time")
+        end = cleaned.get("end_time")
+        count = cleaned.get("count")
+        until = cleaned.get("until")
+
+        if start and end and end <= start:
+            raise ValidationError("La hora de fin debe ser mayor que la hora de inicio.")
+        if count is None and not until:
+            raise ValidationError("Indica la cantidad de citas o la fecha límite.")
+        if count is not None and not 1 <= count <= MAX_OCCURRENCES:
+            self.add_error("count", f"Entre 1 y {MAX_OCCURRENCES} citas por serie.")
+        if start and until and until < timezone.localdate(start):
+            self.add_error("until", "La fecha límite no puede ser anterior a la primera cita.")
+        return cleaned
 
-            # Si estamos editando una cita, excluirla
-            if self.instance and self.instance.pk:
-                overlaps = overlaps.exclude(pk=self.instance.pk)
 
-            if overlaps.exists():
-                raise ValidationError("Ya existe una cita que se cruza con ese horario.")
+class SeriesFollowingForm(forms.Form):
+    """
+    Nueva hora y motivo para una ocurrencia y las siguientes.
+    """
 
+    start_time = forms.DateTimeField(label="Inicio", widget=forms.DateTimeInput(attrs={"type": "datetime-local"}))
+    end_time = forms.DateTimeField(label="Fin", widget=forms.DateTimeInput(attrs={"type": "datetime-local"}))
+    reason = forms.CharField(label="Motivo", required=False, max_length=255)
+
+    def clean(self):
+        cleaned = super().clean()
+        start = cleaned.get("start_time")
+        end = cleaned.get("end_time")
+        if start and end and end <= start:
+            raise ValidationError("La hora de fin debe ser mayor que la hora de inicio.")
         return cleaned
@@ -0,0 +1,103 @@
+"""
+Fragmentos cacheados del detalle de cita: notas, recetas y archivos.
+
+La clave de cada fragmento incluye Appointment.cache_version, que las señales
+suben cuando cambia la cita o alguna de sus notas, recetas o archivos. La
+versión viene en la misma consulta de la cita, así un fragmento viejo nunca
+se sirve aunque cada worker tenga su propia caché. Hay una variante para el
+doctor (con botones de eliminar) y otra para el paciente (solo notas
+visibles).
+
+El {% csrf_token %} de los fragmentos se guarda como CSRF_PLACEHOLDER y se
+reemplaza por el token de la petición al servirlos.
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from notes.models import ClinicalNote
+from prescriptions.models import AppointmentFile, Prescription
+
+from .models import Appointment
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+# Subir el sufijo cuando cambien las plantillas _detail_*.html
+KEY_PREFIX = "appt_fragment:v3"
+CSRF_PLACEHOLDER = "__csrf_token__"
+
+PATIENT = "patient"
+DOCTOR = "doctor"
+
+
+def bump_version(appointment_id):
+    Appointment.objects.filter(pk=appointment_id).update(cache_version=F("cache_version") + 1)
+
+
+def _notes(appointment, variant):
+    qs = ClinicalNote.objects.filter(appointment_id=appointment.id).select_related("author")
+    if variant == PATIENT:
+        qs = qs.filter(visible_to_patient=True)
+    return list(qs)
+
+
+def _prescriptions(appointment, variant):
+    return list(Prescription.objects.filter(appointment_id=appointment.id))
+
+
+def _files(appointment, variant):
+    return list(AppointmentFile.objects.filter(appointment_id=appointment.id))
+
+
+SECTIONS = {
+    "notes": ("appointments/_detail_notes.html", _notes),
+    "prescriptions": ("appointments/_detail_prescriptions.html", _prescriptions),
+    "files": ("appointments/_detail_files.html", _files),
+}
+
+
+def fragment_key(appointment, section, variant):
+    return f"{KEY_PREFIX}:{appointment.id}:{appointment.cache_version}:{section}:{variant}"
+
+
+def detail_sections(request, appointment, is_patient):
+    """
+    {sección: {"html": ..., "count": n}} para el detalle de la cita. Solo
+    consulta la base de datos por las secciones que no están en caché.
+    """
+    variant = PATIENT if is_patient else DOCTOR
+    keys = {section: fragment_key(appointment, section, variant) for section in SECTIONS}
+    cached = cache.get_many(keys.values())
+
+    sections, missing = {}, {}
+    for section, (template, load) in SECTIONS.items():
+        fragment = cached.get(keys[section])
+        if fragment is None:
+            items = load(appointment, variant)
+            fragment = {
+                "html": render_to_string(
+                    template,
+                    {
+                        "appointment": appointment,
+                        "is_patient": is_patient,
+                        "items": items,
+                        "csrf_token": CSRF_PLACEHOLDER,
+                    },
+                ),
+                "count": len(items),
+            }
+            missing[keys[section]] = fragment
+        sections[section] = fragment
+
+    if missing:
+        cache.set_many(missing, timeout=FRAGMENT_TIMEOUT)
+
+    token = get_token(request)
+    return {
+        section: {
+            "html": mark_safe(fragment["html"].replace(CSRF_PLACEHOLDER, token)),
+            "count": fragment["count"],
+        }
+        for section, fragment in sections.items()
+    }
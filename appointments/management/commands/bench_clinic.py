@@ -0,0 +1,244 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments import pdf_cache
+from appointments.models import Appointment
+from appointments.tasks import send_confirmations_24h
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide las vistas principales, el PDF de recetas y send_confirmations_24h "
+        "sobre los datos actuales (ver seed_clinic) y escribe los resultados en JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=10, help="Mediciones por escenario.")
+        parser.add_argument("--warmup", type=int, default=2, help="Ejecuciones previas no medidas.")
+        parser.add_argument("--only", nargs="*", help="Solo estos escenarios.")
+        parser.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout).")
+        parser.add_argument("--compare", help="JSON de una corrida anterior para comparar medianas.")
+
+    def handle(self, *args, **opts):
+        doctor_id, patient, appt = self._sample()
+
+        doctor_client = Client()
+        doctor_client.force_login(appt.doctor)
+        patient_client = Client()
+        patient_client.force_login(patient.user)
+
+        day = timezone.localdate(appt.start_time).isoformat()
+        scenarios = {
+            "my_appointments (doctor)": (doctor_client, reverse("my_appointments")),
+            "my_appointments (paciente)": (patient_client, reverse("my_appointments")),
+            "doctor_agenda": (doctor_client, f"{reverse('doctor_agenda')}?date={day}"),
+            "doctor_dashboard": (doctor_client, reverse("doctor_dashboard")),
+            "appointment_detail (doctor)": (doctor_client, reverse("appointment_detail", args=[appt.pk])),
+            "appointment_detail (paciente)": (patient_client, reverse("appointment_detail", args=[appt.pk])),
+            "patient_history": (patient_client, reverse("patient_history")),
+            "prescriptions_pdf (caché)": (doctor_client, reverse("appointment_prescriptions_pdf", args=[appt.pk])),
+            "prescriptions_pdf (sin caché)": (
+                doctor_client, reverse("appointment_prescriptions_pdf", args=[appt.pk]), appt.pk,
+            ),
+            "send_confirmations_24h": None,
+        }
+        if opts["only"]:
+            unknown = set(opts["only"]) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+            scenarios = {name: scenarios[name] for name in opts["only"]}
+
+        results = {}
+        with override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            SECURE_SSL_REDIRECT=False,
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+        ):
+            for name, scenario in scenarios.items():
+                if scenario is None:
+                    run = self._task_runner()
+                else:
+                    run = self._view_runner(*scenario)
+                results[name] = self._measure(run, opts["warmup"], opts["repeat"])
+                self.stderr.write(
+                    f"{name:32} mediana {results[name]['median_ms']:9.2f} ms  "
+                    f"p95 {results[name]['p95_ms']:9.2f} ms  {results[name]['queries']} consultas"
+                )
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "commit": _git_commit(),
+            "django": django.get_version(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "repeat": opts["repeat"],
+            "dataset": {
+                "appointments": Appointment.objects.count(),
+                "doctor_id": doctor_id,
+                "patient_id": patient.pk,
+                "appointment_id": appt.pk,
+            },
+            "results": results,
+        }
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as fh:
+                fh.write(output + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Resultados en {opts['output']}"))
+        else:
+            self.stdout.write(output)
+
+        if opts["compare"]:
+            self._compare(opts["compare"], results)
+
+    # ---------------------------
+    # Datos de muestra
+    # ---------------------------
+
+    def _sample(self):
+        """
+        Doctor con más citas y, de ese doctor, la cita con recetas más
+        reciente (para el detalle y el PDF).
+        """
+        top = (
+            Appointment.objects.values("doctor_id")
+            .annotate(total=Count("id"))
+            .order_by("-total")
+            .first()
+        )
+        if not top:
+            raise CommandError("No hay citas. Ejecuta primero seed_clinic.")
+
+        appt = (
+            Appointment.objects.filter(doctor_id=top["doctor_id"], prescriptions__isnull=False)
+            .select_related("doctor", "patient__user")
+            .order_by("-start_time")
+            .first()
+        ) or (
+            Appointment.objects.filter(doctor_id=top["doctor_id"])
+            .select_related("doctor", "patient__user")
+            .order_by("-start_time")
+            .first()
+        )
+        return top["doctor_id"], appt.patient, appt
+
+    # ---------------------------
+    # Ejecución
+    # ---------------------------
+
+    def _view_runner(self, client, url, invalidate_pdf=None):
+        def run():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} respondió {response.status_code}")
+            if getattr(response, "streaming", False):
+                return sum(len(chunk) for chunk in response.streaming_content)
+            return len(response.content)
+
+        if invalidate_pdf:
+            run.setup = lambda: pdf_cache.invalidate(invalidate_pdf)
+        return run
+
+    def _task_runner(self):
+        def setup():
+            # Las citas de la ventana de 24 h quedan sin recordatorio para
+            # que cada medición haga el mismo trabajo.
+            window = timezone.now() + timedelta(hours=24)
+            Appointment.objects.filter(
+                start_time__range=(window, window + timedelta(hours=1))
+            ).update(reminder_sent_at=None)
+
+        def run():
+            return send_confirmations_24h.run()
+
+        run.setup = setup
+        return run
+
+    def _measure(self, run, warmup, repeat):
+        for _ in range(warmup):
+            self._once(run)
+
+        timings, queries, size = [], 0, 0
+        for _ in range(repeat):
+            elapsed, queries, size = self._once(run)
+            timings.append(elapsed * 1000)
+
+        return {
+            "min_ms": round(min(timings), 3),
+            "median_ms": round(statistics.median(timings), 3),
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "p95_ms": round(_percentile(timings, 95), 3),
+            "max_ms": round(max(timings), 3),
+            "queries": queries,
+            "result": size,
+        }
+
+    def _once(self, run):
+        """
+        Ejecuta dentro de una transacción que se revierte, así la bitácora
+        y los recordatorios no cambian los datos entre mediciones.
+        """
+        outcome = {}
+        setup = getattr(run, "setup", None)
+        try:
+            with transaction.atomic():
+                if setup:
+                    setup()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    outcome["result"] = run()
+                    outcome["elapsed"] = time.perf_counter() - start
+                raise _Rollback
+        except _Rollback:
+            pass
+        return outcome["elapsed"], len(captured), outcome["result"]
+
+    def _compare(self, path, results):
+        with open(path, encoding="utf-8") as fh:
+            previous = json.load(fh).get("results", {})
+
+        self.stderr.write(f"\nComparación con {path} (mediana):")
+        for name, current in results.items():
+            before = previous.get(name)
+            if not before:
+                continue
+            delta = current["median_ms"] - before["median_ms"]
+            pct = delta / before["median_ms"] * 100 if before["median_ms"] else 0.0
+            self.stderr.write(
+                f"{name:32} {before['median_ms']:9.2f} -> {current['median_ms']:9.2f} ms "
+                f"({pct:+.1f}%)  consultas {before['queries']} -> {current['queries']}"
+            )
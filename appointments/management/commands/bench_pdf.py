@@ -0,0 +1,229 @@
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from appointments.management.commands.bench_clinic import _percentile
+from appointments.models import Appointment
+from appointments.pdf import item, prescriptions_data, render_prescriptions
+from patients.models import Patient
+from prescriptions.models import Prescription
+
+
+class _Rollback(Exception):
+    pass
+
+
+def legacy_build_prescriptions_pdf(appointment):
+    """
+    Copia del render anterior (consulta las recetas, redibuja todo en cada
+    página y copia el BytesIO con getvalue()). Solo para comparar.
+    """
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+
+    y = height - 50
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, f"Receta médica - Cita #{appointment.id}")
+    y -= 22
+
+    c.setFont("Helvetica", 11)
+    c.drawString(50, y, f"Paciente: {appointment.patient}")
+    y -= 16
+    c.drawString(50, y, f"Fecha: {appointment.start_time.strftime('%Y-%m-%d %H:%M')}")
+    y -= 22
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, y, "Medicamentos:")
+    y -= 18
+
+    c.setFont("Helvetica", 10)
+
+    prescriptions = appointment.prescriptions.all().order_by("-created_at")
+
+    if not prescriptions:
+        c.drawString(60, y, "No hay medicamentos registrados.")
+        y -= 14
+    else:
+        for p in prescriptions:
+            med = p.medication or "—"
+            dosage = p.dosage or "—"
+            freq = p.frequency or "—"
+            dur = p.duration or "—"
+
+            c.drawString(60, y, f"- {med}")
+            y -= 14
+            c.drawString(80, y, f"Dosis: {dosage} | Frecuencia: {freq} | Duración: {dur}")
+            y -= 18
+
+            if y < 80:
+                c.showPage()
+                y = height - 50
+                c.setFont("Helvetica", 10)
+
+    c.showPage()
+    c.save()
+
+    pdf = buffer.getvalue()
+    buffer.close()
+    return pdf
+
+
+def _rows(appointment_ids):
+    by_appointment = {pk: [] for pk in appointment_ids}
+    rows = (
+        Prescription.objects.filter(appointment_id__in=appointment_ids)
+        .order_by("-created_at")
+        .values_list("appointment_id", "medication", "dosage", "frequency", "duration")
+    )
+    for appointment_id, *fields in rows:
+        by_appointment[appointment_id].append(item(*fields))
+    return by_appointment
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el render de recetas en PDF con el anterior: renders por "
+        "segundo, consultas y memoria pico (tracemalloc). Usa datos propios "
+        "dentro de una transacción que se revierte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=100, help="Mediciones por escenario.")
+        parser.add_argument("--warmup", type=int, default=10, help="Ejecuciones previas no medidas.")
+        parser.add_argument("--items", type=int, default=6, help="Recetas por cita.")
+        parser.add_argument("--day", type=int, default=40, help="Citas en el escenario del día.")
+        parser.add_argument("--output", help="Archivo JSON de salida.")
+
+    def handle(self, *args, **opts):
+        results = {}
+        try:
+            with transaction.atomic():
+                appointments = self._dataset(opts["day"], opts["items"])
+                one = appointments[:1]
+                for name, run in self._scenarios(one, appointments, opts["day"]).items():
+                    results[name] = self._measure(run, opts["warmup"], opts["repeat"])
+                    r = results[name]
+                    self.stderr.write(
+                        f"{name:30} {r['renders_per_second']:9.1f} renders/s  mediana {r['median_ms']:8.2f} ms  "
+                        f"pico {r['peak_kib']:8.1f} KiB  {r['queries']} consultas"
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        if opts["output"]:
+            report = {
+                "created_at": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "repeat": opts["repeat"],
+                "items": opts["items"],
+                "day": opts["day"],
+                "results": results,
+            }
+            with open(opts["output"], "w", encoding="utf-8") as fh:
+                json.dump(report, fh, indent=2, ensure_ascii=False)
+                fh.write("\n")
+            self.stderr.write(self.style.SUCCESS(f"Resultados en {opts['output']}"))
+
+    def _dataset(self, day, items):
+        password = make_password(None)
+        doctor = User.objects.create(username="bench_pdf_doc", password=password)
+        user = User.objects.create(username="bench_pdf_pat", first_name="Paciente", last_name="Prueba", password=password)
+        patient = Patient.objects.create(user=user)
+
+        start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        appointments = Appointment.objects.bulk_create(
+            Appointment(
+                patient=patient,
+                doctor=doctor,
+                start_time=start + timedelta(minutes=30 * i),
+                end_time=start + timedelta(minutes=30 * i + 30),
+                reason="Control",
+            )
+            for i in range(day)
+        )
+        Prescription.objects.bulk_create(
+            Prescription(
+                appointment=appt,
+                medication=f"Medicamento {k}",
+                dosage="500 mg",
+                frequency="cada 8 horas",
+                duration="7 días",
+            )
+            for appt in appointments
+            for k in range(items)
+        )
+        return list(
+            Appointment.objects.filter(pk__in=[a.pk for a in appointments])
+            .select_related("patient__user")
+            .order_by("start_time")
+        )
+
+    def _scenarios(self, one, day, size):
+        ids = [appt.pk for appt in day]
+
+        def legacy_one():
+            return len(legacy_build_prescriptions_pdf(one[0]))
+
+        def new_one():
+            rows = _rows([one[0].pk])
+            with render_prescriptions([prescriptions_data(one[0], rows[one[0].pk])]) as fh:
+                return fh.seek(0, 2)
+
+        def legacy_day():
+            return sum(len(legacy_build_prescriptions_pdf(appt)) for appt in day)
+
+        def new_day():
+            rows = _rows(ids)
+            datas = [prescriptions_data(appt, rows[appt.pk]) for appt in day]
+            with render_prescriptions(datas) as fh:
+                return fh.seek(0, 2)
+
+        return {
+            "una receta (anterior)": legacy_one,
+            "una receta (nuevo)": new_one,
+            f"día de {size} (anterior)": legacy_day,
+            f"día de {size} (nuevo)": new_day,
+        }
+
+    def _measure(self, run, warmup, repeat):
+        for _ in range(warmup):
+            run()
+
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                size = run()
+                timings.append(time.perf_counter() - start)
+
+        # Memoria aparte: tracemalloc hace más lento cada render
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        median = statistics.median(timings)
+        return {
+            "renders_per_second": round(1 / median, 1),
+            "median_ms": round(median * 1000, 3),
+            "p95_ms": round(_percentile(timings, 95) * 1000, 3),
+            "peak_kib": round(peak / 1024, 1),
+            "queries": len(captured),
+            "bytes": size,
+        }
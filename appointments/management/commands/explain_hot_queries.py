@@ -0,0 +1,127 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from appointments.booking import overlapping
+from appointments.models import ACTIVE_STATUSES, Appointment
+
+
+def _hot_queries(sample):
+    """
+    Consultas que hacen las vistas y tareas más usadas, con valores reales
+    tomados de una cita de ejemplo.
+    """
+    now = timezone.now()
+    day = timezone.localdate(sample.start_time)
+    start_day = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+    end_day = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.max.time()))
+
+    return [
+        (
+            "doctor_agenda",
+            Appointment.objects.filter(
+                doctor_id=sample.doctor_id,
+                start_time__range=(start_day, end_day),
+            ).order_by("start_time"),
+        ),
+        (
+            "doctor_dashboard (próximas)",
+            Appointment.objects.filter(
+                doctor_id=sample.doctor_id,
+                start_time__gte=now,
+            ).order_by("start_time")[:10],
+        ),
+        (
+            # La misma consulta que arma booking.overlapping() al editar la cita
+            "AppointmentForm.clean (choques)",
+            overlapping(sample.doctor_id, sample.start_time, sample.end_time, sample.pk)[:1],
+        ),
+        (
+            "patient_history",
+            Appointment.objects.filter(
+                patient_id=sample.patient_id,
+                start_time__lt=now,
+            ).order_by("-start_time", "-id")[:11],
+        ),
+        (
+            "my_appointments (paciente)",
+            Appointment.objects.filter(
+                patient_id=sample.patient_id,
+            ).order_by("-start_time", "-id")[:26],
+        ),
+        (
+            "my_appointments (staff)",
+            Appointment.objects.order_by("-start_time", "-id")[:26],
+        ),
+        (
+            "send_confirmations_24h",
+            Appointment.objects.filter(
+                status__in=ACTIVE_STATUSES,
+                start_time__range=(now + timedelta(hours=24), now + timedelta(hours=25)),
+            ),
+        ),
+    ]
+
+
+def _is_sequential_scan(plan, table):
+    """
+    Detecta un recorrido completo de la tabla en la salida de EXPLAIN.
+    PostgreSQL: "Seq Scan on <tabla>". SQLite: "SCAN <tabla>" sin "USING ... INDEX".
+    """
+    table = re.escape(table)
+    if re.search(rf"Seq Scan on {table}\b", plan):
+        return True
+    for line in plan.splitlines():
+        if re.search(rf"\bSCAN {table}\b", line) and "INDEX" not in line:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta EXPLAIN sobre las consultas más usadas de citas y falla si alguna "
+        "recorre la tabla completa. Usar sobre una base de datos con datos (seed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Actualiza las estadísticas (ANALYZE) antes de pedir los planes.",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Muestra el plan completo de cada consulta.",
+        )
+
+    def handle(self, *args, **options):
+        table = Appointment._meta.db_table
+
+        sample = Appointment.objects.order_by("-start_time").first()
+        if sample is None:
+            raise CommandError("No hay citas; carga datos antes de revisar los planes.")
+
+        if options["analyze"]:
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+
+        failures = []
+        for name, qs in _hot_queries(sample):
+            plan = qs.explain()
+            if options["verbose_plans"]:
+                self.stdout.write(f"--- {name}\n{plan}")
+
+            if _is_sequential_scan(plan, table):
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"SEQ SCAN  {name}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK        {name}"))
+
+        if failures:
+            raise CommandError(
+                "Consultas sin índice: " + ", ".join(failures)
+            )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointments import stats
+
+
+class Command(BaseCommand):
+    help = "Recalcula DoctorDailyStats a partir de las citas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctor", type=int, help="Solo el doctor con este id.")
+
+    def handle(self, *args, **options):
+        stats.rebuild(doctor_id=options["doctor"])
+        self.stdout.write(self.style.SUCCESS("Estadísticas recalculadas."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointments import search
+
+
+class Command(BaseCommand):
+    help = "Regenera el índice de búsqueda (motivos, notas y recetas)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctor", type=int, help="Solo las citas del doctor con este id.")
+
+    def handle(self, *args, **options):
+        total = search.rebuild(doctor_id=options["doctor"])
+        self.stdout.write(self.style.SUCCESS(f"{total} entradas indexadas."))
@@ -0,0 +1,255 @@
+import hashlib
+import random
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from appointments import search, stats, uploads
+from appointments.agenda import touch_agenda
+from appointments.models import Appointment, StoredBlob
+from notes.models import ClinicalNote
+from patients.models import Patient
+from prescriptions.models import AppointmentFile, Prescription
+
+SLOT_MINUTES = 30
+DAY_START = time(8, 0)
+SLOTS_PER_DAY = 18  # 08:00 - 17:00
+
+FIRST_NAMES = ["Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Pedro", "Sofía", "Diego"]
+LAST_NAMES = ["García", "Pérez", "López", "Sánchez", "Ramírez", "Torres", "Flores", "Rivera", "Gómez", "Díaz"]
+REASONS = ["Control", "Dolor de cabeza", "Chequeo anual", "Resultados de laboratorio", "Fiebre", "Seguimiento", ""]
+MEDICATIONS = ["Paracetamol", "Ibuprofeno", "Amoxicilina", "Omeprazol", "Loratadina", "Metformina"]
+NOTES = [
+    "Paciente estable, continuar tratamiento.",
+    "Se solicitan exámenes de control.",
+    "Presión arterial dentro de rangos normales.",
+    "Refiere mejoría desde la última consulta.",
+]
+
+# Estados de citas pasadas y futuras (pesos relativos)
+PAST_STATUSES = (["DONE", "CANCELLED", "CONFIRMED"], [80, 15, 5])
+FUTURE_STATUSES = (["PENDING", "CONFIRMED", "CANCELLED"], [55, 35, 10])
+
+# Un solo blob (appointments.uploads) compartido por todos los archivos
+SEED_FILE_NAME = "archivo.pdf"
+SEED_FILE_CONTENT = b"%PDF-1.4\n% archivo de prueba\n"
+SEED_PASSWORD = "seed1234"
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sintéticos (doctores, pacientes, citas, notas, recetas y "
+        "archivos) con bulk_create para reproducir volúmenes de producción."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=20)
+        parser.add_argument("--patients", type=int, default=5000)
+        parser.add_argument("--appointments", type=int, default=100_000)
+        parser.add_argument("--days-back", type=int, default=730, help="Días hacia atrás desde hoy.")
+        parser.add_argument("--days-ahead", type=int, default=90, help="Días hacia adelante desde hoy.")
+        parser.add_argument("--notes-ratio", type=float, default=0.6, help="Fracción de citas DONE con nota.")
+        parser.add_argument("--prescriptions-ratio", type=float, default=0.4, help="Fracción de citas DONE con recetas.")
+        parser.add_argument("--files-ratio", type=float, default=0.05, help="Fracción de citas DONE con archivo.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--prefix", default="seed", help="Prefijo de los usernames generados.")
+        parser.add_argument("--seed", type=int, default=42, help="Semilla del generador aleatorio.")
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts["seed"])
+        prefix = opts["prefix"]
+
+        if User.objects.filter(username__startswith=f"{prefix}_").exists():
+            raise CommandError(f"Ya existen usuarios con el prefijo '{prefix}_'. Usa otro --prefix.")
+
+        days = opts["days_back"] + opts["days_ahead"]
+        capacity = opts["doctors"] * days * SLOTS_PER_DAY
+        if opts["doctors"] < 1 or opts["patients"] < 1:
+            raise CommandError("Se necesita al menos un doctor y un paciente.")
+        if opts["appointments"] > capacity:
+            raise CommandError(
+                f"{opts['appointments']} citas no caben en {opts['doctors']} doctores x {days} días "
+                f"(máximo {capacity}). Aumenta --doctors o --days-back."
+            )
+
+        # Un solo hash para todos: make_password por usuario tomaría minutos
+        password = make_password(SEED_PASSWORD)
+
+        doctor_ids = self._create_users(rng, prefix, "doc", opts["doctors"], password, is_staff=True)
+        patient_user_ids = self._create_users(rng, prefix, "pat", opts["patients"], password)
+        patient_ids = self._create_patients(rng, patient_user_ids, opts["batch_size"])
+        self.stdout.write(f"{len(doctor_ids)} doctores y {len(patient_ids)} pacientes creados.")
+
+        # La referencia que toma store_blob se suelta al final: quedan solo
+        # las de los archivos creados (y si no hubo ninguno, se borra)
+        blob, _ = uploads.store_blob(
+            ContentFile(SEED_FILE_CONTENT),
+            hashlib.sha256(SEED_FILE_CONTENT).hexdigest(),
+            len(SEED_FILE_CONTENT),
+            SEED_FILE_NAME,
+        )
+        try:
+            totals = self._create_appointments(rng, doctor_ids, patient_ids, blob, opts)
+        finally:
+            uploads.release_blob(blob.pk)
+
+        for doctor_id in doctor_ids:
+            stats.rebuild(doctor_id=doctor_id)
+            search.rebuild(doctor_id=doctor_id)
+        touch_agenda(doctor_ids)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Listo: {appointments} citas, {notes} notas, {prescriptions} recetas, "
+                "{files} archivos. Contraseña: {password}".format(
+                    password=SEED_PASSWORD,
+                    **{key: totals[key] for key in ("appointments", "notes", "prescriptions", "files")},
+                )
+            )
+        )
+
+    # ---------------------------
+    # Usuarios
+    # ---------------------------
+
+    def _create_users(self, rng, prefix, kind, count, password, is_staff=False):
+        users = [
+            User(
+                username=f"{prefix}_{kind}_{i}",
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                email=f"{prefix}_{kind}_{i}@example.com",
+                password=password,
+                is_staff=is_staff,
+            )
+            for i in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=1000)
+        # Algunos backends no retornan pk en bulk_create
+        return list(
+            User.objects.filter(username__startswith=f"{prefix}_{kind}_").order_by("id").values_list("id", flat=True)
+        )
+
+    def _create_patients(self, rng, user_ids, batch_size):
+        today = timezone.localdate()
+        Patient.objects.bulk_create(
+            (
+                Patient(
+                    user_id=user_id,
+                    phone=f"9{rng.randrange(10**7, 10**8)}",
+                    birth_date=today - timedelta(days=rng.randrange(365 * 5, 365 * 90)),
+                )
+                for user_id in user_ids
+            ),
+            batch_size=batch_size,
+        )
+        return list(Patient.objects.filter(user_id__in=user_ids).values_list("id", flat=True))
+
+    # ---------------------------
+    # Citas
+    # ---------------------------
+
+    def _slots(self, rng, doctor_count, days, total):
+        """
+        Reparte `total` citas entre los doctores en slots de 30 minutos
+        distintos, así ninguna cita de un doctor se cruza con otra.
+        Genera (índice de doctor, día, slot) ordenado por doctor.
+        """
+        per_doctor = [total // doctor_count] * doctor_count
+        for i in range(total % doctor_count):
+            per_doctor[i] += 1
+
+        for index, count in enumerate(per_doctor):
+            for slot in sorted(rng.sample(range(days * SLOTS_PER_DAY), count)):
+                yield index, *divmod(slot, SLOTS_PER_DAY)
+
+    def _create_appointments(self, rng, doctor_ids, patient_ids, blob, opts):
+        now = timezone.now()
+        first_day = timezone.localdate() - timedelta(days=opts["days_back"])
+        days = opts["days_back"] + opts["days_ahead"]
+        tz = timezone.get_current_timezone()
+
+        totals = Counter()
+        batch = []
+        for doctor_index, day_offset, slot in self._slots(rng, len(doctor_ids), days, opts["appointments"]):
+            day = first_day + timedelta(days=day_offset)
+            start = timezone.make_aware(datetime.combine(day, DAY_START), tz) + timedelta(minutes=slot * SLOT_MINUTES)
+
+            statuses, weights = PAST_STATUSES if start < now else FUTURE_STATUSES
+            batch.append(
+                Appointment(
+                    doctor_id=doctor_ids[doctor_index],
+                    patient_id=rng.choice(patient_ids),
+                    start_time=start,
+                    end_time=start + timedelta(minutes=rng.choice((15, 20, 30))),
+                    status=rng.choices(statuses, weights)[0],
+                    reason=rng.choice(REASONS),
+                    reminder_sent_at=start - timedelta(hours=24) if start < now else None,
+                )
+            )
+            if len(batch) >= opts["batch_size"]:
+                totals += self._flush(rng, batch, blob, opts)
+                batch = []
+                self.stdout.write(f"  {totals['appointments']} citas...")
+
+        if batch:
+            totals += self._flush(rng, batch, blob, opts)
+        return totals
+
+    def _flush(self, rng, batch, blob, opts):
+        """
+        Inserta un lote de citas y sus notas, recetas y archivos.
+        """
+        with transaction.atomic():
+            created = Appointment.objects.bulk_create(batch)
+            if created and created[0].pk is None:
+                raise CommandError("El backend de base de datos no retorna ids en bulk_create.")
+
+            notes, prescriptions, files = [], [], []
+            for appt in created:
+                if appt.status != "DONE":
+                    continue
+                if rng.random() < opts["notes_ratio"]:
+                    notes.append(
+                        ClinicalNote(
+                            appointment_id=appt.pk,
+                            author_id=appt.doctor_id,
+                            content=rng.choice(NOTES),
+                            visible_to_patient=rng.random() < 0.5,
+                        )
+                    )
+                if rng.random() < opts["prescriptions_ratio"]:
+                    for _ in range(rng.randint(1, 3)):
+                        prescriptions.append(
+                            Prescription(
+                                appointment_id=appt.pk,
+                                medication=rng.choice(MEDICATIONS),
+                                dosage=f"{rng.choice((250, 500, 1000))} mg",
+                                frequency=f"Cada {rng.choice((6, 8, 12, 24))} horas",
+                                duration=f"{rng.randint(3, 14)} días",
+                                created_at=appt.end_time,
+                            )
+                        )
+                if rng.random() < opts["files_ratio"]:
+                    f = AppointmentFile(
+                        appointment_id=appt.pk, title="Resultado de laboratorio", created_at=appt.end_time
+                    )
+                    uploads.attach_blob(f, blob)
+                    files.append(f)
+
+            ClinicalNote.objects.bulk_create(notes)
+            Prescription.objects.bulk_create(prescriptions)
+            AppointmentFile.objects.bulk_create(files)
+            # Una referencia por archivo (bulk_create no pasa por store_blob)
+            StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + len(files))
+
+        return Counter(
+            appointments=len(created), notes=len(notes), prescriptions=len(prescriptions), files=len(files)
+        )
@@ -0,0 +1,24 @@
+import logging
+
+from .utils import AUDIT_BUFFER_ATTR, flush_audit_events
+
+logger = logging.getLogger(__name__)
+
+
+class AuditMiddleware:
+    """
+    Guarda al final de cada petición los eventos que acumuló log_action().
+    Un error al guardarlos queda en el log y no cambia la respuesta.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            try:
+                flush_audit_events(getattr(request, AUDIT_BUFFER_ATTR, None))
+            except Exception:
+                logger.exception("No se pudo guardar la bitácora de %s", request.path)
@@ -0,0 +1,78 @@
+# Generated by Django 6.0 on 2026-10-18 19:40
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+# Solo PostgreSQL: ningún doctor puede tener dos citas no canceladas que se
+# crucen. En otros motores la validación la hace appointments.booking.
+CREATE_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    """
+    ALTER TABLE appointments_appointment
+        ADD CONSTRAINT appt_no_overlap
+        EXCLUDE USING gist (
+            doctor_id WITH =,
+            tstzrange(start_time, end_time) WITH &&
+        )
+        WHERE (status <> 'CANCELLED')
+    """,
+]
+
+DROP_SQL = "ALTER TABLE appointments_appointment DROP CONSTRAINT IF EXISTS appt_no_overlap"
+
+
+# Cuántos choques se listan en el error
+MAX_REPORTED = 50
+
+
+def overlapping_rows(apps):
+    """
+    Citas no canceladas que ya se cruzan con otra del mismo doctor: con
+    ellas el ALTER TABLE fallaría sin decir cuáles son.
+    """
+    Appointment = apps.get_model("appointments", "Appointment")
+    active = Appointment.objects.exclude(status="CANCELLED")
+    clashes = active.filter(
+        doctor_id=OuterRef("doctor_id"),
+        start_time__lt=OuterRef("end_time"),
+        end_time__gt=OuterRef("start_time"),
+    ).exclude(pk=OuterRef("pk"))
+    return (
+        active.filter(Exists(clashes))
+        .order_by("doctor_id", "start_time", "pk")
+        .values_list("pk", "doctor_id", "start_time", "end_time")
+    )
+
+
+def add_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        rows = list(overlapping_rows(apps)[:MAX_REPORTED + 1])
+        if rows:
+            lines = [
+                f"  cita #{pk} doctor {doctor_id}: {start:%Y-%m-%d %H:%M} - {end:%H:%M}"
+                for pk, doctor_id, start, end in rows[:MAX_REPORTED]
+            ]
+            if len(rows) > MAX_REPORTED:
+                lines.append("  ...")
+            raise RuntimeError(
+                "Hay citas no canceladas que se cruzan; cancela o mueve una de cada par "
+                "y vuelve a migrar:\n" + "\n".join(lines)
+            )
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def remove_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_constraint, remove_constraint),
+    ]
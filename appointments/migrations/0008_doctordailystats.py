@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-18 19:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def populate_stats(apps, schema_editor):
+    Appointment = apps.get_model("appointments", "Appointment")
+    DoctorDailyStats = apps.get_model("appointments", "DoctorDailyStats")
+
+    rows = (
+        Appointment.objects.annotate(day=TruncDate("start_time"))
+        .values("doctor_id", "day", "status")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    DoctorDailyStats.objects.bulk_create(
+        [
+            DoctorDailyStats(doctor_id=r["doctor_id"], day=r["day"], status=r["status"], count=r["total"])
+            for r in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_auditevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('CONFIRMED', 'Confirmada'), ('CANCELLED', 'Cancelada'), ('DONE', 'Finalizada')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day', 'status'), name='daily_stats_doctor_day_status_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
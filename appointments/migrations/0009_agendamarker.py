@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_doctordailystats'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaMarker',
+            fields=[
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='agenda_marker', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('changed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
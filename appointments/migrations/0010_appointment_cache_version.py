@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_agendamarker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='cache_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 6.0 on 2026-10-18 19:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLE = "appointments_searchentry"
+FTS_TABLE = "appointments_searchentry_fts"
+
+# PostgreSQL: tsvector generado en español + GIN
+POSTGRES_SQL = [
+    f"""
+    ALTER TABLE {TABLE}
+        ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('spanish', body)) STORED
+    """,
+    f"CREATE INDEX search_entry_vector_gin ON {TABLE} USING gin (search_vector)",
+]
+POSTGRES_DROP_SQL = [
+    "DROP INDEX IF EXISTS search_entry_vector_gin",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+# SQLite: FTS5 con contenido externo; los triggers la sincronizan con la tabla.
+# Si una migración futura reconstruye la tabla (ALTER en SQLite), hay que
+# volver a crear los triggers.
+SQLITE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        body, content='{TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {TABLE}_au AFTER UPDATE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+]
+SQLITE_DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_index(apps, schema_editor):
+    _run(schema_editor, {"postgresql": POSTGRES_SQL, "sqlite": SQLITE_SQL})
+
+
+def drop_index(apps, schema_editor):
+    _run(schema_editor, {"postgresql": POSTGRES_DROP_SQL, "sqlite": SQLITE_DROP_SQL})
+
+
+def backfill(apps, schema_editor):
+    Appointment = apps.get_model("appointments", "Appointment")
+    ClinicalNote = apps.get_model("notes", "ClinicalNote")
+    Prescription = apps.get_model("prescriptions", "Prescription")
+    SearchEntry = apps.get_model("appointments", "SearchEntry")
+
+    def entries():
+        for appt in Appointment.objects.exclude(reason="").only("id", "reason").iterator(chunk_size=1000):
+            yield SearchEntry(kind="reason", object_id=appt.pk, appointment_id=appt.pk, body=appt.reason)
+        for note in ClinicalNote.objects.iterator(chunk_size=1000):
+            yield SearchEntry(
+                kind="note",
+                object_id=note.pk,
+                appointment_id=note.appointment_id,
+                body=note.content,
+                visible_to_patient=note.visible_to_patient,
+            )
+        for rx in Prescription.objects.iterator(chunk_size=1000):
+            parts = [rx.medication, rx.dosage, rx.frequency, rx.duration, rx.notes]
+            body = " ".join(part for part in parts if part)
+            yield SearchEntry(kind="medication", object_id=rx.pk, appointment_id=rx.appointment_id, body=body)
+
+    batch = []
+    for entry in entries():
+        if not entry.body.strip():
+            continue
+        batch.append(entry)
+        if len(batch) >= 1000:
+            SearchEntry.objects.bulk_create(batch)
+            batch = []
+    SearchEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_storedblob_uploadsession'),
+        ('notes', '0001_initial'),
+        ('prescriptions', '0005_file_previews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('reason', 'Motivo'), ('note', 'Nota clínica'), ('medication', 'Receta')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('visible_to_patient', models.BooleanField(default=True)),
+                ('body', models.TextField()),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='appointments.appointment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_entry_unique_object')],
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
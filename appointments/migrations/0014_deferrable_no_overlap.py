@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 21:30
+
+from django.db import migrations
+
+# Solo PostgreSQL: la misma restricción de 0003, pero DEFERRABLE INITIALLY
+# IMMEDIATE. Sigue revisándose fila por fila salvo que la transacción pida
+# SET CONSTRAINTS appt_no_overlap DEFERRED (booking.defer_overlap_check), como
+# hace "esta y las siguientes" al correr una serie un periodo o más.
+DROP_SQL = "ALTER TABLE appointments_appointment DROP CONSTRAINT IF EXISTS appt_no_overlap"
+
+ADD_SQL = """
+    ALTER TABLE appointments_appointment
+        ADD CONSTRAINT appt_no_overlap
+        EXCLUDE USING gist (
+            doctor_id WITH =,
+            tstzrange(start_time, end_time) WITH &&
+        )
+        WHERE (status <> 'CANCELLED')
+        {deferrable}
+"""
+
+
+def _recreate(schema_editor, deferrable):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SQL)
+        schema_editor.execute(ADD_SQL.format(deferrable=deferrable))
+
+
+def make_deferrable(apps, schema_editor):
+    _recreate(schema_editor, "DEFERRABLE INITIALLY IMMEDIATE")
+
+
+def make_immediate(apps, schema_editor):
+    _recreate(schema_editor, "")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0013_appointmentseries'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_deferrable, make_immediate),
+    ]
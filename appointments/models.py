@@ -1,7 +1,14 @@
+import uuid
+
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from patients.models import Patient
 
+ACTIVE_STATUSES = ("PENDING", "CONFIRMED")
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ("PENDING", "Pendiente"),
@@ -21,8 +28,303 @@ class Appointment(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Marca de send_confirmations_24h: evita reenviar el recordatorio
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+
+    # Versión de notas / recetas / archivos: la suben las señales y forma
+    # parte de la clave de los fragmentos cacheados del detalle
+    cache_version = models.PositiveIntegerField(default=0, editable=False)
+
+    # Serie recurrente de la que salió la cita (ver appointments.series)
+    series = models.ForeignKey(
+        "AppointmentSeries",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="appointments",
+        db_index=False,
+        editable=False,
+    )
+
     class Meta:
         ordering = ["-start_time"]
+        indexes = [
+            # agenda, dashboard y validación de choques del formulario
+            models.Index(fields=["doctor", "start_time"], name="appt_doctor_start_idx"),
+            # historial y "mis citas" del paciente
+            models.Index(fields=["patient", "start_time"], name="appt_patient_start_idx"),
+            models.Index(fields=["status", "start_time"], name="appt_status_start_idx"),
+            # lista general paginada por cursor (start_time, id)
+            models.Index(fields=["start_time", "id"], name="appt_start_id_idx"),
+            # recordatorios: solo citas activas
+            models.Index(
+                fields=["start_time"],
+                name="appt_active_start_idx",
+                condition=Q(status__in=ACTIVE_STATUSES),
+            ),
+            # "esta y las siguientes" de una serie
+            models.Index(fields=["series", "start_time"], name="appt_series_start_idx"),
+        ]
 
     def __str__(self):
         return f"{self.patient} - {self.start_time:%Y-%m-%d %H:%M}"
+
+
+class AppointmentSeries(models.Model):
+    """
+    Regla de una cita recurrente. start_time / end_time son los de la primera
+    ocurrencia; termina tras `count` ocurrencias o en `until` (fecha local).
+    Las citas se crean de una vez al guardar la serie (appointments.series).
+    """
+
+    WEEKLY = "WEEKLY"
+    BIWEEKLY = "BIWEEKLY"
+    MONTHLY = "MONTHLY"
+    FREQUENCY_CHOICES = [
+        (WEEKLY, "Semanal"),
+        (BIWEEKLY, "Cada dos semanas"),
+        (MONTHLY, "Mensual"),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.PROTECT, related_name="appointment_series")
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="appointment_series")
+
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default=WEEKLY)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    count = models.PositiveSmallIntegerField(null=True, blank=True)
+    until = models.DateField(null=True, blank=True)
+
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(count__isnull=False) | Q(until__isnull=False),
+                name="series_count_or_until",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.patient} - {self.get_frequency_display()} desde {self.start_time:%Y-%m-%d %H:%M}"
+
+
+class WorkingHours(models.Model):
+    WEEKDAY_CHOICES = [
+        (0, "Lunes"),
+        (1, "Martes"),
+        (2, "Miércoles"),
+        (3, "Jueves"),
+        (4, "Viernes"),
+        (5, "Sábado"),
+        (6, "Domingo"),
+    ]
+
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="working_hours")
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start = models.TimeField()
+    end = models.TimeField()
+
+    class Meta:
+        ordering = ["doctor", "weekday", "start"]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.get_weekday_display()} {self.start:%H:%M}-{self.end:%H:%M}"
+
+
+class DoctorDayAvailability(models.Model):
+    """
+    Bitmap de ocupación de un doctor en un día local: un bit por bloque de
+    5 minutos (288 bits). Lo mantiene appointments.availability.
+    """
+
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="availability_days")
+    day = models.DateField()
+    booked = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "day"], name="availability_doctor_day_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.day}"
+
+
+class OutboundEmail(models.Model):
+    """
+    Correo pendiente de envío. Lo envía la tarea send_outbound_emails
+    (ver appointments.outbox), nunca la petición web.
+    """
+
+    STATUS_CHOICES = [
+        ("PENDING", "Pendiente"),
+        ("SENDING", "Enviando"),
+        ("SENT", "Enviado"),
+        ("FAILED", "Fallido"),
+    ]
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+
+    # Si se indica, el PDF de recetas de la cita se adjunta al enviar
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.CASCADE, null=True, blank=True, related_name="outbound_emails"
+    )
+    attach_prescriptions = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_status_next_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
+
+
+class AuditEvent(models.Model):
+    """
+    Registro de acciones de los usuarios (ver appointments.utils.log_action).
+    """
+
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="audit_events"
+    )
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name="audit_events"
+    )
+    action = models.CharField(max_length=20)
+    object_type = models.CharField(max_length=50, blank=True)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["appointment", "created_at"], name="audit_appt_created_idx"),
+            models.Index(fields=["actor", "created_at"], name="audit_actor_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"[{self.created_at:%Y-%m-%d %H:%M}] {self.actor} -> {self.action}"
+
+
+class DoctorDailyStats(models.Model):
+    """
+    Cantidad de citas por (doctor, día local, estado). La mantienen las
+    señales de Appointment; rebuild_doctor_stats la recalcula completa.
+    """
+
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "day", "status"], name="daily_stats_doctor_day_status_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.day} {self.status}: {self.count}"
+
+
+class AgendaMarker(models.Model):
+    """
+    Última vez que cambió alguna cita del doctor. Sirve para ETag /
+    Last-Modified de las vistas de agenda sin consultar las citas.
+    """
+
+    doctor = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="agenda_marker"
+    )
+    changed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.doctor} - {self.changed_at}"
+
+
+class StoredBlob(models.Model):
+    """
+    Contenido de un archivo subido, guardado una sola vez por SHA-256.
+    AppointmentFile y MedicalFile apuntan aquí; ref_count cuenta cuántos.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="blobs/", max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)"
+
+
+class UploadSession(models.Model):
+    """
+    Subida por partes en curso (ver appointments.uploads). Los bytes
+    recibidos se van escribiendo en un archivo temporal; `offset` es cuántos
+    están confirmados.
+    """
+
+    KIND_CHOICES = [
+        ("appointment_file", "Archivo de cita"),
+        ("medical_file", "Archivo clínico"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name="upload_sessions")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="upload_sessions")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    title = models.CharField(max_length=120, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class SearchEntry(models.Model):
+    """
+    Texto indexado para la búsqueda (ver appointments.search): el motivo de
+    la cita, cada nota clínica y cada receta. El índice de texto completo
+    (tsvector + GIN en PostgreSQL, FTS5 en SQLite) lo crea la migración 0012.
+    """
+
+    REASON = "reason"
+    NOTE = "note"
+    MEDICATION = "medication"
+    KIND_CHOICES = [
+        (REASON, "Motivo"),
+        (NOTE, "Nota clínica"),
+        (MEDICATION, "Receta"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name="search_entries")
+    visible_to_patient = models.BooleanField(default=True)
+    body = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "object_id"], name="search_entry_unique_object"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} (cita #{self.appointment_id})"
@@ -0,0 +1,156 @@
+"""
+Bandeja de salida de correos.
+
+Las vistas solo crean filas OutboundEmail (enqueue_email) y responden de
+inmediato. La tarea send_outbound_emails las envía en lotes reutilizando una
+sola conexión SMTP; los fallos se reintentan con espera exponencial hasta
+OUTBOX_MAX_ATTEMPTS y luego quedan en FAILED.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# Una fila en SENDING más tiempo que esto se considera abandonada
+# (el worker murió) y se vuelve a tomar.
+SENDING_LEASE = timedelta(minutes=10)
+
+
+def _max_attempts():
+    return getattr(settings, "OUTBOX_MAX_ATTEMPTS", 5)
+
+
+def _backoff(attempts):
+    base = getattr(settings, "OUTBOX_RETRY_BASE_SECONDS", 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def enqueue_email(to, subject, body, appointment=None, attach_prescriptions=False):
+    email = OutboundEmail.objects.create(
+        to=to,
+        subject=subject,
+        body=body,
+        appointment=appointment,
+        attach_prescriptions=attach_prescriptions,
+    )
+    transaction.on_commit(_kick)
+    return email
+
+
+def _kick():
+    """
+    Pide a Celery vaciar la bandeja ya. Si el broker no responde no pasa nada:
+    la tarea periódica la vaciará después.
+    """
+    from .tasks import send_outbound_emails
+
+    try:
+        send_outbound_emails.apply_async(retry=False)
+    except Exception:
+        logger.warning("No se pudo encolar send_outbound_emails", exc_info=True)
+
+
+def _claim(batch_size):
+    """
+    Marca como SENDING un lote de correos listos y lo retorna.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=["PENDING", "SENDING"], next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(
+            status="SENDING", next_attempt_at=now + SENDING_LEASE
+        )
+
+    return list(
+        OutboundEmail.objects.filter(id__in=ids)
+        .select_related("appointment__patient__user")
+        .order_by("id")
+    )
+
+
+def _build_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        to=[email.to],
+        connection=connection,
+    )
+    if email.attach_prescriptions and email.appointment_id:
+        from .pdf_cache import read_prescriptions_pdf
+
+        message.attach(
+            f"receta_cita_{email.appointment_id}.pdf",
+            read_prescriptions_pdf(email.appointment),
+            "application/pdf",
+        )
+    return message
+
+
+def _mark_failed(email, exc):
+    email.attempts += 1
+    email.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+    if email.attempts >= _max_attempts():
+        email.status = "FAILED"
+    else:
+        email.status = "PENDING"
+        email.next_attempt_at = timezone.now() + _backoff(email.attempts)
+    email.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+
+
+def drain(batch_size=100, max_batches=50):
+    """
+    Envía correos pendientes por lotes. Retorna {"sent": n, "failed": n}.
+    """
+    result = {"sent": 0, "failed": 0}
+
+    for _ in range(max_batches):
+        batch = _claim(batch_size)
+        if not batch:
+            break
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as exc:
+            # Servidor de correo caído: se reintenta todo el lote más tarde
+            logger.warning("No se pudo abrir la conexión de correo", exc_info=True)
+            for email in batch:
+                _mark_failed(email, exc)
+            result["failed"] += len(batch)
+            break
+
+        sent_ids = []
+        try:
+            for email in batch:
+                try:
+                    connection.send_messages([_build_message(email, connection)])
+                except Exception as exc:
+                    logger.warning("Falló el envío del correo #%s", email.id, exc_info=True)
+                    _mark_failed(email, exc)
+                    result["failed"] += 1
+                else:
+                    sent_ids.append(email.id)
+        finally:
+            connection.close()
+
+        OutboundEmail.objects.filter(id__in=sent_ids).update(
+            status="SENT", sent_at=timezone.now(), last_error=""
+        )
+        result["sent"] += len(sent_ids)
+
+        if len(batch) < batch_size:
+            break
+
+    return result
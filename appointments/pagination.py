@@ -0,0 +1,190 @@
+"""
+Paginación por cursor (keyset / seek) para listas de citas.
+
+En vez de OFFSET + COUNT(*) (lo que hace Paginator), cada página se pide
+"a partir de" la última fila vista, ordenando por (campo, id). Con un índice
+sobre ese orden, la página N cuesta lo mismo que la primera y nunca se cuenta
+la tabla completa.
+
+Los cursores son tokens opacos (base64 de un JSON pequeño); si llega uno
+inválido se vuelve a la primera página, igual que Paginator.get_page().
+"""
+import base64
+import binascii
+import json
+
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+CURSOR_PARAM = "cursor"
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk, direction=NEXT):
+    payload = json.dumps([direction, value.isoformat(), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Retorna (direction, value, pk). Lanza InvalidCursor si el token no es válido.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        direction, raw_value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        # ValueError también para fechas imposibles (2024-02-30T...)
+        value = parse_datetime(raw_value) if isinstance(raw_value, str) else None
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(token)
+
+    if direction not in (NEXT, PREVIOUS) or value is None or not isinstance(pk, int):
+        raise InvalidCursor(token)
+
+    return direction, value, pk
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_keyset(queryset, cursor=None, per_page=20, field="start_time", descending=True):
+    """
+    Retorna un KeysetPage de `queryset` ordenado por (field, id).
+
+    `field` debe ser un DateTimeField (start_time, created_at...). Se piden
+    per_page + 1 filas para saber si hay más, sin COUNT.
+    """
+    direction = NEXT
+    if cursor:
+        try:
+            direction, value, pk = decode_cursor(cursor)
+        except InvalidCursor:
+            cursor = None
+
+    # Al ir hacia atrás se recorre el orden inverso y luego se voltea la página
+    forward = direction == NEXT
+    seek_desc = descending if forward else not descending
+
+    if seek_desc:
+        ordering = (f"-{field}", "-id")
+    else:
+        ordering = (field, "id")
+    qs = queryset.order_by(*ordering)
+
+    if cursor:
+        op = "lt" if seek_desc else "gt"
+        qs = qs.filter(
+            Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
+        )
+
+    rows = list(qs[: per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if not forward:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([])
+
+    first, last = rows[0], rows[-1]
+    has_next = has_more if forward else True
+    has_previous = bool(cursor) if forward else has_more
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(getattr(last, field), last.pk, NEXT) if has_next else None,
+        previous_cursor=(
+            encode_cursor(getattr(first, field), first.pk, PREVIOUS) if has_previous else None
+        ),
+    )
+
+
+# ---------------------------
+# ADMIN
+# ---------------------------
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList del admin que pagina con cursor y no ejecuta COUNT(*).
+    """
+
+    keyset = True
+
+    def __init__(self, request, *args, **kwargs):
+        # ChangeList trata cualquier parámetro GET desconocido como filtro,
+        # así que el cursor se saca antes de construirlo.
+        self.cursor = request.GET.get(CURSOR_PARAM)
+        if CURSOR_PARAM in request.GET:
+            request.GET = request.GET.copy()
+            del request.GET[CURSOR_PARAM]
+        super().__init__(request, *args, **kwargs)
+
+    def get_results(self, request):
+        admin = self.model_admin
+        page = paginate_keyset(
+            self.queryset,
+            self.cursor,
+            per_page=self.list_per_page,
+            field=admin.keyset_field,
+        )
+
+        self.keyset_page = page
+        self.next_url = (
+            self.get_query_string({CURSOR_PARAM: page.next_cursor}) if page.has_next else None
+        )
+        self.previous_url = (
+            self.get_query_string({CURSOR_PARAM: page.previous_cursor})
+            if page.has_previous else None
+        )
+
+        self.result_count = len(page)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = page.object_list
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+
+
+class KeysetPaginationMixin:
+    """
+    Mixin para ModelAdmin: paginación por cursor sobre (keyset_field, id).
+    """
+
+    keyset_field = "start_time"
+    show_full_result_count = False
+    # Ordenar por otra columna rompería el cursor
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -1,61 +1,126 @@
-from io import BytesIO
+"""
+Recetas en PDF (ReportLab).
+
+Los títulos y etiquetas, que son iguales en todas las recetas, se dibujan una
+sola vez por documento como form XObject y cada receta lo reutiliza con
+doForm(); por página solo se escriben los datos, en un único objeto de
+texto. El render recibe los datos ya cargados (prescriptions_data), así que
+no consulta la base, y escribe a un SpooledTemporaryFile que se guarda o se
+envía tal cual, sin copiarlo a bytes.
+"""
+import tempfile
+
 from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 
+from clinic.metrics import timed
+
+SPOOL_MAX_BYTES = 1024 * 1024
+
+WIDTH, HEIGHT = letter
+TOP = HEIGHT - 50
+BOTTOM = 80
+
+REGULAR = "Helvetica"
+BOLD = "Helvetica-Bold"
+
+HEADER_FORM = "rx_header"
+TITLE = "Receta médica - Cita #"
+PATIENT_LABEL = "Paciente: "
+DATE_LABEL = "Fecha: "
+
+# Dónde empieza cada dato, justo después de su etiqueta en el encabezado
+TITLE_X = 50 + stringWidth(TITLE, BOLD, 14)
+PATIENT_X = 50 + stringWidth(PATIENT_LABEL, REGULAR, 11)
+DATE_X = 50 + stringWidth(DATE_LABEL, REGULAR, 11)
 
-def build_prescriptions_pdf(appointment):
+
+def item(medication, dosage, frequency, duration):
+    return (medication or "—", dosage or "—", frequency or "—", duration or "—")
+
+
+def prescriptions_data(appointment, items):
     """
-    Retorna bytes del PDF con las recetas de una cita.
-    Requiere ReportLab: pip install reportlab
+    Datos planos de la receta de una cita. `items`: tuplas de item() en el
+    orden del PDF. `appointment` debe traer patient__user ya cargado.
     """
+    return {
+        "id": appointment.id,
+        "patient": str(appointment.patient),
+        "start": appointment.start_time.strftime("%Y-%m-%d %H:%M"),
+        "items": list(items),
+    }
 
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-    y = height - 50
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, f"Receta médica - Cita #{appointment.id}")
-    y -= 22
-
-    c.setFont("Helvetica", 11)
-    c.drawString(50, y, f"Paciente: {appointment.patient}")
-    y -= 16
-    c.drawString(50, y, f"Fecha: {appointment.start_time.strftime('%Y-%m-%d %H:%M')}")
-    y -= 22
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y, "Medicamentos:")
-    y -= 18
-
-    c.setFont("Helvetica", 10)
-
-    prescriptions = appointment.prescriptions.all().order_by("-created_at")
-
-    if not prescriptions:
-        c.drawString(60, y, "No hay medicamentos registrados.")
-        y -= 14
-    else:
-        for p in prescriptions:
-            # Ajusta aquí a tus campos reales:
-            med = getattr(p, "medication", "") or getattr(p, "medicine", "") or "—"
-            dosage = getattr(p, "dosage", "") or getattr(p, "dose", "") or "—"
-            freq = getattr(p, "frequency", "") or "—"
-            dur = getattr(p, "duration", "") or "—"
-
-            c.drawString(60, y, f"- {med}")
-            y -= 14
-            c.drawString(80, y, f"Dosis: {dosage} | Frecuencia: {freq} | Duración: {dur}")
-            y -= 18
-
-            if y < 80:
-                c.showPage()
-                y = height - 50
-                c.setFont("Helvetica", 10)
 
+def _define_header(c):
+    c.beginForm(HEADER_FORM)
+    c.setFont(BOLD, 14)
+    c.drawString(50, TOP, TITLE)
+    c.setFont(REGULAR, 11)
+    c.drawString(50, TOP - 22, PATIENT_LABEL)
+    c.drawString(50, TOP - 38, DATE_LABEL)
+    c.setFont(BOLD, 12)
+    c.drawString(50, TOP - 60, "Medicamentos:")
+    c.endForm()
+
+
+def draw_prescriptions(c, data):
+    """
+    Dibuja la receta de una cita en el canvas, desde una página nueva.
+    """
+    if not c.hasForm(HEADER_FORM):
+        _define_header(c)
+    c.doForm(HEADER_FORM)
+
+    text = c.beginText()
+    text.setFont(BOLD, 14)
+    text.setTextOrigin(TITLE_X, TOP)
+    text.textLine(str(data["id"]))
+    text.setFont(REGULAR, 11)
+    text.setTextOrigin(PATIENT_X, TOP - 22)
+    text.textLine(data["patient"])
+    text.setTextOrigin(DATE_X, TOP - 38)
+    text.textLine(data["start"])
+
+    text.setFont(REGULAR, 10)
+    y = TOP - 78
+
+    if not data["items"]:
+        text.setTextOrigin(60, y)
+        text.textLine("No hay medicamentos registrados.")
+
+    for med, dosage, freq, dur in data["items"]:
+        if y < BOTTOM:
+            c.drawText(text)
+            c.showPage()
+            text = c.beginText()
+            text.setFont(REGULAR, 10)
+            y = TOP
+
+        text.setTextOrigin(60, y)
+        text.textLine(f"- {med}")
+        text.setTextOrigin(80, y - 14)
+        text.textLine(f"Dosis: {dosage} | Frecuencia: {freq} | Duración: {dur}")
+        y -= 32
+
+    c.drawText(text)
     c.showPage()
+
+
+@timed("clinic_pdf_render_seconds")
+def render_prescriptions(datas, out=None):
+    """
+    PDF con las recetas de varias citas, una tras otra. Lo escribe en `out`
+    (o en un SpooledTemporaryFile nuevo) y lo retorna posicionado al inicio.
+    """
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+    c = canvas.Canvas(out, pagesize=letter)
+    for data in datas:
+        draw_prescriptions(c, data)
     c.save()
 
-    pdf = buffer.getvalue()
-    buffer.close()
-    return pdf
+    out.seek(0)
+    return out
@@ -0,0 +1,171 @@
+"""
+Caché de PDFs de recetas en el storage.
+
+Cada PDF se guarda como pdf_cache/<cita>/<sha256>.pdf, donde el hash sale de
+los datos del encabezado y de las filas de recetas: si algo cambia, cambia el
+nombre y el PDF viejo ya no se usa. Las señales de Prescription borran los
+PDFs de la cita y, cuando el total supera PDF_CACHE_MAX_BYTES, se eliminan
+los más antiguos.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .pdf import item, prescriptions_data, render_prescriptions
+
+CACHE_DIR = "pdf_cache"
+
+STATS_HITS = "pdf_cache:hits"
+STATS_MISSES = "pdf_cache:misses"
+STATS_BYTES = "pdf_cache:bytes"
+
+PRESCRIPTION_FIELDS = ("id", "medication", "dosage", "frequency", "duration", "created_at")
+
+
+def _max_bytes():
+    return getattr(settings, "PDF_CACHE_MAX_BYTES", 200 * 1024 * 1024)
+
+
+def _incr(key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+
+def stats():
+    return {
+        "hits": cache.get(STATS_HITS, 0),
+        "misses": cache.get(STATS_MISSES, 0),
+    }
+
+
+def cache_key(appointment, rows):
+    """
+    Hash del encabezado de la cita + filas de recetas (en el orden del PDF).
+    """
+    payload = [
+        appointment.id,
+        str(appointment.patient),
+        appointment.start_time.isoformat(),
+        rows,
+    ]
+    raw = json.dumps(payload, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _appointment_dir(appointment_id):
+    return f"{CACHE_DIR}/{appointment_id}"
+
+
+def get_prescriptions_pdf(appointment, refresh=False):
+    """
+    Retorna el nombre en el storage del PDF de recetas de la cita,
+    generándolo solo si no está en caché (o si `refresh`).
+    """
+    rows = list(
+        appointment.prescriptions.order_by("-created_at").values_list(*PRESCRIPTION_FIELDS)
+    )
+    name = f"{_appointment_dir(appointment.id)}/{cache_key(appointment, rows)}.pdf"
+
+    if not refresh and default_storage.exists(name):
+        _incr(STATS_HITS)
+        return name
+
+    _incr(STATS_MISSES)
+    data = prescriptions_data(appointment, [item(*row[1:5]) for row in rows])
+    with render_prescriptions([data]) as fh:
+        size = fh.seek(0, 2)
+        fh.seek(0)
+        name = default_storage.save(name, File(fh))
+    add_bytes(size)
+    return name
+
+
+def add_bytes(size):
+    """
+    Suma un PDF nuevo al total en caché y libera espacio si hace falta.
+    """
+    # Solo se recorre el directorio (evict) al pasar el límite. Sin total
+    # conocido se empieza de cero: con Redis el total es de todos los
+    # procesos; con la caché en memoria cada proceso cuenta lo suyo y el
+    # recorrido corrige el total cuando alguno llega al límite.
+    if _incr(STATS_BYTES, size) > _max_bytes():
+        evict()
+
+
+def open_prescriptions_pdf(appointment):
+    """
+    Abre (rb) el PDF de recetas de la cita. Si evict() lo borró entre
+    exists() y open(), lo vuelve a generar.
+    """
+    try:
+        return default_storage.open(get_prescriptions_pdf(appointment), "rb")
+    except FileNotFoundError:
+        return default_storage.open(get_prescriptions_pdf(appointment, refresh=True), "rb")
+
+
+def read_prescriptions_pdf(appointment):
+    with open_prescriptions_pdf(appointment) as fh:
+        return fh.read()
+
+
+def invalidate(appointment_id):
+    """
+    Borra los PDFs en caché de una cita.
+    """
+    directory = _appointment_dir(appointment_id)
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+
+    freed = 0
+    for filename in files:
+        name = f"{directory}/{filename}"
+        freed += default_storage.size(name)
+        default_storage.delete(name)
+
+    if freed:
+        try:
+            cache.decr(STATS_BYTES, freed)
+        except ValueError:
+            pass
+
+
+def evict(target_ratio=0.9):
+    """
+    Elimina los PDFs más antiguos hasta bajar del límite (al 90%) y
+    recalcula el total de bytes en caché.
+    """
+    try:
+        dirs, _ = default_storage.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        cache.set(STATS_BYTES, 0, timeout=None)
+        return
+
+    entries = []
+    for directory in dirs:
+        _, files = default_storage.listdir(f"{CACHE_DIR}/{directory}")
+        for filename in files:
+            name = f"{CACHE_DIR}/{directory}/{filename}"
+            entries.append(
+                (default_storage.get_modified_time(name), default_storage.size(name), name)
+            )
+
+    total = sum(size for _, size, _ in entries)
+    limit = _max_bytes()
+    if total > limit:
+        entries.sort()
+        for _, size, name in entries:
+            if total <= limit * target_ratio:
+                break
+            default_storage.delete(name)
+            total -= size
+
+    cache.set(STATS_BYTES, total, timeout=None)
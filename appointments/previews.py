@@ -0,0 +1,124 @@
+"""
+Miniaturas y vistas previas WebP de las imágenes subidas.
+
+Al crear un AppointmentFile / MedicalFile la señal encola
+generate_file_previews (Celery). Los derivados se guardan junto al original
+(<nombre>.thumb.webp y <nombre>.preview.webp); como los blobs se comparten
+por hash, archivos con el mismo contenido también comparten derivados. Si
+falta alguno cuando se pide, file_preview lo regenera en el momento.
+"""
+import logging
+import mimetypes
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import fragments
+
+logger = logging.getLogger(__name__)
+
+# nombre -> (lado máximo en px, calidad WebP)
+SIZES = {
+    "thumbnail": (256, 70),
+    "preview": (1280, 80),
+}
+SUFFIXES = {"thumbnail": "thumb", "preview": "preview"}
+
+
+def is_image(name):
+    content_type, _ = mimetypes.guess_type(name or "")
+    return bool(content_type and content_type.startswith("image/"))
+
+
+def derivative_name(original_name, size):
+    root, _ = os.path.splitext(original_name)
+    return f"{root}.{SUFFIXES[size]}.webp"
+
+
+def _render(image, max_side, quality):
+    copy = image.copy()
+    copy.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    out = BytesIO()
+    copy.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def build_previews(obj, sizes=tuple(SIZES)):
+    """
+    Genera los derivados que falten y los guarda en el modelo. Retorna
+    {tamaño: nombre} o {} si el archivo no es una imagen legible.
+    """
+    if not obj.file or not is_image(obj.file.name):
+        return {}
+
+    storage = obj.file.storage
+    names = {size: derivative_name(obj.file.name, size) for size in sizes}
+    missing = [size for size, name in names.items() if not storage.exists(name)]
+
+    if missing:
+        try:
+            with storage.open(obj.file.name, "rb") as fh, Image.open(fh) as image:
+                # JPEG: decodifica ya reducido (mucho más rápido en radiografías)
+                largest = max(SIZES[size][0] for size in missing)
+                image.draft(image.mode, (largest, largest))
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+                for size in missing:
+                    max_side, quality = SIZES[size]
+                    data = _render(image, max_side, quality)
+                    if not storage.exists(names[size]):
+                        storage.save(names[size], ContentFile(data))
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            logger.warning("No se pudo generar la vista previa de %s", obj.file.name, exc_info=True)
+            return {}
+
+    changed = {size: name for size, name in names.items() if getattr(obj, size).name != name}
+    if changed:
+        type(obj).objects.filter(pk=obj.pk).update(**changed)
+        for size, name in changed.items():
+            setattr(obj, size, name)
+        # El fragmento de archivos del detalle ahora muestra la miniatura
+        fragments.bump_version(obj.appointment_id)
+    return names
+
+
+def ensure_preview(obj, size):
+    """
+    Nombre del derivado `size`, regenerándolo si falta. None si no aplica.
+    """
+    field = getattr(obj, size)
+    if field and field.storage.exists(field.name):
+        return field.name
+    return build_previews(obj, sizes=(size,)).get(size)
+
+
+def enqueue_previews(obj):
+    """
+    Encola la generación al confirmar la transacción. Sin broker no pasa
+    nada: se generan la primera vez que se pidan.
+    """
+    if not obj.file or not is_image(obj.file.name):
+        return
+
+    from .tasks import generate_file_previews
+
+    kind = obj._meta.label_lower
+
+    def kick():
+        try:
+            generate_file_previews.apply_async(args=[kind, obj.pk], retry=False)
+        except Exception:
+            logger.warning("No se pudo encolar generate_file_previews", exc_info=True)
+
+    transaction.on_commit(kick)
+
+
+def delete_previews(original_name):
+    for size in SIZES:
+        default_storage.delete(derivative_name(original_name, size))
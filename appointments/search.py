@@ -0,0 +1,271 @@
+"""
+Búsqueda de texto completo sobre motivos de cita, notas clínicas y recetas.
+
+Cada objeto indexado tiene una fila SearchEntry que las señales mantienen al
+día. El índice depende del motor (ver migración 0012):
+- PostgreSQL: columna generada search_vector = to_tsvector('spanish', body)
+  con índice GIN; el orden es ts_rank_cd.
+- SQLite: tabla FTS5 appointments_searchentry_fts (contenido externo,
+  sincronizada con triggers, sin acentos); el orden es bm25.
+En otros motores se cae a icontains, sin ranking.
+
+Cada palabra de la consulta se busca como prefijo y deben aparecer todas:
+"dolor cab" encuentra "dolor de cabeza".
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from notes.models import ClinicalNote
+from prescriptions.models import Prescription
+
+from .models import Appointment, SearchEntry
+
+TABLE = SearchEntry._meta.db_table
+FTS_TABLE = f"{TABLE}_fts"
+
+MAX_TERMS = 8
+PER_PAGE = 20
+SNIPPET_CHARS = 180
+BATCH_SIZE = 1000
+
+TERM_RE = re.compile(r"\w+")
+
+
+def terms(query):
+    return TERM_RE.findall(query or "")[:MAX_TERMS]
+
+
+# ---------------------------
+# Indexado
+# ---------------------------
+
+def prescription_body(rx):
+    parts = [rx.medication, rx.dosage, rx.frequency, rx.duration, rx.notes]
+    return " ".join(part for part in parts if part)
+
+
+def _entry(kind, object_id, appointment_id, body, visible_to_patient=True):
+    return SearchEntry(
+        kind=kind,
+        object_id=object_id,
+        appointment_id=appointment_id,
+        body=(body or "").strip(),
+        visible_to_patient=visible_to_patient,
+    )
+
+
+def _entries_for(appointments, notes, prescriptions):
+    for appt in appointments:
+        yield _entry(SearchEntry.REASON, appt.pk, appt.pk, appt.reason)
+    for note in notes:
+        yield _entry(SearchEntry.NOTE, note.pk, note.appointment_id, note.content, note.visible_to_patient)
+    for rx in prescriptions:
+        yield _entry(SearchEntry.MEDICATION, rx.pk, rx.appointment_id, prescription_body(rx))
+
+
+def _save(entry):
+    if not entry.body:
+        unindex(entry.kind, entry.object_id)
+        return
+    # Un solo INSERT ... ON CONFLICT; en SQLite los triggers actualizan FTS5
+    SearchEntry.objects.bulk_create(
+        [entry],
+        update_conflicts=True,
+        unique_fields=["kind", "object_id"],
+        update_fields=["appointment", "body", "visible_to_patient"],
+    )
+
+
+def index_appointment(appt):
+    _save(_entry(SearchEntry.REASON, appt.pk, appt.pk, appt.reason))
+
+
+def index_appointments(appointments):
+    """
+    Indexa varias citas con una sola consulta (para bulk_create / update(),
+    que no disparan señales). Las que quedaron sin motivo salen del índice.
+    """
+    entries = [_entry(SearchEntry.REASON, appt.pk, appt.pk, appt.reason) for appt in appointments]
+    empty = [entry.object_id for entry in entries if not entry.body]
+    entries = [entry for entry in entries if entry.body]
+    if empty:
+        SearchEntry.objects.filter(kind=SearchEntry.REASON, object_id__in=empty).delete()
+    if entries:
+        SearchEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=["kind", "object_id"],
+            update_fields=["appointment", "body", "visible_to_patient"],
+        )
+
+
+def index_note(note):
+    _save(_entry(SearchEntry.NOTE, note.pk, note.appointment_id, note.content, note.visible_to_patient))
+
+
+def index_prescription(rx):
+    _save(_entry(SearchEntry.MEDICATION, rx.pk, rx.appointment_id, prescription_body(rx)))
+
+
+def unindex(kind, object_id):
+    SearchEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild(doctor_id=None):
+    """
+    Regenera las filas de un doctor (o de todos). Para cargas masivas que no
+    pasan por las señales (bulk_create, seed_clinic).
+    """
+    appointments = Appointment.objects.all()
+    if doctor_id:
+        appointments = appointments.filter(doctor_id=doctor_id)
+
+    SearchEntry.objects.filter(appointment__in=appointments).delete()
+
+    entries = _entries_for(
+        appointments.exclude(reason="").only("id", "reason").iterator(chunk_size=BATCH_SIZE),
+        ClinicalNote.objects.filter(appointment__in=appointments)
+        .only("id", "appointment_id", "content", "visible_to_patient")
+        .iterator(chunk_size=BATCH_SIZE),
+        Prescription.objects.filter(appointment__in=appointments).iterator(chunk_size=BATCH_SIZE),
+    )
+
+    total, batch = 0, []
+    for entry in entries:
+        if not entry.body:
+            continue
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            SearchEntry.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        SearchEntry.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+# ---------------------------
+# Consulta
+# ---------------------------
+
+def _match(qs, words, ranked=True):
+    """
+    Filtra `qs` (SearchEntry) por las palabras y, si `ranked`, anota `rank`
+    (mayor es mejor). El filtro no nombra la tabla de afuera, así `qs` también
+    sirve como subconsulta; `rank` sí, y solo se usa en la consulta principal.
+    """
+    vendor = connection.vendor
+
+    if vendor == "postgresql":
+        tsquery = " & ".join(f"{word}:*" for word in words)
+        qs = qs.filter(
+            id__in=RawSQL(f"SELECT id FROM {TABLE} WHERE search_vector @@ to_tsquery('spanish', %s)", [tsquery])
+        )
+        if ranked:
+            qs = qs.annotate(
+                rank=RawSQL(
+                    f"ts_rank_cd({TABLE}.search_vector, to_tsquery('spanish', %s))",
+                    [tsquery],
+                    output_field=FloatField(),
+                )
+            )
+        return qs
+
+    if vendor == "sqlite":
+        match = " ".join(f'"{word}"*' for word in words)
+        qs = qs.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+        if ranked:
+            # bm25() es menor cuanto más relevante
+            qs = qs.annotate(
+                rank=RawSQL(
+                    f"(SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+                    f"WHERE {FTS_TABLE} MATCH %s AND rowid = {TABLE}.id)",
+                    [match],
+                    output_field=FloatField(),
+                )
+            )
+        return qs
+
+    for word in words:
+        qs = qs.filter(body__icontains=word)
+    return qs.annotate(rank=Value(0.0, output_field=FloatField())) if ranked else qs
+
+
+def filter_by_reason(qs, query):
+    """
+    Citas de `qs` cuyo motivo contiene las palabras (usa el índice en vez de
+    reason__icontains).
+    """
+    words = terms(query)
+    if not words:
+        return qs
+    entries = _match(SearchEntry.objects.filter(kind=SearchEntry.REASON), words, ranked=False)
+    return qs.filter(pk__in=entries.values("appointment_id"))
+
+
+def highlight(body, words, length=SNIPPET_CHARS):
+    """
+    Fragmento de `body` alrededor de la primera coincidencia, con las
+    palabras encontradas en <mark>.
+    """
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\w*", re.IGNORECASE)
+    found = pattern.search(body)
+    start = max((found.start() if found else 0) - length // 3, 0)
+    text = body[start:start + length]
+
+    parts, last = [], 0
+    for hit in pattern.finditer(text):
+        parts.append(escape(text[last:hit.start()]))
+        parts.append(f"<mark>{escape(hit.group())}</mark>")
+        last = hit.end()
+    parts.append(escape(text[last:]))
+
+    prefix = "… " if start else ""
+    suffix = " …" if start + length < len(body) else ""
+    return mark_safe(prefix + "".join(parts) + suffix)
+
+
+class SearchPage:
+    def __init__(self, results, number, has_next):
+        self.object_list = results
+        self.number = number
+        self.has_next = has_next
+        self.has_previous = number > 1
+        self.next_page_number = number + 1
+        self.previous_page_number = number - 1
+        self.has_other_pages = has_next or self.has_previous
+
+
+def search(role, query, page=1, per_page=PER_PAGE):
+    """
+    Resultados ordenados por relevancia. `role`: el de la petición
+    (accounts.roles). El doctor busca en sus citas; el paciente en las suyas
+    y solo en notas visible_to_patient. Pagina con LIMIT/OFFSET pidiendo una
+    fila de más en vez de contar el total.
+    """
+    words = terms(query)
+    if not words:
+        return SearchPage([], 1, False)
+
+    qs = SearchEntry.objects.select_related("appointment__patient__user", "appointment__doctor")
+    if role.is_patient:
+        qs = qs.filter(appointment__patient_id=role.patient_id, visible_to_patient=True)
+    else:
+        qs = qs.filter(appointment__doctor_id=role.user_id)
+
+    qs = _match(qs, words).order_by("-rank", "-appointment__start_time", "id")
+
+    offset = (page - 1) * per_page
+    results = list(qs[offset:offset + per_page + 1])
+    has_next = len(results) > per_page
+    results = results[:per_page]
+
+    for entry in results:
+        entry.snippet = highlight(entry.body, words)
+    return SearchPage(results, page, has_next)
@@ -0,0 +1,266 @@
+"""
+Citas recurrentes (AppointmentSeries).
+
+Las ocurrencias se calculan en memoria con la hora local de la primera (una
+cita semanal a las 09:00 sigue a las 09:00 aunque cambie el horario de
+verano). Los choques de todas se buscan con una consulta por rango y un
+barrido (booking.find_conflicts) y se crean con un solo bulk_create.
+
+"Esta y las siguientes" es un solo UPDATE sobre (series, start_time >= la
+ocurrencia elegida): cancelar, o mover y cambiar el motivo. Al mover, las
+siguientes pasan a una serie nueva con la regla nueva y la original termina
+antes de la ocurrencia elegida.
+
+Como bulk_create y update() no disparan señales, ocupación, conteos, agenda
+e índice se actualizan con bulk.sync_derived y search.index_appointments.
+"""
+import calendar
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
+
+from . import search
+from .agenda import touch_agenda
+from .booking import (
+    APPOINTMENT,
+    OVERLAP_CONSTRAINT,
+    OverlapError,
+    check_overlap_now,
+    defer_overlap_check,
+    find_conflicts,
+    lock_doctor,
+)
+from .bulk import sync_derived
+from .models import ACTIVE_STATUSES, Appointment, AppointmentSeries
+
+MAX_OCCURRENCES = 104
+
+
+class SeriesConflict(Exception):
+    """
+    Alguna ocurrencia choca. `conflicts`: [(start, [mensajes])].
+    """
+
+    def __init__(self, conflicts):
+        super().__init__("Hay ocurrencias que se cruzan con otras citas.")
+        self.conflicts = conflicts
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    # El 31 cae en el último día de los meses más cortos
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def occurrences(start, end, frequency, count=None, until=None, limit=MAX_OCCURRENCES):
+    """
+    [(start, end)] de la regla, a lo sumo `limit`.
+    """
+    first = timezone.localtime(start).replace(tzinfo=None)
+    duration = end - start
+
+    result = []
+    for index in range(limit):
+        if count is not None and index >= count:
+            break
+
+        if frequency == AppointmentSeries.MONTHLY:
+            local = _add_months(first, index)
+        else:
+            weeks = 2 if frequency == AppointmentSeries.BIWEEKLY else 1
+            local = first + timedelta(weeks=weeks * index)
+
+        if until is not None and local.date() > until:
+            break
+
+        occurrence = timezone.make_aware(local)
+        result.append((occurrence, occurrence + duration))
+    return result
+
+
+def _messages(found, starts):
+    messages = []
+    for kind, key in found:
+        if kind == APPOINTMENT:
+            messages.append(f"Se cruza con la cita #{key}.")
+        else:
+            messages.append(f"Se cruza con la ocurrencia del {timezone.localtime(starts[key]):%d/%m/%Y %H:%M}.")
+    return messages
+
+
+def _conflicts(doctor_id, intervals, exclude_pks=()):
+    """
+    [(start, [mensajes])] de las ocurrencias que chocan, en orden.
+    """
+    starts = {key: start for key, start, _ in intervals}
+    found = find_conflicts(doctor_id, intervals, exclude_pks=exclude_pks)
+    return [(starts[key], _messages(found[key], starts)) for key, _, _ in intervals if key in found]
+
+
+# ---------------------------
+# Alta
+# ---------------------------
+
+def create_series(series, skip_conflicts=False):
+    """
+    Guarda `series` (sin guardar aún) y crea sus citas. Con choques lanza
+    SeriesConflict sin guardar nada, salvo que `skip_conflicts` pida crear
+    solo las que no chocan (y quede alguna). Retorna (citas creadas, ocurrencias omitidas).
+    """
+    dates = occurrences(series.start_time, series.end_time, series.frequency, series.count, series.until)
+    if not dates:
+        raise ValueError("La regla de la serie no genera ninguna cita.")
+
+    with transaction.atomic():
+        lock_doctor(series.doctor_id)
+
+        conflicts = _conflicts(series.doctor_id, [(index, start, end) for index, (start, end) in enumerate(dates)])
+        # Si chocan todas no queda nada que crear: también es un rechazo
+        if conflicts and (not skip_conflicts or len(conflicts) == len(dates)):
+            raise SeriesConflict(conflicts)
+
+        skipped = {start for start, _ in conflicts}
+        series.save()
+        try:
+            with transaction.atomic():
+                created = Appointment.objects.bulk_create(
+                    [
+                        Appointment(
+                            series=series,
+                            patient_id=series.patient_id,
+                            doctor_id=series.doctor_id,
+                            start_time=start,
+                            end_time=end,
+                            reason=series.reason,
+                        )
+                        for start, end in dates
+                        if start not in skipped
+                    ]
+                )
+        except IntegrityError as exc:
+            if OVERLAP_CONSTRAINT in str(exc):
+                raise OverlapError() from exc
+            raise
+
+        sync_derived([(series.doctor_id, a.start_time, a.end_time, None, a.status) for a in created])
+        search.index_appointments(created)
+
+    return created, conflicts
+
+
+# ---------------------------
+# Esta y las siguientes
+# ---------------------------
+
+def _following(appointment):
+    return Appointment.objects.filter(series_id=appointment.series_id, start_time__gte=appointment.start_time)
+
+
+def _end_before(series, appointment, delete_empty=False):
+    """
+    La serie original termina antes de `appointment`; si no le queda
+    ninguna cita y `delete_empty`, se borra.
+    """
+    before = Appointment.objects.filter(series=series, start_time__lt=appointment.start_time).count()
+    if not before and delete_empty:
+        series.delete()
+        return
+    series.count, series.until = before, None
+    series.save(update_fields=["count", "until"])
+
+
+def cancel_following(appointment):
+    """
+    Cancela (un UPDATE) esta ocurrencia y las siguientes que siguen activas.
+    Retorna cuántas canceló.
+    """
+    with transaction.atomic():
+        lock_doctor(appointment.doctor_id)
+
+        qs = _following(appointment).filter(status__in=ACTIVE_STATUSES)
+        rows = list(qs.values_list("start_time", "end_time", "status"))
+        qs.update(status="CANCELLED", cache_version=F("cache_version") + 1)
+
+        _end_before(appointment.series, appointment)
+        sync_derived([(appointment.doctor_id, start, end, status, "CANCELLED") for start, end, status in rows])
+
+    return len(rows)
+
+
+def edit_following(appointment, start, end, reason):
+    """
+    Mueve esta ocurrencia y las siguientes (el mismo corrimiento que lleva
+    `appointment` a `start`, con la duración nueva) y les pone `reason`, en
+    un solo UPDATE. Pasan a una serie nueva. Lanza SeriesConflict si alguna
+    activa chocaría. Retorna (serie nueva, cuántas movió).
+    """
+    delta = start - appointment.start_time
+    duration = end - start
+    series = appointment.series
+
+    with transaction.atomic():
+        lock_doctor(appointment.doctor_id)
+
+        rows = list(_following(appointment).values_list("pk", "start_time", "end_time", "status", "reason"))
+        pks = [pk for pk, *_ in rows]
+        moved = [
+            (pk, old_start + delta, old_start + delta + duration)
+            for pk, old_start, _, status, _ in rows
+            if status != "CANCELLED"
+        ]
+        reschedule = bool(delta) or duration != appointment.end_time - appointment.start_time
+        if reschedule:
+            conflicts = _conflicts(appointment.doctor_id, moved, exclude_pks=pks)
+            if conflicts:
+                raise SeriesConflict(conflicts)
+
+        new_series = AppointmentSeries.objects.create(
+            patient_id=series.patient_id,
+            doctor_id=series.doctor_id,
+            frequency=series.frequency,
+            start_time=start,
+            end_time=end,
+            count=len(rows) if series.count is not None else None,
+            until=series.until,
+            reason=reason,
+        )
+
+        try:
+            with transaction.atomic():
+                # Corridas un periodo o más, la ocurrencia N cae donde estaba
+                # la N+1 antes de que esa se mueva: la restricción se revisa
+                # al terminar el UPDATE y no fila por fila
+                defer_overlap_check()
+                # Todas las expresiones del SET leen los valores de antes
+                _following(appointment).update(
+                    start_time=F("start_time") + delta,
+                    end_time=ExpressionWrapper(F("start_time") + delta + duration, output_field=DateTimeField()),
+                    reason=reason,
+                    series=new_series,
+                    cache_version=F("cache_version") + 1,
+                )
+                check_overlap_now()
+        except IntegrityError as exc:
+            if OVERLAP_CONSTRAINT in str(exc):
+                raise OverlapError() from exc
+            raise
+
+        _end_before(series, appointment, delete_empty=True)
+
+        if reschedule:
+            changes = []
+            for _, old_start, old_end, status, _ in rows:
+                changes.append((appointment.doctor_id, old_start, old_end, status, None))
+                changes.append((appointment.doctor_id, old_start + delta, old_start + delta + duration, None, status))
+            sync_derived(changes)
+        else:
+            touch_agenda([appointment.doctor_id])
+
+        if any(old_reason != reason for *_, old_reason in rows):
+            search.index_appointments([Appointment(pk=pk, reason=reason) for pk in pks])
+
+    return new_series, len(rows)
@@ -0,0 +1,147 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import availability, fragments, previews, search, stats, uploads
+from .models import Appointment, SearchEntry
+from .agenda import touch_agenda
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_previous_schedule(sender, instance, raw=False, **kwargs):
+    instance._previous_schedule = None
+    if instance.pk and not raw:
+        instance._previous_schedule = (
+            Appointment.objects.filter(pk=instance.pk)
+            .values_list("doctor_id", "start_time", "end_time", "status")
+            .first()
+        )
+
+
+@receiver(post_save, sender=Appointment)
+def refresh_availability_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    affected = {(instance.doctor_id, day) for day in availability.local_days(instance.start_time, instance.end_time)}
+
+    previous = getattr(instance, "_previous_schedule", None)
+    if previous:
+        doctor_id, start, end, _ = previous
+        affected |= {(doctor_id, day) for day in availability.local_days(start, end)}
+
+    _refresh(affected)
+
+
+@receiver(post_delete, sender=Appointment)
+def refresh_availability_on_delete(sender, instance, **kwargs):
+    _refresh({(instance.doctor_id, day) for day in availability.local_days(instance.start_time, instance.end_time)})
+
+
+def _refresh(affected):
+    by_doctor = {}
+    for doctor_id, day in affected:
+        by_doctor.setdefault(doctor_id, []).append(day)
+    for doctor_id, days in by_doctor.items():
+        availability.refresh_days(doctor_id, days)
+
+
+@receiver(post_save, sender=Appointment)
+def update_daily_stats_on_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = getattr(instance, "_previous_schedule", None)
+    old_key = None
+    if previous and not created:
+        doctor_id, start, _, status = previous
+        old_key = stats.stats_key(doctor_id, start, status)
+
+    stats.apply_change(old_key, stats.stats_key(instance.doctor_id, instance.start_time, instance.status))
+
+
+@receiver(post_delete, sender=Appointment)
+def update_daily_stats_on_delete(sender, instance, **kwargs):
+    stats.apply_change(stats.stats_key(instance.doctor_id, instance.start_time, instance.status), None)
+
+
+@receiver(post_save, sender=Appointment)
+def touch_agenda_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    doctors = {instance.doctor_id}
+    previous = getattr(instance, "_previous_schedule", None)
+    if previous:
+        doctors.add(previous[0])
+    touch_agenda(doctors)
+
+
+@receiver(post_delete, sender=Appointment)
+def touch_agenda_on_delete(sender, instance, **kwargs):
+    touch_agenda([instance.doctor_id])
+
+
+@receiver(post_save, sender=Appointment)
+def bump_fragments_on_appointment_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    fragments.bump_version(instance.pk)
+
+
+@receiver(post_save, sender="notes.ClinicalNote")
+@receiver(post_delete, sender="notes.ClinicalNote")
+@receiver(post_save, sender="prescriptions.Prescription")
+@receiver(post_delete, sender="prescriptions.Prescription")
+@receiver(post_save, sender="prescriptions.AppointmentFile")
+@receiver(post_delete, sender="prescriptions.AppointmentFile")
+def bump_fragments_on_child_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fragments.bump_version(instance.appointment_id)
+
+
+@receiver(post_delete, sender="prescriptions.AppointmentFile")
+@receiver(post_delete, sender="records.MedicalFile")
+def release_blob_on_delete(sender, instance, **kwargs):
+    if instance.blob_id:
+        uploads.release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender="prescriptions.AppointmentFile")
+@receiver(post_save, sender="records.MedicalFile")
+def enqueue_previews_on_create(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        previews.enqueue_previews(instance)
+
+
+# ---------------------------
+# Índice de búsqueda
+# ---------------------------
+
+@receiver(post_save, sender=Appointment)
+def index_appointment_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "reason" not in update_fields):
+        return
+    search.index_appointment(instance)
+
+
+@receiver(post_save, sender="notes.ClinicalNote")
+def index_note_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_note(instance)
+
+
+@receiver(post_save, sender="prescriptions.Prescription")
+def index_prescription_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_prescription(instance)
+
+
+@receiver(post_delete, sender="notes.ClinicalNote")
+def unindex_note_on_delete(sender, instance, **kwargs):
+    search.unindex(SearchEntry.NOTE, instance.pk)
+
+
+@receiver(post_delete, sender="prescriptions.Prescription")
+def unindex_prescription_on_delete(sender, instance, **kwargs):
+    search.unindex(SearchEntry.MEDICATION, instance.pk)
@@ -0,0 +1,173 @@
+"""
+Estadísticas diarias por doctor (DoctorDailyStats) para el dashboard.
+
+Cada cita suma 1 en (doctor, día local de start_time, estado). Las señales
+de Appointment llaman a apply_change() con la clave anterior y la nueva, así
+un cambio de estado o de fecha mueve el conteo sin recorrer la tabla.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Appointment, DoctorDailyStats
+
+STATUSES = [code for code, _ in Appointment.STATUS_CHOICES]
+
+# Desde cuántas claves apply_counts() trabaja por lote en vez de una por una
+BULK_THRESHOLD = 20
+
+
+def stats_key(doctor_id, start_time, status):
+    return (doctor_id, timezone.localtime(start_time).date(), status)
+
+
+def _bump(key, delta):
+    doctor_id, day, status = key
+    lookup = {"doctor_id": doctor_id, "day": day, "status": status}
+
+    if DoctorDailyStats.objects.filter(**lookup).update(count=F("count") + delta):
+        return
+    try:
+        with transaction.atomic():
+            DoctorDailyStats.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        # Otro proceso creó la fila entre el UPDATE y el INSERT
+        DoctorDailyStats.objects.filter(**lookup).update(count=F("count") + delta)
+
+
+def apply_change(old_key, new_key):
+    """
+    old_key / new_key: (doctor_id, day, status) o None (creada / borrada).
+    """
+    if old_key == new_key:
+        return
+    if old_key:
+        _bump(old_key, -1)
+    if new_key:
+        _bump(new_key, 1)
+
+
+def apply_counts(counts):
+    """
+    Aplica varios cambios de una vez: {(doctor_id, day, status): delta}.
+    """
+    counts = {key: delta for key, delta in counts.items() if delta}
+    if len(counts) >= BULK_THRESHOLD:
+        try:
+            with transaction.atomic():
+                _apply_bulk(counts)
+            return
+        except IntegrityError:
+            # Otro proceso creó alguna fila a la vez: clave por clave
+            pass
+
+    for key, delta in counts.items():
+        _bump(key, delta)
+
+
+def _apply_bulk(counts):
+    """
+    Una consulta para las filas existentes (bloqueadas), un bulk_update y
+    un bulk_create para las que faltan.
+    """
+    doctors = {doctor_id for doctor_id, _, _ in counts}
+    days = [day for _, day, _ in counts]
+    rows = {
+        (row.doctor_id, row.day, row.status): row
+        for row in DoctorDailyStats.objects.select_for_update().filter(
+            doctor_id__in=doctors, day__range=(min(days), max(days))
+        )
+    }
+
+    changed, missing = [], []
+    for key, delta in counts.items():
+        row = rows.get(key)
+        if row is None:
+            doctor_id, day, status = key
+            missing.append(DoctorDailyStats(doctor_id=doctor_id, day=day, status=status, count=delta))
+        else:
+            row.count += delta
+            changed.append(row)
+
+    DoctorDailyStats.objects.bulk_update(changed, ["count"], batch_size=500)
+    DoctorDailyStats.objects.bulk_create(missing, batch_size=500)
+
+
+def rebuild(doctor_id=None):
+    """
+    Recalcula las estadísticas desde Appointment (todas o de un doctor).
+    """
+    qs = Appointment.objects.all()
+    stats = DoctorDailyStats.objects.all()
+    if doctor_id:
+        qs = qs.filter(doctor_id=doctor_id)
+        stats = stats.filter(doctor_id=doctor_id)
+
+    rows = (
+        qs.annotate(day=TruncDate("start_time"))
+        .values("doctor_id", "day", "status")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        stats.delete()
+        DoctorDailyStats.objects.bulk_create(
+            (
+                DoctorDailyStats(doctor_id=r["doctor_id"], day=r["day"], status=r["status"], count=r["total"])
+                for r in rows.iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+def _empty_counts():
+    counts = {status.lower(): 0 for status in STATUSES}
+    counts["total"] = 0
+    return counts
+
+
+def _add(counts, status, n):
+    counts[status.lower()] += n
+    counts["total"] += n
+
+
+def dashboard_counts(doctor_id, now=None):
+    """
+    Retorna (today_counts, upcoming_counts) con las claves total, pending,
+    confirmed, cancelled y done.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+
+    today_counts = _empty_counts()
+    for status, n in DoctorDailyStats.objects.filter(doctor_id=doctor_id, day=today).values_list(
+        "status", "count"
+    ):
+        _add(today_counts, status, n)
+
+    upcoming_counts = _empty_counts()
+    future = (
+        DoctorDailyStats.objects.filter(doctor_id=doctor_id, day__gt=today)
+        .values("status")
+        .annotate(n=Sum("count"))
+        .order_by()
+    )
+    for row in future:
+        _add(upcoming_counts, row["status"], row["n"])
+
+    # Lo que queda de hoy sí se cuenta en la tabla de citas (un solo día)
+    tomorrow = timezone.make_aware(datetime.combine(today + timedelta(days=1), time.min))
+    rest_of_today = (
+        Appointment.objects.filter(doctor_id=doctor_id, start_time__gte=now, start_time__lt=tomorrow)
+        .values("status")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for row in rest_of_today:
+        _add(upcoming_counts, row["status"], row["n"])
+
+    return today_counts, upcoming_counts
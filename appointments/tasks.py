@@ -1,28 +1,162 @@
+import logging
+
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
-from django.core.mail import send_mail
-from .models import Appointment
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from .models import ACTIVE_STATUSES, Appointment, AuditEvent
+
+REMINDER_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def _reminder_message(appt, connection):
+    return EmailMessage(
+        subject="Confirmación de cita",
+        body=f"Hola {appt.patient}. Tu cita es el {appt.start_time}. Responde para confirmar.",
+        to=[appt.patient.user.email],
+        connection=connection,
+    )
+
+
+def _claim_reminders(ids, now):
+    """
+    Marca reminder_sent_at en las citas del lote que nadie más ha tomado y
+    retorna sus ids. Dos ejecuciones simultáneas nunca toman la misma cita.
+    """
+    with transaction.atomic():
+        claimed = list(
+            Appointment.objects.select_for_update(skip_locked=True)
+            .filter(id__in=ids, reminder_sent_at__isnull=True)
+            .values_list("id", flat=True)
+        )
+        Appointment.objects.filter(id__in=claimed).update(reminder_sent_at=now)
+    return set(claimed)
+
 
 @shared_task
-def send_confirmations_24h():
+def send_confirmations_24h(batch_size=REMINDER_BATCH_SIZE):
     now = timezone.now()
     start = now + timedelta(hours=24)
     end = now + timedelta(hours=25)
 
-    qs = Appointment.objects.filter(
-        status__in=["PENDING", "CONFIRMED"],
-        start_time__range=(start, end),
-    ).select_related("patient__user")
+    qs = (
+        Appointment.objects.filter(
+            status__in=ACTIVE_STATUSES,
+            start_time__range=(start, end),
+            reminder_sent_at__isnull=True,
+        )
+        .exclude(patient__user__email="")
+        .select_related("patient__user")
+        .only(
+            "id",
+            "start_time",
+            "patient__user__email",
+            "patient__user__username",
+            "patient__user__first_name",
+            "patient__user__last_name",
+        )
+        .order_by("start_time", "id")
+    )
 
-    for appt in qs:
-        email = appt.patient.user.email
-        if not email:
+    sent = 0
+    connection = get_connection()
+    connection.open()
+    try:
+        batch = []
+        for appt in qs.iterator(chunk_size=batch_size):
+            batch.append(appt)
+            if len(batch) >= batch_size:
+                sent += _send_reminder_batch(batch, connection, now)
+                batch = []
+        if batch:
+            sent += _send_reminder_batch(batch, connection, now)
+    finally:
+        connection.close()
+
+    return sent
+
+
+def _send_reminder_batch(batch, connection, now):
+    claimed = _claim_reminders([appt.id for appt in batch], now)
+    if not claimed:
+        return 0
+
+    # Un correo a la vez (por la misma conexión): un error de SMTP solo
+    # libera esa cita para que la próxima ejecución la reintente
+    sent, failed = 0, []
+    for appt in batch:
+        if appt.id not in claimed:
             continue
-        send_mail(
-            subject="Confirmación de cita",
-            message=f"Hola {appt.patient}. Tu cita es el {appt.start_time}. Responde para confirmar.",
-            from_email=None,
-            recipient_list=[email],
-            fail_silently=True,
-        )
+        try:
+            sent += connection.send_messages([_reminder_message(appt, connection)]) or 0
+        except Exception:
+            logger.warning("No se pudo enviar el recordatorio de la cita %s", appt.id, exc_info=True)
+            failed.append(appt.id)
+
+    if failed:
+        Appointment.objects.filter(id__in=failed, reminder_sent_at=now).update(reminder_sent_at=None)
+    return sent
+
+
+@shared_task
+def send_outbound_emails(batch_size=100):
+    from .outbox import drain
+
+    return drain(batch_size=batch_size)
+
+
+@shared_task
+def write_audit_events(rows):
+    AuditEvent.objects.bulk_create(
+        [AuditEvent(**{**row, "created_at": parse_datetime(row["created_at"])}) for row in rows]
+    )
+
+
+@shared_task
+def purge_stale_uploads():
+    from .uploads import purge_stale_sessions
+
+    return purge_stale_sessions()
+
+
+@shared_task
+def generate_file_previews(model_label, pk):
+    from django.apps import apps
+
+    from .previews import build_previews
+
+    obj = apps.get_model(model_label).objects.filter(pk=pk).first()
+    if obj is None:
+        return {}
+    return build_previews(obj)
+
+
+@shared_task
+def render_day_pdf(doctor_id, day):
+    from django.utils.dateparse import parse_date
+
+    from .print_day import store_day
+
+    return store_day(doctor_id, parse_date(day))
+
+
+@shared_task
+def rollover_past_appointments(batch_size=None):
+    """
+    Cierra las citas activas de días anteriores (ver bulk.ROLLOVER), de a
+    ROLLOVER_BATCH_SIZE por transacción. Retorna cuántas cerró.
+    """
+    from .bulk import ROLLOVER_BATCH_SIZE, rollover_batch, rollover_cutoff
+
+    batch_size = batch_size or ROLLOVER_BATCH_SIZE
+    cutoff = rollover_cutoff()
+    total = 0
+    while True:
+        closed = rollover_batch(cutoff, batch_size)
+        total += closed
+        if closed < batch_size:
+            return total
@@ -1,3 +1,1728 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from uuid import UUID
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from accounts.roles import role_for
+from clinic import metrics
+from notes.models import ClinicalNote
+from patients.models import Patient
+from prescriptions.models import AppointmentFile, Prescription
+
+from . import (
+    availability,
+    booking,
+    bulk,
+    exports,
+    fragments,
+    outbox,
+    pagination,
+    pdf,
+    pdf_cache,
+    previews,
+    print_day,
+    search,
+    stats,
+    tasks,
+    uploads,
+    views,
+)
+from .admin import AuditEventAdmin
+from .booking import OVERLAP_ERROR, overlapping
+from .forms import AppointmentForm, AppointmentSeriesForm
+from .management.commands import explain_hot_queries
+from .middleware import AuditMiddleware
+from .models import (
+    Appointment,
+    AppointmentSeries,
+    AuditEvent,
+    DoctorDailyStats,
+    DoctorDayAvailability,
+    OutboundEmail,
+    SearchEntry,
+    StoredBlob,
+    UploadSession,
+)
+from .series import (
+    MAX_OCCURRENCES,
+    SeriesConflict,
+    cancel_following,
+    create_series,
+    edit_following,
+    occurrences,
+)
+from .utils import log_action
+
+
+def _form_data(patient, start, minutes=30):
+    fmt = "%Y-%m-%dT%H:%M"
+    return {
+        "patient": patient.pk,
+        "start_time": timezone.localtime(start).strftime(fmt),
+        "end_time": timezone.localtime(start + timedelta(minutes=minutes)).strftime(fmt),
+        "status": "PENDING",
+        "reason": "Control",
+    }
+
+
+def _at(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def _bulk_row(patient, start, minutes=30, **extra):
+    end = start + timedelta(minutes=minutes)
+    return {"patient": patient.pk, "start": start.isoformat(), "end": end.isoformat(), **extra}
+
+
+class DerivedDataMixin:
+    """
+    Los caminos por lote (bulk_create / update()) no disparan señales: las
+    tablas derivadas que mantienen deben quedar igual que recalculadas.
+    """
+
+    def assertDerivedConsistent(self, doctor):
+        def daily():
+            rows = DoctorDailyStats.objects.filter(doctor=doctor, count__gt=0)
+            return sorted(rows.values_list("day", "status", "count"))
+
+        kept = daily()
+        stats.rebuild(doctor.pk)
+        self.assertEqual(kept, daily())
+
+        stored = {
+            day: availability.from_bytes(raw)
+            for day, raw in DoctorDayAvailability.objects.filter(doctor=doctor).values_list("day", "booked")
+        }
+        self.assertEqual(stored, availability.build_booked(doctor.pk, list(stored)))
+
+        indexed = SearchEntry.objects.filter(kind=SearchEntry.REASON, appointment__doctor=doctor)
+        reasons = Appointment.objects.filter(doctor=doctor).exclude(reason="")
+        self.assertEqual(
+            dict(indexed.values_list("object_id", "body")), dict(reasons.values_list("pk", "reason"))
+        )
+
+
+class AppointmentFormOverlapTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.start = (timezone.now() + timedelta(days=1)).replace(second=0, microsecond=0)
+
+    def test_overlap_maps_to_form_error(self):
+        first = AppointmentForm(_form_data(self.patient, self.start), doctor=self.doctor)
+        self.assertTrue(first.is_valid())
+        self.assertIsNotNone(first.save_booking())
+
+        second = AppointmentForm(
+            _form_data(self.patient, self.start + timedelta(minutes=15)), doctor=self.doctor
+        )
+        self.assertTrue(second.is_valid())
+        self.assertIsNone(second.save_booking())
+        self.assertEqual(second.non_field_errors(), [OVERLAP_ERROR])
+
+    def test_cancelled_slot_can_be_rebooked(self):
+        form = AppointmentForm(_form_data(self.patient, self.start), doctor=self.doctor)
+        self.assertTrue(form.is_valid())
+        appt = form.save_booking()
+        appt.status = "CANCELLED"
+        appt.save()
+
+        again = AppointmentForm(_form_data(self.patient, self.start), doctor=self.doctor)
+        self.assertTrue(again.is_valid())
+        self.assertIsNotNone(again.save_booking())
+
+
+class AdminOverlapTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.start = (timezone.now() + timedelta(days=1)).replace(second=0, microsecond=0)
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.admin,
+            start_time=self.start,
+            end_time=self.start + timedelta(minutes=30),
+        )
+
+    def _post(self, start):
+        local = timezone.localtime(start)
+        end = timezone.localtime(start + timedelta(minutes=30))
+        self.client.force_login(self.admin)
+        return self.client.post(
+            reverse("admin:appointments_appointment_add"),
+            {
+                "patient": self.patient.pk,
+                "doctor": self.admin.pk,
+                "start_time_0": local.strftime("%d/%m/%Y"),
+                "start_time_1": local.strftime("%H:%M"),
+                "end_time_0": end.strftime("%d/%m/%Y"),
+                "end_time_1": end.strftime("%H:%M"),
+                "status": "PENDING",
+                "reason": "",
+            },
+            secure=True,
+        )
+
+    def test_overlap_is_a_form_error(self):
+        response = self._post(self.start + timedelta(minutes=15))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["adminform"].form.non_field_errors(), [OVERLAP_ERROR])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_overlap_after_clean_is_a_message(self):
+        with mock.patch("appointments.admin.overlapping") as overlapping:
+            overlapping.return_value.exists.return_value = False
+            response = self._post(self.start + timedelta(minutes=15))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_free_slot_is_saved(self):
+        response = self._post(self.start + timedelta(hours=1))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.start = (timezone.now() + timedelta(days=1)).replace(second=0, microsecond=0)
+
+    def test_same_slot_from_many_threads(self):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+        errors = []
+
+        def book():
+            try:
+                form = AppointmentForm(_form_data(self.patient, self.start), doctor=self.doctor)
+                form.is_valid()
+                barrier.wait()
+                results.append(form.save_booking() is not None)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor).count(), 1)
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class OutboxTests(TestCase):
+    def setUp(self):
+        # Los adjuntos se renderizan y se guardan en la caché de PDFs
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user("pat", email="pat@example.com", password="x")
+        )
+        start = timezone.now() + timedelta(days=1)
+        self.appt = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            start_time=start,
+            end_time=start + timedelta(minutes=30),
+        )
+        Prescription.objects.create(appointment=self.appt, medication="Ibuprofeno")
+
+    def test_email_view_only_enqueues(self):
+        self.client.force_login(self.doctor)
+        response = self.client.post(
+            reverse("appointment_prescriptions_email", args=[self.appt.pk]), secure=True
+        )
+
+        self.assertRedirects(
+            response,
+            reverse("appointment_detail", args=[self.appt.pk]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.to, email.status), ("pat@example.com", "PENDING"))
+
+    def test_drain_sends_batch_with_attachment(self):
+        for _ in range(3):
+            outbox.enqueue_email("pat@example.com", "Receta", "Hola", self.appt, attach_prescriptions=True)
+
+        result = outbox.drain(batch_size=2)
+
+        self.assertEqual(result, {"sent": 3, "failed": 0})
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].attachments[0][2], "application/pdf")
+        self.assertFalse(OutboundEmail.objects.exclude(status="SENT").exists())
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_fail(self):
+        email = outbox.enqueue_email("pat@example.com", "Aviso", "Hola")
+
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=OSError("smtp caído"),
+        ):
+            self.assertEqual(outbox.drain(), {"sent": 0, "failed": 1})
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ("PENDING", 1))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+
+            # No se reintenta antes de tiempo
+            self.assertEqual(outbox.drain(), {"sent": 0, "failed": 0})
+
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            outbox.drain()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ("FAILED", 2))
+            self.assertIn("smtp caído", email.last_error)
+
+
+class PdfCacheTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+        doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = timezone.now() + timedelta(days=1)
+        self.appt = Appointment.objects.create(
+            patient=patient, doctor=doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        Prescription.objects.create(appointment=self.appt, medication="Ibuprofeno")
+
+    def test_evicted_between_exists_and_open_is_regenerated(self):
+        name = pdf_cache.get_prescriptions_pdf(self.appt)
+        real_open = default_storage.open
+
+        def evicted_once(path, mode="rb"):
+            if default_storage.exists(path) and not hasattr(evicted_once, "done"):
+                evicted_once.done = True
+                default_storage.delete(path)
+            return real_open(path, mode)
+
+        with mock.patch.object(default_storage, "open", side_effect=evicted_once):
+            data = pdf_cache.read_prescriptions_pdf(self.appt)
+
+        self.assertTrue(data.startswith(b"%PDF"))
+        self.assertTrue(default_storage.exists(name))
+
+    def test_add_bytes_walks_only_over_the_limit(self):
+        with override_settings(PDF_CACHE_MAX_BYTES=1000), mock.patch.object(pdf_cache, "evict") as evict:
+            pdf_cache.add_bytes(600)
+            evict.assert_not_called()
+            pdf_cache.add_bytes(600)
+            evict.assert_called_once()
+
+
+class PrescriptionsPdfTests(TestCase):
+    def render(self, *datas):
+        # Sin compresión, el texto de la receta queda legible en el PDF
+        with mock.patch("reportlab.rl_config.pageCompression", 0):
+            out = pdf.render_prescriptions(datas)
+        self.addCleanup(out.close)
+        return out
+
+    def data(self, items):
+        return {"id": 7, "patient": "Ana Pérez", "start": "2026-03-02 10:00", "items": items}
+
+    def pages(self, content):
+        return len(re.findall(rb"/Type /Page\b(?!s)", content))
+
+    def test_without_items(self):
+        content = self.render(self.data([])).read()
+        self.assertTrue(content.startswith(b"%PDF"))
+        self.assertIn(b"No hay medicamentos registrados.", content)
+        self.assertEqual(self.pages(content), 1)
+
+    def test_long_list_spans_pages(self):
+        items = [pdf.item(f"Ibuprofeno {i}", "400 mg", "c/8h", "5 días") for i in range(60)]
+        content = self.render(self.data(items), self.data([pdf.item("Amoxicilina", None, None, None)])).read()
+
+        self.assertTrue(content.startswith(b"%PDF"))
+        self.assertTrue(content.rstrip().endswith(b"%%EOF"))
+        self.assertGreaterEqual(self.pages(content), 4)
+        for i in (0, 30, 59):
+            self.assertIn(f"- Ibuprofeno {i}".encode(), content)
+        self.assertIn(b"- Amoxicilina", content)
+
+    def test_spools_to_disk_over_the_limit(self):
+        items = [pdf.item(f"Paracetamol {i}", None, None, None) for i in range(10)]
+        with mock.patch.object(pdf, "SPOOL_MAX_BYTES", 512):
+            out = self.render(self.data(items))
+
+        self.assertTrue(out._rolled)
+        content = out.read()
+        self.assertGreater(len(content), 512)
+        self.assertTrue(content.startswith(b"%PDF"))
+        self.assertIn(b"- Paracetamol 9", content)
+
+
+class PreviewTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = _at(date(2027, 1, 4), 9)
+        self.appt = Appointment.objects.create(
+            patient=patient, doctor=doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+
+    def _attach(self, content, filename):
+        blob, _ = uploads.store_blob(
+            ContentFile(content), hashlib.sha256(content).hexdigest(), len(content), filename
+        )
+        obj = AppointmentFile(appointment=self.appt, title=filename)
+        uploads.attach_blob(obj, blob)
+        obj.save()
+        return obj
+
+    def _png(self, size=(1600, 800)):
+        out = BytesIO()
+        Image.new("RGB", size, "teal").save(out, "PNG")
+        return out.getvalue()
+
+    def test_image_gets_webp_derivatives(self):
+        obj = self._attach(self._png(), "rx.png")
+
+        names = previews.build_previews(obj)
+
+        self.assertEqual(set(names), {"thumbnail", "preview"})
+        for size, (max_side, _) in previews.SIZES.items():
+            self.assertEqual(names[size], previews.derivative_name(obj.file.name, size))
+            with default_storage.open(names[size]) as fh, Image.open(fh) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(max(image.size), max_side)
+        obj.refresh_from_db()
+        self.assertEqual((obj.thumbnail.name, obj.preview.name), (names["thumbnail"], names["preview"]))
+
+        default_storage.delete(names["preview"])
+        self.assertEqual(previews.ensure_preview(obj, "preview"), names["preview"])
+        self.assertTrue(default_storage.exists(names["preview"]))
+
+    def test_non_image_and_corrupt_files_have_no_preview(self):
+        pdf_file = self._attach(b"%PDF-1.4", "informe.pdf")
+        self.assertEqual(previews.build_previews(pdf_file), {})
+
+        corrupt = self._attach(b"no es una imagen", "roto.png")
+        with self.assertLogs("appointments.previews", "WARNING"):
+            self.assertEqual(previews.build_previews(corrupt), {})
+            self.assertIsNone(previews.ensure_preview(corrupt, "thumbnail"))
+
+        for obj in (pdf_file, corrupt):
+            obj.refresh_from_db()
+            self.assertFalse(obj.thumbnail)
+            self.assertFalse(default_storage.exists(previews.derivative_name(obj.file.name, "thumbnail")))
+
+    def test_previews_are_deleted_with_the_last_reference(self):
+        png = self._png((300, 300))
+        first = self._attach(png, "rx.png")
+        second = self._attach(png, "copia.png")
+        names = previews.build_previews(first)
+
+        with mock.patch.object(previews, "delete_previews", wraps=previews.delete_previews) as delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                first.delete()
+            delete.assert_not_called()
+            self.assertTrue(default_storage.exists(names["thumbnail"]))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                second.delete()
+            delete.assert_called_once_with(second.file.name)
+
+        self.assertFalse(default_storage.exists(second.file.name))
+        for name in names.values():
+            self.assertFalse(default_storage.exists(name))
+
+
+class PatientStatusTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = _at(date(2027, 1, 4), 9)
+        self.appt = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        self.client.force_login(self.patient.user)
+
+    def _post(self, name):
+        with mock.patch.object(views, "save_appointment", wraps=booking.save_appointment) as save:
+            response = self.client.post(reverse(name, args=[self.appt.pk]), secure=True)
+        save.assert_called_once()
+        self.appt.refresh_from_db()
+        return response
+
+    def test_confirm_and_cancel_go_through_save_appointment(self):
+        self._post("patient_confirm_appointment")
+        self.assertEqual(self.appt.status, "CONFIRMED")
+
+        self._post("patient_cancel_appointment")
+        self.assertEqual(self.appt.status, "CANCELLED")
+
+    def test_confirm_over_a_taken_slot_is_rejected(self):
+        # Cruce heredado (creado sin pasar por save_appointment)
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            start_time=self.appt.start_time + timedelta(minutes=15),
+            end_time=self.appt.end_time + timedelta(minutes=15),
+            status="CONFIRMED",
+        )
+
+        response = self._post("patient_confirm_appointment")
+
+        self.assertEqual(self.appt.status, "PENDING")
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], [OVERLAP_ERROR])
+
+
+class StreamingMetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(METRICS_DIR=Path(directory))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = timezone.now() - timedelta(days=3)
+        Appointment.objects.create(
+            patient=patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+
+    def test_queries_while_streaming_are_counted(self):
+        self.client.force_login(self.doctor)
+
+        def queries(inc):
+            return [c.args[1] for c in inc.call_args_list if c.args[0] == "clinic_http_db_queries_total"]
+
+        with mock.patch("clinic.metrics.inc") as inc:
+            response = self.client.get(reverse("appointment_history_export"), secure=True)
+            # Aún no se recorrió: la petición no se registró
+            self.assertEqual(queries(inc), [])
+
+            body = b"".join(response.streaming_content)
+            response.close()
+
+        self.assertIn(b"\n", body)
+        self.assertEqual(len(queries(inc)), 1)
+        self.assertGreater(queries(inc)[0], 0)
+
+    def test_dead_process_files_are_archived(self):
+        directory = metrics._metrics_dir()
+        host = socket.gethostname()
+        process = subprocess.Popen(["true"])
+        process.wait()
+        dead_pid = process.pid
+
+        row = [["clinic_tasks_total", {"task": "t", "outcome": "success"}, 2.0]]
+        for pid in (os.getpid(), dead_pid):
+            (directory / f"{host}-{pid}.json").write_text(json.dumps(row))
+        (directory / f"otro-host-{dead_pid}.json").write_text(json.dumps(row))
+
+        key = ("clinic_tasks_total", (("outcome", "success"), ("task", "t")))
+        self.assertEqual(metrics._collect()[key], 6.0)
+        self.assertFalse((directory / f"{host}-{dead_pid}.json").exists())
+        self.assertTrue((directory / f"{host}-{os.getpid()}.json").exists())
+        self.assertTrue((directory / f"otro-host-{dead_pid}.json").exists())
+
+        # Otro proceso que termina se suma al archivo existente
+        (directory / f"{host}-{dead_pid}.json").write_text(json.dumps(row))
+        self.assertEqual(metrics._collect()[key], 8.0)
+        self.assertEqual(len(list(directory.glob("*.json"))), 3)
+
+
+class ChunkedUploadTests(TestCase):
+    CONTENT = b"radiografia-" * 100
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media, CHUNKED_UPLOAD_DIR=f"{media}/_uploads")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = timezone.now() + timedelta(days=1)
+        self.appt = Appointment.objects.create(
+            patient=patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        self.client.force_login(self.doctor)
+
+    def _start(self, content=CONTENT):
+        response = self.client.post(
+            reverse("upload_start", args=[self.appt.pk]),
+            json.dumps({"kind": "appointment_file", "filename": "rx.png", "size": len(content)}),
+            content_type="application/json",
+            secure=True,
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["url"]
+
+    def _put(self, url, offset, chunk, sha256=""):
+        headers = {"Upload-Offset": str(offset)}
+        if sha256:
+            headers["X-Chunk-SHA256"] = sha256
+        return self.client.put(
+            url, chunk, content_type="application/octet-stream", headers=headers, secure=True
+        )
+
+    def _upload(self, content=CONTENT):
+        url = self._start(content)
+        response = self._put(url, 0, content)
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_resume_after_wrong_offset_and_bad_digest(self):
+        url = self._start()
+        half = len(self.CONTENT) // 2
+        first, second = self.CONTENT[:half], self.CONTENT[half:]
+
+        self.assertEqual(self._put(url, 0, first).json()["offset"], half)
+
+        wrong = self._put(url, 0, second)
+        self.assertEqual((wrong.status_code, wrong.json()["offset"]), (409, half))
+
+        bad = self._put(url, half, second, sha256="0" * 64)
+        self.assertEqual((bad.status_code, bad.json()["offset"]), (400, half))
+        self.assertEqual(self.client.get(url, secure=True).json()["offset"], half)
+
+        done = self._put(url, half, second, sha256=hashlib.sha256(second).hexdigest())
+        self.assertEqual(done.status_code, 201)
+        self.assertEqual(done.json()["sha256"], hashlib.sha256(self.CONTENT).hexdigest())
+        with default_storage.open(StoredBlob.objects.get().file.name, "rb") as fh:
+            self.assertEqual(fh.read(), self.CONTENT)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertNotIn(UUID(url.rstrip("/").rsplit("/", 1)[1]), uploads._hashers)
+
+    def test_failed_finish_is_retried_with_empty_put(self):
+        url = self._start()
+        with mock.patch("appointments.uploads.store_blob", side_effect=uploads.UploadError("falla", status=409)):
+            self.assertEqual(self._put(url, 0, self.CONTENT).status_code, 409)
+
+        self.assertEqual(self._put(url, len(self.CONTENT), self.CONTENT).status_code, 400)
+        retry = self._put(url, len(self.CONTENT), b"")
+        self.assertEqual(retry.status_code, 201)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_same_content_shares_blob_until_last_release(self):
+        first = self._upload()
+        second = self._upload()
+
+        self.assertFalse(first["deduplicated"])
+        self.assertTrue(second["deduplicated"])
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+
+        files = self.appt.prescription_files.order_by("id")
+        with self.captureOnCommitCallbacks(execute=True):
+            files.first().delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            files.get().delete()
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_new_blob_never_reuses_a_file_left_on_disk(self):
+        canonical = uploads.blob_name(hashlib.sha256(self.CONTENT).hexdigest(), "rx.png")
+        # El archivo de un blob liberado cuyo borrado aún no corrió
+        default_storage.save(canonical, ContentFile(b"viejo"))
+
+        self._upload()
+
+        name = StoredBlob.objects.get().file.name
+        self.assertNotEqual(name, canonical)
+        with default_storage.open(name, "rb") as fh:
+            self.assertEqual(fh.read(), self.CONTENT)
+
+
+@override_settings(PRINT_DAY_ASYNC_THRESHOLD=1)
+class PrintDayTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+        self.doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.day = timezone.localdate() + timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(self.day, time(9)))
+        appt = Appointment.objects.create(
+            patient=patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        Prescription.objects.create(appointment=appt, medication="Ibuprofeno")
+        self.client.force_login(self.doctor)
+
+    def _get(self):
+        return self.client.get(reverse("doctor_day_pdf"), {"date": self.day.isoformat()}, secure=True)
+
+    def test_cached_pdf_is_audited(self):
+        print_day.store_day(self.doctor.id, self.day)
+
+        response = self._get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+        self.assertEqual(AuditEvent.objects.filter(action="PDF").count(), 1)
+
+    def test_missing_pdf_is_queued_without_audit(self):
+        with mock.patch.object(print_day, "queue_day", return_value=True) as queue_day:
+            response = self._get()
+
+        self.assertEqual(response.status_code, 202)
+        queue_day.assert_called_once()
+        self.assertFalse(AuditEvent.objects.filter(action="PDF").exists())
+
+
+class BulkApiAuthTests(TestCase):
+    def test_anonymous_gets_json_401(self):
+        calls = [
+            (self.client.get, "api_appointments"),
+            (self.client.post, "api_appointments"),
+            (self.client.post, "api_appointments_status"),
+        ]
+        for call, name in calls:
+            response = call(reverse(name), secure=True)
+            self.assertEqual(response.status_code, 401)
+            self.assertIn("error", response.json())
+
+    def test_status_endpoint_is_post_only(self):
+        self.assertEqual(self.client.get(reverse("api_appointments_status"), secure=True).status_code, 405)
+
+
+class SeriesTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+
+    def _series(self, **kwargs):
+        fields = {
+            "patient": self.patient,
+            "doctor": self.doctor,
+            "frequency": AppointmentSeries.WEEKLY,
+            "start_time": _at(self.MONDAY, 9),
+            "end_time": _at(self.MONDAY, 10),
+            "count": 5,
+            "reason": "Terapia",
+        }
+        fields.update(kwargs)
+        return AppointmentSeries(**fields)
+
+    def _block(self, day, hour=9):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=_at(day, hour), end_time=_at(day, hour, 30)
+        )
+
+    def _starts(self, qs):
+        starts = qs.order_by("start_time").values_list("start_time", flat=True)
+        return [timezone.localtime(start) for start in starts]
+
+    def test_monthly_clamps_to_month_end(self):
+        start = _at(date(2027, 1, 31), 9)
+        found = occurrences(start, start + timedelta(hours=1), AppointmentSeries.MONTHLY, count=3)
+        days = [s.date() for s, _ in found]
+        self.assertEqual(days, [date(2027, 1, 31), date(2027, 2, 28), date(2027, 3, 31)])
+
+    def test_until_is_inclusive(self):
+        start = _at(self.MONDAY, 9)
+        end = start + timedelta(hours=1)
+        found = occurrences(start, end, AppointmentSeries.BIWEEKLY, until=date(2027, 2, 15))
+        self.assertEqual([s.date() for s, _ in found][-1], date(2027, 2, 15))
+        self.assertEqual(len(found), 4)
+
+    def test_occurrences_are_capped(self):
+        start = _at(self.MONDAY, 9)
+        end = start + timedelta(hours=1)
+        far = date(2040, 1, 1)
+        self.assertEqual(len(occurrences(start, end, AppointmentSeries.WEEKLY, until=far)), MAX_OCCURRENCES)
+        self.assertEqual(len(occurrences(start, end, AppointmentSeries.WEEKLY, count=500)), MAX_OCCURRENCES)
+
+    def test_conflict_rejects_whole_series(self):
+        block = self._block(self.MONDAY + timedelta(weeks=2), hour=9)
+
+        with self.assertRaises(SeriesConflict) as caught:
+            create_series(self._series())
+
+        [(start, messages)] = caught.exception.conflicts
+        self.assertEqual(start, _at(self.MONDAY + timedelta(weeks=2), 9))
+        self.assertIn(f"#{block.pk}", messages[0])
+        self.assertFalse(AppointmentSeries.objects.exists())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_skip_conflicts_creates_the_free_dates(self):
+        self._block(self.MONDAY + timedelta(weeks=2), hour=9)
+
+        created, skipped = create_series(self._series(), skip_conflicts=True)
+
+        self.assertEqual((len(created), len(skipped)), (4, 1))
+        self.assertEqual(Appointment.objects.filter(series__isnull=False).count(), 4)
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_all_conflicts_rejected_even_when_skipping(self):
+        self._block(self.MONDAY, hour=9)
+
+        with self.assertRaises(SeriesConflict):
+            create_series(self._series(count=1), skip_conflicts=True)
+        self.assertFalse(AppointmentSeries.objects.exists())
+
+    def test_edit_following_by_one_period_splits_the_series(self):
+        created, _ = create_series(self._series())
+        third = created[2]
+
+        # Una semana más tarde: cada ocurrencia cae donde estaba la siguiente
+        start = third.start_time + timedelta(weeks=1)
+        new_series, moved = edit_following(third, start, start + timedelta(minutes=45), "Control")
+
+        old = AppointmentSeries.objects.exclude(pk=new_series.pk).get()
+        self.assertEqual((moved, old.count, new_series.count), (3, 2, 3))
+        self.assertEqual(
+            self._starts(new_series.appointments.all()),
+            [timezone.localtime(a.start_time) + timedelta(weeks=1) for a in created[2:]],
+        )
+        self.assertEqual(set(new_series.appointments.values_list("reason", flat=True)), {"Control"})
+        for appt in new_series.appointments.all():
+            self.assertEqual(appt.end_time - appt.start_time, timedelta(minutes=45))
+        self.assertEqual(old.appointments.count(), 2)
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_edit_following_checks_conflicts_outside_the_series(self):
+        created, _ = create_series(self._series())
+        self._block(self.MONDAY + timedelta(weeks=4), hour=11)
+
+        with self.assertRaises(SeriesConflict):
+            second = created[1]
+            edit_following(second, second.start_time + timedelta(hours=2), second.end_time + timedelta(hours=2), "")
+        self.assertEqual(AppointmentSeries.objects.count(), 1)
+
+    def test_cancel_following(self):
+        created, _ = create_series(self._series())
+
+        self.assertEqual(cancel_following(created[3]), 2)
+
+        series = AppointmentSeries.objects.get()
+        self.assertEqual(series.count, 3)
+        statuses = list(series.appointments.order_by("start_time").values_list("status", flat=True))
+        self.assertEqual(statuses, ["PENDING"] * 3 + ["CANCELLED"] * 2)
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_form_rejects_zero_count(self):
+        form = AppointmentSeriesForm(
+            {
+                "patient": self.patient.pk,
+                "start_time": "2027-01-04T09:00",
+                "end_time": "2027-01-04T10:00",
+                "frequency": AppointmentSeries.WEEKLY,
+                "count": 0,
+                "until": "2027-03-01",
+            }
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn("count", form.errors)
+
+
+class AvailabilityTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+
+    def _book(self, hour, minute=0, minutes=30, status="PENDING"):
+        start = _at(self.MONDAY, hour, minute)
+        return Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            start_time=start,
+            end_time=start + timedelta(minutes=minutes),
+            status=status,
+        )
+
+    def _free(self, day=None, length=30, limit=4):
+        day = day or self.MONDAY
+        return [
+            timezone.localtime(start).time()
+            for start, _ in availability.find_free_slots(self.doctor.pk, day, day, length, limit=limit)
+        ]
+
+    def test_free_slots_skip_bookings_and_off_hours(self):
+        self._book(8, 30)
+        self._book(9, 40, minutes=20)
+
+        self.assertEqual(self._free(), [time(8), time(9), time(10), time(10, 30)])
+        self.assertEqual(self._free(length=45, limit=1), [time(10)])
+        self.assertEqual(self._free(day=self.MONDAY + timedelta(days=5)), [])
+
+    def test_cancelled_appointment_frees_its_slot(self):
+        appt = self._book(8)
+        self.assertEqual(self._free(limit=1), [time(8, 30)])
+
+        appt.status = "CANCELLED"
+        appt.save()
+
+        self.assertEqual(self._free(limit=1), [time(8)])
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_bulk_paths_refresh_stored_bitmaps(self):
+        # La fila del día ya existe antes de los cambios por lote
+        self._free()
+        self.assertTrue(DoctorDayAvailability.objects.filter(doctor=self.doctor, day=self.MONDAY).exists())
+
+        rows = [_bulk_row(self.patient, _at(self.MONDAY, hour)) for hour in (8, 9)]
+        created, errors = bulk.create_appointments(self.doctor.pk, {"appointments": rows})
+        self.assertEqual((len(created), errors), (2, {}))
+        self.assertEqual(self._free(limit=1), [time(8, 30)])
+        self.assertDerivedConsistent(self.doctor)
+
+        bulk.transition(self.doctor.pk, [created[0][1].pk], "CANCELLED")
+        self.assertEqual(self._free(limit=1), [time(8)])
+        self.assertDerivedConsistent(self.doctor)
+
+
+class DailyStatsTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+
+    def _counts(self):
+        rows = DoctorDailyStats.objects.filter(doctor=self.doctor).exclude(count=0)
+        return {(day, status): count for day, status, count in rows.values_list("day", "status", "count")}
+
+    def test_signals_move_counts(self):
+        start = _at(self.MONDAY, 9)
+        appt = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        self.assertEqual(self._counts(), {(self.MONDAY, "PENDING"): 1})
+
+        tuesday = self.MONDAY + timedelta(days=1)
+        appt.status = "CONFIRMED"
+        appt.start_time, appt.end_time = _at(tuesday, 9), _at(tuesday, 9, 30)
+        appt.save()
+        self.assertEqual(self._counts(), {(tuesday, "CONFIRMED"): 1})
+        self.assertDerivedConsistent(self.doctor)
+
+        appt.delete()
+        self.assertEqual(self._counts(), {})
+
+    def test_bulk_paths_match_rebuild(self):
+        days = [self.MONDAY + timedelta(days=i) for i in range(stats.BULK_THRESHOLD + 5)]
+        rows = [_bulk_row(self.patient, _at(day, 9)) for day in days]
+
+        with mock.patch.object(stats, "_apply_bulk", wraps=stats._apply_bulk) as apply_bulk:
+            created, _ = bulk.create_appointments(self.doctor.pk, {"appointments": rows})
+            self.assertEqual(len(created), len(days))
+            self.assertDerivedConsistent(self.doctor)
+
+            updates = [{"id": appt.pk, "status": "CONFIRMED"} for _, appt in created[::2]]
+            bulk.update_statuses(self.doctor.pk, {"updates": updates})
+            self.assertDerivedConsistent(self.doctor)
+
+        self.assertEqual(apply_bulk.call_count, 2)
+        counts = self._counts()
+        self.assertEqual(counts[(self.MONDAY, "CONFIRMED")], 1)
+        self.assertNotIn((self.MONDAY, "PENDING"), counts)
+
+    def test_apply_counts_one_by_one_below_threshold(self):
+        key = (self.doctor.pk, self.MONDAY, "PENDING")
+
+        with mock.patch.object(stats, "_apply_bulk") as apply_bulk:
+            stats.apply_counts({key: 2})
+            stats.apply_counts({key: -1, (self.doctor.pk, self.MONDAY, "DONE"): 0})
+
+        apply_bulk.assert_not_called()
+        self.assertEqual(self._counts(), {(self.MONDAY, "PENDING"): 1})
+
+
+class AgendaConditionalTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.appt = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=_at(self.MONDAY, 9), end_time=_at(self.MONDAY, 10)
+        )
+        self.client.force_login(self.doctor)
+
+    def _get(self, name="doctor_agenda_week", **headers):
+        return self.client.get(reverse(name), {"date": self.MONDAY.isoformat()}, secure=True, headers=headers)
+
+    def test_unchanged_agenda_is_304(self):
+        for name in ("doctor_agenda_week", "doctor_agenda_month"):
+            first = self._get(name)
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(self._get(name, if_none_match=first["ETag"]).status_code, 304)
+
+    def test_bulk_transition_changes_etag(self):
+        etag = self._get()["ETag"]
+
+        changed, _ = bulk.transition(self.doctor.pk, [self.appt.pk], "CONFIRMED")
+        self.assertEqual(changed, [(self.appt.pk, "PENDING")])
+
+        response = self._get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_other_doctor_changes_keep_etag(self):
+        etag = self._get()["ETag"]
+        other = User.objects.create_user("otro", password="x")
+        Appointment.objects.create(
+            patient=self.patient, doctor=other, start_time=_at(self.MONDAY, 9), end_time=_at(self.MONDAY, 10)
+        )
+        self.assertEqual(self._get(if_none_match=etag).status_code, 304)
+
+
+class DetailFragmentTests(DerivedDataMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient_user = User.objects.create_user("pat", password="x")
+        self.patient = Patient.objects.create(user=self.patient_user)
+        start = _at(date(2027, 1, 4), 9)
+        self.appt = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+
+    def _detail(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse("appointment_detail", args=[self.appt.pk]), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def _version(self):
+        return Appointment.objects.values_list("cache_version", flat=True).get(pk=self.appt.pk)
+
+    def test_note_changes_invalidate_fragments(self):
+        self.assertIn("No hay notas aún.", self._detail(self.doctor))
+        version = self._version()
+
+        note = ClinicalNote.objects.create(appointment=self.appt, author=self.doctor, content="Dolor lumbar")
+        self.assertEqual(self._version(), version + 1)
+        self.assertIn("Dolor lumbar", self._detail(self.doctor))
+
+        note.delete()
+        self.assertNotIn("Dolor lumbar", self._detail(self.doctor))
+
+    def test_patient_variant_shows_only_visible_notes(self):
+        ClinicalNote.objects.create(appointment=self.appt, author=self.doctor, content="Nota interna")
+        ClinicalNote.objects.create(
+            appointment=self.appt, author=self.doctor, content="Reposo dos días", visible_to_patient=True
+        )
+
+        self.assertIn("Nota interna", self._detail(self.doctor))
+        html = self._detail(self.patient_user)
+        self.assertIn("Reposo dos días", html)
+        self.assertNotIn("Nota interna", html)
+
+    def test_bulk_status_changes_bump_version(self):
+        self._detail(self.doctor)
+        stale = fragments.fragment_key(Appointment.objects.get(pk=self.appt.pk), "notes", fragments.DOCTOR)
+        self.assertIsNotNone(cache.get(stale))
+        version = self._version()
+
+        bulk.update_statuses(self.doctor.pk, {"updates": [{"id": self.appt.pk, "status": "CONFIRMED"}]})
+        self.assertEqual(self._version(), version + 1)
+        bulk.transition(self.doctor.pk, [self.appt.pk], "DONE")
+        self.assertEqual(self._version(), version + 2)
+
+        fresh = fragments.fragment_key(Appointment.objects.get(pk=self.appt.pk), "notes", fragments.DOCTOR)
+        self.assertNotEqual(fresh, stale)
+        self.assertDerivedConsistent(self.doctor)
+
+
+class SearchTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient_user = User.objects.create_user("pat", password="x")
+        self.patient = Patient.objects.create(user=self.patient_user)
+        self.appt = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            start_time=_at(self.MONDAY, 9),
+            end_time=_at(self.MONDAY, 10),
+            reason="Dolor de cabeza",
+        )
+
+    def _found(self, user, query):
+        return [(entry.kind, entry.object_id) for entry in search.search(role_for(user), query).object_list]
+
+    def _entries(self):
+        fields = ("kind", "object_id", "appointment_id", "body", "visible_to_patient")
+        return sorted(SearchEntry.objects.values_list(*fields))
+
+    def test_prefix_terms_and_accents(self):
+        self.assertEqual(self._found(self.doctor, "dolor cab"), [(SearchEntry.REASON, self.appt.pk)])
+        self.assertEqual(self._found(self.doctor, "dolor muela"), [])
+
+        note = ClinicalNote.objects.create(appointment=self.appt, author=self.doctor, content="Migraña crónica")
+        self.assertEqual(self._found(self.doctor, "migrana"), [(SearchEntry.NOTE, note.pk)])
+
+    def test_patient_only_sees_visible_notes(self):
+        hidden = ClinicalNote.objects.create(appointment=self.appt, author=self.doctor, content="Sospecha de estrés")
+        shown = ClinicalNote.objects.create(
+            appointment=self.appt, author=self.doctor, content="Control de estrés en un mes", visible_to_patient=True
+        )
+
+        self.assertEqual(
+            sorted(self._found(self.doctor, "estrés")), [(SearchEntry.NOTE, hidden.pk), (SearchEntry.NOTE, shown.pk)]
+        )
+        self.assertEqual(self._found(self.patient_user, "estrés"), [(SearchEntry.NOTE, shown.pk)])
+
+        other = User.objects.create_user("otro", password="x")
+        Patient.objects.create(user=other)
+        self.assertEqual(self._found(other, "estrés"), [])
+
+    def test_bulk_create_matches_rebuild(self):
+        rows = [
+            _bulk_row(self.patient, _at(self.MONDAY, 11), reason="Revisión de presión arterial"),
+            _bulk_row(self.patient, _at(self.MONDAY, 12)),
+        ]
+        created, _ = bulk.create_appointments(self.doctor.pk, {"appointments": rows})
+
+        indexed = self._entries()
+        search.rebuild(self.doctor.pk)
+        self.assertEqual(self._entries(), indexed)
+        self.assertEqual(self._found(self.doctor, "presion"), [(SearchEntry.REASON, created[0][1].pk)])
+        self.assertDerivedConsistent(self.doctor)
+
+
+class BulkAppointmentsTests(DerivedDataMixin, TestCase):
+    MONDAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        self.booked = self._create(9)
+
+    def _create(self, hour, status="PENDING"):
+        return Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            start_time=_at(self.MONDAY, hour),
+            end_time=_at(self.MONDAY, hour, 30),
+            status=status,
+        )
+
+    def _rows(self):
+        return [
+            _bulk_row(self.patient, _at(self.MONDAY, 10), reason="Control"),
+            {"patient": self.patient.pk, "start": "2027-02-30T11:00:00", "end": "2027-02-30T11:30:00"},
+            _bulk_row(self.patient, _at(self.MONDAY, 9, 15)),
+            # Chocan entre sí: se rechazan las dos
+            _bulk_row(self.patient, _at(self.MONDAY, 11)),
+            _bulk_row(self.patient, _at(self.MONDAY, 11, 15)),
+        ]
+
+    def test_partial_batch_keeps_valid_rows(self):
+        created, errors = bulk.create_appointments(self.doctor.pk, {"appointments": self._rows()})
+
+        self.assertEqual([row for row, _ in created], [0])
+        self.assertEqual(sorted(errors), [1, 2, 3, 4])
+        self.assertEqual(errors[1], ["Fechas inválidas (ISO 8601)."])
+        self.assertIn(f"#{self.booked.pk}", errors[2][0])
+        self.assertIn("fila 4", errors[3][0])
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_atomic_batch_creates_nothing_on_error(self):
+        created, errors = bulk.create_appointments(self.doctor.pk, {"appointments": self._rows(), "atomic": True})
+
+        self.assertEqual((created, sorted(errors)), ([], [1, 2, 3, 4]))
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_api_create_is_audited_and_doctor_only(self):
+        url = reverse("api_appointments")
+        body = json.dumps({"appointments": self._rows()[:1]})
+
+        self.client.force_login(self.doctor)
+        response = self.client.post(url, body, content_type="application/json", secure=True)
+        self.assertEqual(response.status_code, 201)
+        [row] = response.json()["created"]
+        self.assertTrue(AuditEvent.objects.filter(action="CREATE", object_id=row["id"]).exists())
+
+        self.client.force_login(self.patient.user)
+        response = self.client.post(url, body, content_type="application/json", secure=True)
+        self.assertEqual(response.status_code, 403)
+
+    def test_update_statuses(self):
+        cancelled = self._create(9, status="CANCELLED")
+        self._create(10)
+        blocked = self._create(10, status="CANCELLED")
+        foreign = Appointment.objects.create(
+            patient=self.patient,
+            doctor=User.objects.create_user("otro", password="x"),
+            start_time=_at(self.MONDAY, 12),
+            end_time=_at(self.MONDAY, 13),
+        )
+
+        updates = [
+            # Se libera el horario de `booked` en el mismo lote: reactivar no choca
+            {"id": self.booked.pk, "status": "CANCELLED"},
+            {"id": cancelled.pk, "status": "CONFIRMED"},
+            {"id": blocked.pk, "status": "PENDING"},
+            {"id": foreign.pk, "status": "DONE"},
+            {"id": cancelled.pk, "status": "DONE"},
+            {"id": self.booked.pk, "status": "NOPE"},
+        ]
+        updated, errors = bulk.update_statuses(self.doctor.pk, {"updates": updates})
+
+        self.assertEqual(
+            updated, [(self.booked.pk, "PENDING", "CANCELLED"), (cancelled.pk, "CANCELLED", "CONFIRMED")]
+        )
+        self.assertEqual(sorted(errors), [2, 3, 4, 5])
+        self.assertEqual(Appointment.objects.get(pk=blocked.pk).status, "CANCELLED")
+        self.assertEqual(Appointment.objects.get(pk=foreign.pk).status, "PENDING")
+        self.assertDerivedConsistent(self.doctor)
+
+
+class TransitionRolloverTests(DerivedDataMixin, TestCase):
+    TODAY = date(2027, 1, 4)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+
+    def _create(self, day, hour, status="PENDING", doctor=None):
+        return Appointment.objects.create(
+            patient=self.patient,
+            doctor=doctor or self.doctor,
+            start_time=_at(day, hour),
+            end_time=_at(day, hour, 30),
+            status=status,
+        )
+
+    def _statuses(self, appointments):
+        return [Appointment.objects.get(pk=appt.pk).status for appt in appointments]
+
+    def test_transition_only_from_allowed_statuses(self):
+        appts = [
+            self._create(self.TODAY, hour, status)
+            for hour, status in ((9, "PENDING"), (10, "CONFIRMED"), (11, "DONE"), (12, "CANCELLED"))
+        ]
+        foreign = self._create(self.TODAY, 9, doctor=User.objects.create_user("otro", password="x"))
+        ids = [appt.pk for appt in appts] + [foreign.pk]
+
+        changed, skipped = bulk.transition(self.doctor.pk, ids, "CONFIRMED")
+        self.assertEqual(changed, [(appts[0].pk, "PENDING")])
+        self.assertEqual(skipped, set(ids) - {appts[0].pk})
+
+        changed, skipped = bulk.transition(self.doctor.pk, ids, "CANCELLED")
+        self.assertEqual(sorted(changed), [(appts[0].pk, "CONFIRMED"), (appts[1].pk, "CONFIRMED")])
+        self.assertEqual(self._statuses(appts), ["CANCELLED", "CANCELLED", "DONE", "CANCELLED"])
+        self.assertEqual(Appointment.objects.get(pk=foreign.pk).status, "PENDING")
+        self.assertDerivedConsistent(self.doctor)
+
+    def test_agenda_bulk_status_is_audited(self):
+        appts = [self._create(self.TODAY, 9), self._create(self.TODAY, 10, "DONE")]
+        self.client.force_login(self.doctor)
+
+        response = self.client.post(
+            reverse("doctor_agenda_bulk_status"),
+            {"date": self.TODAY.isoformat(), "status": "CONFIRMED", "ids": [appt.pk for appt in appts]},
+            secure=True,
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._statuses(appts), ["CONFIRMED", "DONE"])
+        self.assertEqual(list(AuditEvent.objects.values_list("object_id", flat=True)), [appts[0].pk])
+
+    def test_rollover_closes_past_days_in_batches(self):
+        yesterday = self.TODAY - timedelta(days=1)
+        confirmed = self._create(yesterday, 9, "CONFIRMED")
+        pending = [self._create(yesterday, hour) for hour in (10, 11, 12)]
+        untouched = [self._create(yesterday, 13, "DONE"), self._create(yesterday, 14, "CANCELLED")]
+        today = self._create(self.TODAY, 9)
+
+        cutoff = bulk.rollover_cutoff(_at(self.TODAY, 12))
+        self.assertEqual(cutoff, _at(self.TODAY, 0))
+
+        with mock.patch.object(bulk, "rollover_cutoff", return_value=cutoff):
+            self.assertEqual(tasks.rollover_past_appointments(batch_size=2), 4)
+
+        self.assertEqual(self._statuses([confirmed, *pending]), ["DONE"] + ["CANCELLED"] * 3)
+        self.assertEqual(self._statuses([*untouched, today]), ["DONE", "CANCELLED", "PENDING"])
+        audited = AuditEvent.objects.filter(action="STATUS").values_list("object_id", flat=True)
+        self.assertEqual(sorted(audited), sorted(appt.pk for appt in [confirmed, *pending]))
+        self.assertEqual(bulk.rollover_batch(cutoff), 0)
+        self.assertDerivedConsistent(self.doctor)
+
+
+class FileDownloadTests(TestCase):
+    CONTENT = bytes(range(100))
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = _at(date(2027, 1, 4), 9)
+        appt = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+        name = default_storage.save("appointments/informe.txt", ContentFile(self.CONTENT))
+        self.file = AppointmentFile.objects.create(appointment=appt, title="Informe", file=name)
+        self.url = reverse("appointment_file_download", args=[self.file.pk])
+
+    def _get(self, user=None, **headers):
+        self.client.force_login(user or self.patient.user)
+        response = self.client.get(self.url, secure=True, headers=headers)
+        self.body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response
+
+    def test_owner_gets_full_file(self):
+        for user in (self.patient.user, self.doctor):
+            response = self._get(user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.body, self.CONTENT)
+            self.assertEqual(response["Content-Length"], "100")
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+            self.assertIn("Informe.txt", response["Content-Disposition"])
+
+    def test_other_patient_and_other_doctor_get_404(self):
+        other_patient = Patient.objects.create(user=User.objects.create_user("otro", password="x"))
+        other_doctor = User.objects.create_user("otrodoc", password="x")
+
+        for user in (other_patient.user, other_doctor):
+            response = self._get(user)
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn(self.CONTENT, self.body)
+
+    def test_range_returns_206(self):
+        response = self._get(range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(self.body, self.CONTENT[10:20])
+
+        response = self._get(range="bytes=-5")
+        self.assertEqual(response["Content-Range"], "bytes 95-99/100")
+        self.assertEqual(self.body, self.CONTENT[95:])
+
+    def test_unsatisfiable_range_is_416(self):
+        response = self._get(range="bytes=200-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_stale_if_range_sends_full_body(self):
+        etag = self._get()["ETag"]
+
+        self.assertEqual(self._get(range="bytes=0-9", if_range=etag).status_code, 206)
+
+        response = self._get(range="bytes=0-9", if_range='"otro"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body, self.CONTENT)
+
+    def test_accel_headers(self):
+        with override_settings(MEDIA_ACCEL="nginx", MEDIA_ACCEL_PREFIX="/protected-media/"):
+            response = self._get()
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/appointments/informe.txt")
+        self.assertEqual(self.body, b"")
+
+        with override_settings(MEDIA_ACCEL="sendfile"):
+            response = self._get()
+        self.assertEqual(response["X-Sendfile"], default_storage.path("appointments/informe.txt"))
+
+
+class ReminderTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        base = timezone.now() + timedelta(hours=24, minutes=5)
+        self.appts = []
+        for i in range(5):
+            user = User.objects.create_user(f"pat{i}", email=f"pat{i}@example.com", password="x")
+            start = base + timedelta(minutes=10 * i)
+            self.appts.append(
+                Appointment.objects.create(
+                    patient=Patient.objects.create(user=user),
+                    doctor=self.doctor,
+                    start_time=start,
+                    end_time=start + timedelta(minutes=10),
+                )
+            )
+
+    def _recipients(self):
+        return sorted(address for message in mail.outbox for address in message.to)
+
+    def test_each_reminder_is_sent_once(self):
+        self.assertEqual(tasks.send_confirmations_24h(), 5)
+        self.assertEqual(tasks.send_confirmations_24h(), 0)
+
+        self.assertEqual(self._recipients(), [f"pat{i}@example.com" for i in range(5)])
+        self.assertFalse(Appointment.objects.filter(reminder_sent_at__isnull=True).exists())
+
+    def test_batches(self):
+        with mock.patch.object(tasks, "_claim_reminders", wraps=tasks._claim_reminders) as claim:
+            self.assertEqual(tasks.send_confirmations_24h(batch_size=2), 5)
+
+        self.assertEqual([len(call.args[0]) for call in claim.call_args_list], [2, 2, 1])
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_failed_send_is_released_and_retried(self):
+        backend = type(mail.get_connection())
+        original = backend.send_messages
+
+        def flaky(connection, messages):
+            if messages[0].to == ["pat1@example.com"]:
+                raise OSError("SMTP caído")
+            return original(connection, messages)
+
+        with mock.patch.object(backend, "send_messages", flaky), self.assertLogs("appointments.tasks", "WARNING"):
+            self.assertEqual(tasks.send_confirmations_24h(batch_size=2), 4)
+
+        pending = Appointment.objects.filter(reminder_sent_at__isnull=True)
+        self.assertEqual(list(pending.values_list("pk", flat=True)), [self.appts[1].pk])
+
+        self.assertEqual(tasks.send_confirmations_24h(), 1)
+        self.assertEqual(self._recipients(), [f"pat{i}@example.com" for i in range(5)])
+
+
+class AuditLogTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", password="x")
+        self.factory = RequestFactory()
+
+    def _request(self):
+        request = self.factory.get("/")
+        request.user = self.doctor
+        return request
+
+    def _view(self, response=None, error=None):
+        def view(request):
+            before = AuditEvent.objects.count()
+            log_action(request, "CREATE", message="uno")
+            log_action(request, "UPDATE", message="dos")
+            self.assertEqual(AuditEvent.objects.count(), before)
+            if error:
+                raise error
+            return response or HttpResponse()
+
+        return AuditMiddleware(view)
+
+    def test_events_are_flushed_once_at_the_end(self):
+        patcher = mock.patch.object(AuditEvent.objects, "bulk_create", wraps=AuditEvent.objects.bulk_create)
+        with patcher as bulk_create:
+            self._view()(self._request())
+
+        bulk_create.assert_called_once()
+        self.assertEqual(list(AuditEvent.objects.order_by("id").values_list("message", flat=True)), ["uno", "dos"])
+        self.assertEqual(set(AuditEvent.objects.values_list("actor_id", flat=True)), {self.doctor.pk})
+
+    def test_events_are_kept_on_errors(self):
+        self._view(response=HttpResponse(status=500))(self._request())
+        self.assertEqual(AuditEvent.objects.count(), 2)
+
+        with self.assertRaises(ValueError):
+            self._view(error=ValueError("falla"))(self._request())
+        self.assertEqual(AuditEvent.objects.count(), 4)
+
+    def test_flush_error_does_not_break_the_response(self):
+        with mock.patch("appointments.middleware.flush_audit_events", side_effect=RuntimeError("db")):
+            with self.assertLogs("appointments.middleware", "ERROR"):
+                response = self._view()(self._request())
+        self.assertEqual(response.status_code, 200)
+
+    def test_outside_a_request_writes_directly(self):
+        log_action(self.doctor, "STATUS", message="tarea")
+        log_action(None, "STATUS", message="sin usuario")
+
+        rows = AuditEvent.objects.order_by("id").values_list("actor_id", "message")
+        self.assertEqual(list(rows), [(self.doctor.pk, "tarea"), (None, "sin usuario")])
+
+    @override_settings(AUDIT_ASYNC=True)
+    def test_async_enqueues_serialized_events(self):
+        with mock.patch.object(tasks.write_audit_events, "apply_async") as apply_async:
+            self._view()(self._request())
+
+        self.assertFalse(AuditEvent.objects.exists())
+        [rows] = apply_async.call_args.kwargs["args"]
+        self.assertEqual(
+            [(row["actor_id"], row["action"], row["message"]) for row in rows],
+            [(self.doctor.pk, "CREATE", "uno"), (self.doctor.pk, "UPDATE", "dos")],
+        )
+
+        # Lo que recibe la tarea pasa por JSON
+        tasks.write_audit_events(json.loads(json.dumps(rows)))
+        self.assertEqual(AuditEvent.objects.count(), 2)
+
+    @override_settings(AUDIT_ASYNC=True)
+    def test_async_without_broker_writes_here(self):
+        with mock.patch.object(tasks.write_audit_events, "apply_async", side_effect=OSError("sin broker")):
+            self._view()(self._request())
+        self.assertEqual(AuditEvent.objects.count(), 2)
+
+
+class SeedClinicTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_seeded_files_share_a_refcounted_blob(self):
+        call_command(
+            "seed_clinic",
+            "--doctors=1",
+            "--patients=3",
+            "--appointments=20",
+            "--days-back=10",
+            "--days-ahead=0",
+            "--files-ratio=1",
+            stdout=StringIO(),
+        )
+
+        blob = StoredBlob.objects.get()
+        files = AppointmentFile.objects.all()
+        self.assertGreater(files.count(), 1)
+        self.assertEqual(blob.ref_count, files.count())
+        self.assertEqual(set(files.values_list("blob_id", "file")), {(blob.pk, blob.file.name)})
+
+        f = files.first()
+        self.client.force_login(f.appointment.doctor)
+        self.client.post(reverse("appointment_file_delete", args=[f.appointment_id, f.pk]), secure=True)
+
+        self.assertFalse(AppointmentFile.objects.filter(pk=f.pk).exists())
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, files.count())
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+
+class HistoryExportTests(TestCase):
+    DAY = date(2026, 3, 2)
+
+    def setUp(self):
+        self.doctor = User.objects.create_user("doc", first_name="Ana", last_name="Díaz", password="x")
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user("pat", first_name="+cmd", email="pat@example.com", password="x")
+        )
+        self.first = self._create(self.DAY, "DONE", reason='=HYPERLINK("http://x","y")')
+        self.second = self._create(self.DAY + timedelta(days=7), "CANCELLED")
+        other = User.objects.create_user("otro", password="x")
+        self.foreign = self._create(self.DAY, "DONE", doctor=other)
+        self.client.force_login(self.doctor)
+
+    def _create(self, day, status, doctor=None, reason="Control"):
+        return Appointment.objects.create(
+            patient=self.patient,
+            doctor=doctor or self.doctor,
+            start_time=_at(day, 9),
+            end_time=_at(day, 9, 30),
+            status=status,
+            reason=reason,
+        )
+
+    def _export(self, **params):
+        response = self.client.get(reverse("appointment_history_export"), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content).decode()
+        if params.get("format") == "ndjson":
+            return [json.loads(line) for line in body.splitlines()]
+        return list(csv.DictReader(StringIO(body.lstrip("\ufeff"))))
+
+    def _ids(self, rows):
+        return [int(row["id"]) for row in rows]
+
+    def test_columns_and_formula_cells(self):
+        response = self.client.get(reverse("appointment_history_export"), secure=True)
+        header = b"".join(response.streaming_content).decode().lstrip("\ufeff").splitlines()[0]
+        self.assertEqual(header.split(","), exports.COLUMNS)
+
+        row = self._export()[0]
+        self.assertEqual(row["reason"], '\'=HYPERLINK("http://x","y")')
+        self.assertTrue(row["patient"].startswith("'+cmd"))
+        self.assertEqual(row["doctor"], "Ana Díaz")
+
+        # NDJSON no pasa por una hoja de cálculo: el texto va tal cual
+        self.assertEqual(self._export(format="ndjson")[0]["reason"], '=HYPERLINK("http://x","y")')
+
+    def test_doctor_exports_only_own_appointments(self):
+        self.assertEqual(self._ids(self._export()), [self.first.pk, self.second.pk])
+        self.assertEqual(self._ids(self._export(patient=self.patient.pk)), [self.first.pk, self.second.pk])
+
+        self.client.force_login(self.patient.user)
+        self.assertEqual(self._ids(self._export()), [self.first.pk, self.foreign.pk, self.second.pk])
+
+    def test_status_and_date_filters(self):
+        self.assertEqual(self._ids(self._export(status="cancelled")), [self.second.pk])
+        since = (self.DAY + timedelta(days=1)).isoformat()
+        self.assertEqual(self._ids(self._export(**{"from": since})), [self.second.pk])
+        self.assertEqual(self._ids(self._export(to=self.DAY.isoformat())), [self.first.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Varios eventos con el mismo created_at: el orden lo decide el id
+        base = timezone.now()
+        AuditEvent.objects.bulk_create(
+            AuditEvent(action="CREATE", message=f"e{i}", created_at=base + timedelta(seconds=i // 3))
+            for i in range(8)
+        )
+        self.expected = list(AuditEvent.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+
+    def _page(self, cursor=None):
+        return pagination.paginate_keyset(AuditEvent.objects.all(), cursor, per_page=3, field="created_at")
+
+    def _ids(self, page):
+        return [event.pk for event in page]
+
+    def test_forward_and_back_round_trip(self):
+        pages = [self._page()]
+        while pages[-1].has_next:
+            pages.append(self._page(pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([pk for page in pages for pk in self._ids(page)], self.expected)
+        self.assertFalse(pages[0].has_previous)
+
+        back = self._page(pages[2].previous_cursor)
+        self.assertEqual(self._ids(back), self._ids(pages[1]))
+        self.assertEqual(self._ids(self._page(back.previous_cursor)), self._ids(pages[0]))
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        tampered = base64.urlsafe_b64encode(b'["x","no-es-fecha","1"]').decode()
+        impossible = base64.urlsafe_b64encode(b'["n","2024-02-30T10:00:00+00:00",1]').decode()
+        for cursor in ("%%%", "bm8tanNvbg", tampered, impossible):
+            page = self._page(cursor)
+            self.assertEqual(self._ids(page), self.expected[:3])
+            self.assertFalse(page.has_previous)
+
+    def test_view_ignores_invalid_cursor(self):
+        self.client.force_login(User.objects.create_user("doc", password="x"))
+        response = self.client.get(reverse("my_appointments"), {"cursor": "%%%"}, secure=True)
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_changelist_uses_cursor(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        url = reverse("admin:appointments_auditevent_changelist")
+
+        with mock.patch.object(AuditEventAdmin, "list_per_page", 3):
+            first = self.client.get(url, secure=True)
+            self.assertIsInstance(first.context["cl"], pagination.KeysetChangeList)
+            self.assertEqual([e.pk for e in first.context["cl"].result_list], self.expected[:3])
+
+            second = self.client.get(url + first.context["cl"].next_url, secure=True)
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual([e.pk for e in second.context["cl"].result_list], self.expected[3:6])
+            self.assertContains(second, "cursor=")
+
+            self.assertEqual(self.client.get(url, {"cursor": "%%%"}, secure=True).status_code, 200)
+
+
+class ExplainHotQueriesTests(TestCase):
+    def test_overlap_query_matches_booking(self):
+        doctor = User.objects.create_user("doc", password="x")
+        patient = Patient.objects.create(user=User.objects.create_user("pat", password="x"))
+        start = _at(date(2027, 1, 4), 9)
+        sample = Appointment.objects.create(
+            patient=patient, doctor=doctor, start_time=start, end_time=start + timedelta(minutes=30)
+        )
+
+        queries = dict(explain_hot_queries._hot_queries(sample))
+        self.assertEqual(
+            str(queries["AppointmentForm.clean (choques)"].query),
+            str(overlapping(doctor.pk, sample.start_time, sample.end_time, sample.pk)[:1].query),
+        )
+
+        out = StringIO()
+        call_command("explain_hot_queries", stdout=out)
+        self.assertIn("AppointmentForm.clean (choques)", out.getvalue())
+
+
+class ImpossibleDateTests(TestCase):
+    BAD = "2024-02-30"
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("doc", password="x"))
+
+    def _get(self, name, params):
+        return self.client.get(reverse(name), params, secure=True)
+
+    def test_views_fall_back_to_the_default_date(self):
+        cases = [
+            ("doctor_availability", {"from": self.BAD, "to": self.BAD}, 200),
+            ("doctor_agenda", {"date": self.BAD}, 200),
+            ("doctor_agenda_week", {"date": self.BAD}, 200),
+            ("doctor_day_pdf", {"date": self.BAD}, 302),
+            ("appointment_history_export", {"from": self.BAD, "to": self.BAD}, 200),
+        ]
+        for name, params, status in cases:
+            with self.subTest(name):
+                self.assertEqual(self._get(name, params).status_code, status)
+
+        response = self.client.post(
+            reverse("doctor_agenda_bulk_status"), {"date": self.BAD, "status": "DONE", "ids": ["1"]}, secure=True
+        )
+        self.assertRedirects(response, reverse("doctor_agenda"), fetch_redirect_response=False)
+
+    def test_bulk_read_returns_its_error_payload(self):
+        response = self._get("api_appointments", {"from": self.BAD})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Indica ids o un rango from/to válido."})
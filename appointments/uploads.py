@@ -0,0 +1,336 @@
+"""
+Subidas por partes (reanudables) y almacenamiento deduplicado de archivos.
+
+Flujo de una subida:
+1. start_session() crea la UploadSession y un archivo temporal vacío.
+2. write_chunk() escribe cada parte en su posición leyendo el request de a
+   READ_BLOCK bytes (nunca la parte completa en memoria). Una parte cortada
+   a la mitad no mueve `offset`, así el cliente la reenvía desde ahí.
+3. Con la última parte, finish_session() calcula el SHA-256 y guarda el
+   contenido como StoredBlob: si ese hash ya existe solo suma una referencia
+   y el archivo temporal se descarta. Si falla después de escribir la última
+   parte, una PUT vacía en offset == size lo reintenta.
+
+El hash se va calculando mientras llegan las partes; si la siguiente parte
+la atiende otro worker, se recalcula leyendo el temporal al terminar.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from prescriptions.models import AppointmentFile
+from records.models import MedicalFile
+
+from .models import StoredBlob, UploadSession
+
+READ_BLOCK = 64 * 1024
+BLOB_DIR = "blobs"
+
+FILE_MODELS = {
+    "appointment_file": AppointmentFile,
+    "medical_file": MedicalFile,
+}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def max_chunk_bytes():
+    return getattr(settings, "CHUNKED_UPLOAD_MAX_CHUNK", 8 * 1024 * 1024)
+
+
+def max_upload_bytes():
+    return getattr(settings, "CHUNKED_UPLOAD_MAX_SIZE", 2 * 1024 * 1024 * 1024)
+
+
+def _tmp_dir():
+    return Path(getattr(settings, "CHUNKED_UPLOAD_DIR", Path(settings.MEDIA_ROOT) / "_uploads"))
+
+
+def temp_path(session):
+    return _tmp_dir() / f"{session.pk}.part"
+
+
+# ---------------------------
+# Blobs
+# ---------------------------
+
+class _LocalFile(File):
+    """
+    File con temporary_file_path(): FileSystemStorage lo mueve (rename) en
+    vez de copiarlo byte a byte.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def blob_name(sha256, filename):
+    ext = os.path.splitext(filename)[1].lower()[:10]
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(READ_BLOCK * 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_blob(content, sha256, size, filename):
+    """
+    Suma una referencia al blob con ese hash. Si no existe, guarda `content`
+    (un File) en el storage. Retorna (blob, creado).
+    """
+    canonical = blob_name(sha256, filename)
+
+    for _ in range(2):
+        saved = None
+        try:
+            with transaction.atomic():
+                blob = StoredBlob.objects.select_for_update().filter(sha256=sha256).first()
+                if blob:
+                    StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1)
+                    blob.ref_count += 1
+                    return blob, False
+
+                # Siempre un archivo nuevo: uno que ya esté en `canonical` puede
+                # ser de un blob recién liberado cuyo borrado (on_commit de
+                # release_blob) aún no corrió. Si existe, el storage elige
+                # otro nombre.
+                saved = default_storage.save(canonical, content)
+                blob = StoredBlob.objects.create(sha256=sha256, file=saved, size=size, ref_count=1)
+                return blob, True
+        except IntegrityError:
+            # Otro proceso creó el mismo blob al mismo tiempo
+            if saved:
+                default_storage.delete(saved)
+
+    raise UploadError("No se pudo registrar el archivo.", status=409)
+
+
+def release_blob(blob_id):
+    """
+    Resta una referencia; con la última se borra el blob y su archivo.
+    """
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+            return
+
+        name = blob.file.name
+        blob.delete()
+        transaction.on_commit(lambda: _delete_blob_files(name))
+
+
+def _delete_blob_files(name):
+    from .previews import delete_previews
+
+    default_storage.delete(name)
+    delete_previews(name)
+
+
+def store_uploaded_file(uploaded):
+    """
+    Blob para un archivo del formulario clásico (UploadedFile).
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    uploaded.seek(0)
+    blob, _ = store_blob(uploaded, digest.hexdigest(), uploaded.size, uploaded.name)
+    return blob
+
+
+def attach_blob(instance, blob):
+    instance.blob = blob
+    # Asignar el nombre (str) deja el FieldFile como ya guardado; así el
+    # save() del modelo no vuelve a escribir el contenido en upload_to.
+    instance.file = blob.file.name
+
+
+# ---------------------------
+# Sesiones de subida
+# ---------------------------
+
+# {session_id: (offset, hasher)} de las subidas que este proceso va
+# atendiendo; evita releer el temporal completo al terminar.
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+_MAX_HASHERS = 128
+
+
+def _remember_hasher(session_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[session_id] = (offset, hasher)
+        _hashers.move_to_end(session_id)
+        while len(_hashers) > _MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _hasher_at(session_id, offset):
+    with _hashers_lock:
+        state = _hashers.get(session_id)
+    if state and state[0] == offset:
+        return state[1].copy()
+    if offset == 0:
+        return hashlib.sha256()
+    return None
+
+
+def start_session(appointment, user, kind, filename, size, title=""):
+    if kind not in FILE_MODELS:
+        raise UploadError("Tipo de archivo inválido.")
+    if size <= 0 or size > max_upload_bytes():
+        raise UploadError(f"El tamaño debe estar entre 1 y {max_upload_bytes()} bytes.")
+
+    session = UploadSession.objects.create(
+        appointment=appointment,
+        created_by=user,
+        kind=kind,
+        title=title[:120],
+        filename=os.path.basename(filename)[:255] or "archivo",
+        size=size,
+    )
+    _tmp_dir().mkdir(parents=True, exist_ok=True)
+    temp_path(session).touch()
+    return session
+
+
+def write_chunk(session, offset, stream, length, chunk_sha256=""):
+    """
+    Escribe `length` bytes leídos de `stream` a partir de `offset`.
+    Retorna el nuevo offset confirmado.
+    """
+    if length <= 0 or length > max_chunk_bytes():
+        raise UploadError(f"Cada parte debe tener entre 1 y {max_chunk_bytes()} bytes.")
+
+    path = temp_path(session)
+    try:
+        fh = open(path, "r+b")
+    except FileNotFoundError:
+        raise UploadError("La subida expiró.", status=410)
+
+    with fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Ya se está subiendo una parte de este archivo.", status=409, offset=session.offset)
+
+        # El offset confirmado puede haber cambiado mientras se esperaba el lock
+        session.refresh_from_db(fields=["offset"])
+        if offset != session.offset:
+            raise UploadError("Offset incorrecto.", status=409, offset=session.offset)
+        if offset + length > session.size:
+            raise UploadError("La parte excede el tamaño declarado.")
+
+        # Descarta restos de una parte anterior que quedó a medias
+        fh.seek(offset)
+        fh.truncate()
+
+        hasher = _hasher_at(session.pk, offset)
+        chunk_digest = hashlib.sha256()
+        remaining = length
+        while remaining:
+            block = stream.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            fh.write(block)
+            chunk_digest.update(block)
+            if hasher:
+                hasher.update(block)
+            remaining -= len(block)
+
+        if remaining:
+            fh.truncate(offset)
+            raise UploadError("La parte llegó incompleta.", offset=offset)
+        if chunk_sha256 and chunk_sha256.lower() != chunk_digest.hexdigest():
+            fh.truncate(offset)
+            raise UploadError("El SHA-256 de la parte no coincide.", offset=offset)
+
+        fh.flush()
+        new_offset = offset + length
+        UploadSession.objects.filter(pk=session.pk).update(offset=new_offset, updated_at=timezone.now())
+        session.offset = new_offset
+
+    if hasher:
+        _remember_hasher(session.pk, new_offset, hasher)
+    return new_offset
+
+
+def finish_session(session):
+    """
+    Convierte una subida completa en AppointmentFile / MedicalFile.
+    Retorna (archivo, blob, deduplicado).
+    """
+    if session.offset != session.size:
+        raise UploadError("La subida aún no está completa.", status=409, offset=session.offset)
+
+    session_id = session.pk
+    path = temp_path(session)
+    hasher = _hasher_at(session_id, session.size)
+    try:
+        sha256 = hasher.hexdigest() if hasher else hash_file(path)
+    except FileNotFoundError:
+        raise UploadError("La subida expiró.", status=410)
+
+    with transaction.atomic():
+        # Dos reintentos a la vez: solo uno convierte la sesión
+        if not UploadSession.objects.select_for_update().filter(pk=session_id).exists():
+            raise UploadError("La subida ya terminó.", status=410)
+
+        with open(path, "rb") as fh:
+            blob, created = store_blob(_LocalFile(fh, name=session.filename), sha256, session.size, session.filename)
+
+        model = FILE_MODELS[session.kind]
+        obj = model(appointment_id=session.appointment_id, title=session.title)
+        attach_blob(obj, blob)
+        obj.save()
+        session.delete()
+
+    # delete() deja session.pk en None
+    _forget(session_id, path)
+    return obj, blob, not created
+
+
+def abort_session(session):
+    session_id = session.pk
+    path = temp_path(session)
+    session.delete()
+    _forget(session_id, path)
+
+
+def _forget(session_id, path):
+    with _hashers_lock:
+        _hashers.pop(session_id, None)
+    # Si el storage movió el temporal ya no existe
+    path.unlink(missing_ok=True)
+
+
+def purge_stale_sessions(max_age=timedelta(hours=24)):
+    """
+    Borra subidas abandonadas y sus temporales. Retorna cuántas.
+    """
+    stale = list(UploadSession.objects.filter(updated_at__lt=timezone.now() - max_age))
+    for session in stale:
+        abort_session(session)
+    return len(stale)
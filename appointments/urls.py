@@ -4,13 +4,24 @@ from . import views
 urlpatterns = [
     path("my/", views.my_appointments, name="my_appointments"),
     path("agenda/", views.doctor_agenda, name="doctor_agenda"),
+    path("agenda/week/", views.doctor_agenda_range, {"period": "week"}, name="doctor_agenda_week"),
+    path("agenda/month/", views.doctor_agenda_range, {"period": "month"}, name="doctor_agenda_month"),
+    path("agenda/print/", views.doctor_day_pdf, name="doctor_day_pdf"),
+    path("agenda/status/", views.doctor_agenda_bulk_status, name="doctor_agenda_bulk_status"),
     path("dashboard/", views.doctor_dashboard, name="doctor_dashboard"),
+    path("availability/", views.doctor_availability, name="doctor_availability"),
+    path("api/appointments/", views.api_appointments, name="api_appointments"),
+    path("api/appointments/status/", views.api_appointments_status, name="api_appointments_status"),
 
 
     path("create/", views.appointment_create, name="appointment_create"),
+    path("series/create/", views.appointment_series_create, name="appointment_series_create"),
+    path("<int:pk>/series/", views.appointment_series_following, name="appointment_series_following"),
     path("<int:pk>/", views.appointment_detail, name="appointment_detail"),
     path("<int:pk>/edit/", views.appointment_edit, name="appointment_edit"),
     path("history/", views.patient_history, name="patient_history"),
+    path("history/export/", views.appointment_history_export, name="appointment_history_export"),
+    path("search/", views.appointment_search, name="appointment_search"),
 
 
     path("<int:pk>/status/<str:status>/", views.appointment_set_status, name="appointment_set_status"),
@@ -21,6 +32,14 @@ urlpatterns = [
     path("<int:pk>/notes/<int:note_id>/delete/", views.clinical_note_delete, name="clinical_note_delete"),
     path("<int:pk>/prescriptions/<int:prescription_id>/delete/", views.prescription_delete, name="prescription_delete"),
     path("<int:pk>/files/<int:file_id>/delete/", views.appointment_file_delete, name="appointment_file_delete"),
+    path("files/<int:file_id>/", views.file_download, {"kind": "appointment_file"}, name="appointment_file_download"),
+    path("files/<int:file_id>/thumb/", views.file_preview, {"kind": "appointment_file", "size": "thumbnail"}, name="appointment_file_thumbnail"),
+    path("files/<int:file_id>/preview/", views.file_preview, {"kind": "appointment_file", "size": "preview"}, name="appointment_file_preview"),
+    path("records/<int:file_id>/", views.file_download, {"kind": "medical_file"}, name="medical_file_download"),
+    path("records/<int:file_id>/thumb/", views.file_preview, {"kind": "medical_file", "size": "thumbnail"}, name="medical_file_thumbnail"),
+    path("records/<int:file_id>/preview/", views.file_preview, {"kind": "medical_file", "size": "preview"}, name="medical_file_preview"),
+    path("<int:pk>/uploads/", views.upload_start, name="upload_start"),
+    path("uploads/<uuid:upload_id>/", views.upload_session, name="upload_session"),
 
     # ✅ ACCIONES PACIENTE
     path("<int:pk>/patient/confirm/", views.patient_confirm_appointment, name="patient_confirm_appointment"),
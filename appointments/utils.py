@@ -1,10 +1,87 @@
+from django.conf import settings
+from django.http import HttpRequest
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-def log_action(user, action, appointment=None):
+from .models import AuditEvent
+
+AUDIT_BUFFER_ATTR = "_audit_events"
+
+
+def parse_date_or_none(value):
+    """
+    parse_date() que también retorna None para fechas bien escritas pero
+    imposibles (2024-02-30), en vez de lanzar ValueError.
+    """
+    try:
+        return parse_date(value or "")
+    except ValueError:
+        return None
+
+
+def log_action(request, action, appointment=None, object_type="", object_id=None, message=""):
     """
-    Registro simple de acciones (puedes ampliarlo luego)
+    Registra una acción en la bitácora (AuditEvent).
+
+    Dentro de una petición el evento solo se acumula en el request y
+    AuditMiddleware los guarda todos juntos al terminar la respuesta. Fuera
+    de una petición (tareas, shell) `request` puede ser el usuario o None y
+    el evento se guarda de inmediato.
     """
-    print(
-        f"[{timezone.now()}] {user} -> {action}"
-        + (f" | cita #{appointment.id}" if appointment else "")
+    if isinstance(request, HttpRequest):
+        user = getattr(request, "user", None)
+    else:
+        user, request = request, None
+
+    event = AuditEvent(
+        actor_id=user.pk if getattr(user, "is_authenticated", False) else None,
+        appointment_id=getattr(appointment, "pk", appointment),
+        action=action,
+        object_type=object_type,
+        object_id=object_id,
+        message=message[:255],
+        created_at=timezone.now(),
     )
+
+    if request is None:
+        event.save()
+    else:
+        buffer = getattr(request, AUDIT_BUFFER_ATTR, None)
+        if buffer is None:
+            buffer = []
+            setattr(request, AUDIT_BUFFER_ATTR, buffer)
+        buffer.append(event)
+    return event
+
+
+def flush_audit_events(events):
+    """
+    Guarda los eventos con un solo bulk_create o, si AUDIT_ASYNC está
+    activo, los manda a la tarea write_audit_events.
+    """
+    if not events:
+        return
+
+    if getattr(settings, "AUDIT_ASYNC", False):
+        from .tasks import write_audit_events
+
+        try:
+            write_audit_events.apply_async(args=[[_serialize(e) for e in events]], retry=False)
+            return
+        except Exception:
+            # Sin broker: se escribe aquí mismo
+            pass
+
+    AuditEvent.objects.bulk_create(events)
+
+
+def _serialize(event):
+    return {
+        "actor_id": event.actor_id,
+        "appointment_id": event.appointment_id,
+        "action": event.action,
+        "object_type": event.object_type,
+        "object_id": event.object_id,
+        "message": event.message,
+        "created_at": event.created_at.isoformat(),
+    }
@@ -1,49 +1,72 @@
+import json
+import os
+from datetime import timedelta
+from functools import wraps
+
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.mail import EmailMessage
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
-from django.utils.dateparse import parse_date
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 
+from accounts.roles import doctor_required, patient_required
 from notes.forms import ClinicalNoteForm
 from notes.models import ClinicalNote
 
 from prescriptions.forms import AppointmentFileForm, PrescriptionForm
 from prescriptions.models import AppointmentFile, Prescription
 
-from .forms import AppointmentForm
-from .models import Appointment
-from .pdf import build_prescriptions_pdf
-from .utils import log_action
-from django.db.models import Count, Q
-from django.core.paginator import Paginator
-
+from . import bulk, print_day
+from .agenda import (
+    MONTH,
+    WEEK,
+    agenda_etag,
+    agenda_last_modified,
+    agenda_range,
+    appointments_by_day,
+    calendar_weeks,
+)
+from .availability import find_free_slots
+from .booking import OVERLAP_ERROR, OverlapError, save_appointment
+from .downloads import download_filename, serve_file
+from .exports import CONTENT_TYPES, CSV, apply_history_filters, history_filters, stream_rows
+from .forms import AppointmentForm, AppointmentSeriesForm, SeriesFollowingForm
+from .fragments import detail_sections
+from .models import Appointment, UploadSession
+from .pagination import CURSOR_PARAM, paginate_keyset
+from .outbox import enqueue_email
+from .pdf import render_prescriptions
+from .pdf_cache import open_prescriptions_pdf
+from .previews import delete_previews, ensure_preview
+from .search import search as search_entries
+from .series import SeriesConflict, cancel_following, create_series, edit_following
+from .stats import dashboard_counts
+from .uploads import (
+    FILE_MODELS,
+    UploadError,
+    abort_session,
+    attach_blob,
+    finish_session,
+    max_chunk_bytes,
+    start_session,
+    store_uploaded_file,
+    write_chunk,
+)
+from .utils import log_action, parse_date_or_none
 
 
 # ---------------------------
 # Helpers
 # ---------------------------
 
-def _safe_log_action(request, **kwargs):
-    try:
-        return log_action(request, **kwargs)
-    except TypeError:
-        minimal_keys = ("appointment", "action", "message")
-        minimal = {k: v for k, v in kwargs.items() if k in minimal_keys}
-        try:
-            return log_action(request, **minimal)
-        except Exception:
-            return None
-
-
-def _is_patient(user) -> bool:
-    return hasattr(user, "patient_profile")
-
-
-def _patient_can_touch(appt: Appointment, user) -> bool:
-    return _is_patient(user) and appt.patient.user_id == user.id
+def _patient_can_touch(appt: Appointment, role) -> bool:
+    return role.is_patient and appt.patient_id == role.patient_id
 
 
 # ---------------------------
@@ -52,30 +75,27 @@ def _patient_can_touch(appt: Appointment, user) -> bool:
 
 @login_required
 def my_appointments(request):
-    is_patient = _is_patient(request.user)
+    is_patient = request.role.is_patient
 
     if is_patient:
-        qs = Appointment.objects.filter(
-            patient=request.user.patient_profile
-        ).order_by("-start_time")
+        qs = Appointment.objects.filter(patient_id=request.role.patient_id)
     else:
-        qs = Appointment.objects.all().order_by("-start_time")
+        qs = Appointment.objects.all()
+
+    # Paginación por cursor: (start_time, id) descendente, sin COUNT(*)
+    page = paginate_keyset(qs, request.GET.get(CURSOR_PARAM), per_page=25)
 
     return render(
         request,
         "appointments/my_appointments.html",
-        {"appointments": qs, "is_patient": is_patient},
+        {"appointments": page.object_list, "page": page, "is_patient": is_patient},
     )
 
 
 @login_required
+@doctor_required
 def doctor_agenda(request):
-    # Si es paciente, no puede ver agenda general
-    if _is_patient(request.user):
-        return redirect("my_appointments")
-
-    date_str = request.GET.get("date")
-    selected_date = parse_date(date_str) if date_str else timezone.localdate()
+    selected_date = parse_date_or_none(request.GET.get("date")) or timezone.localdate()
 
     start_day = timezone.make_aware(
         timezone.datetime.combine(selected_date, timezone.datetime.min.time())
@@ -84,61 +104,69 @@ def doctor_agenda(request):
         timezone.datetime.combine(selected_date, timezone.datetime.max.time())
     )
 
-    appointments = Appointment.objects.filter(
-        doctor=request.user,
-        start_time__range=(start_day, end_day),
-    ).order_by("start_time")
+    appointments = (
+        Appointment.objects.filter(doctor=request.user, start_time__range=(start_day, end_day))
+        .select_related("patient__user")
+        .order_by("start_time")
+    )
 
     return render(
         request,
         "appointments/doctor_agenda.html",
-        {"appointments": appointments, "today": selected_date},
+        {
+            "appointments": appointments,
+            "today": selected_date,
+            "transitions": [(code, label) for code, label in Appointment.STATUS_CHOICES if code in bulk.TRANSITIONS],
+        },
     )
 
-from django.db.models import Count, Q  # <-- agrega esto arriba si no lo tienes
 
 @login_required
-def doctor_dashboard(request):
-    # Si es paciente, no puede ver dashboard
-    if hasattr(request.user, "patient_profile"):
-        return redirect("my_appointments")
-
-    today = timezone.localdate()
-    now = timezone.now()
+@doctor_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=agenda_etag, last_modified_func=agenda_last_modified)
+def doctor_agenda_range(request, period):
+    # Semana o mes completo; responde 304 si la agenda no cambió
+    first, last = agenda_range(period, request.GET.get("date"))
+    days = appointments_by_day(request.user.id, first, last)
+
+    if period == WEEK:
+        prev_date, next_date = first - timedelta(days=7), first + timedelta(days=7)
+    else:
+        prev_date = (first - timedelta(days=1)).replace(day=1)
+        next_date = last + timedelta(days=1)
 
-    start_day = timezone.make_aware(
-        timezone.datetime.combine(today, timezone.datetime.min.time())
-    )
-    end_day = timezone.make_aware(
-        timezone.datetime.combine(today, timezone.datetime.max.time())
+    return render(
+        request,
+        "appointments/doctor_agenda_range.html",
+        {
+            "period": period,
+            "first": first,
+            "last": last,
+            "days": list(days.items()),
+            "weeks": calendar_weeks(days, first, last) if period == MONTH else None,
+            "prev_date": prev_date,
+            "next_date": next_date,
+            "today": timezone.localdate(),
+        },
     )
 
-    # Solo citas del doctor logueado
-    base_qs = Appointment.objects.filter(doctor=request.user)
 
-    # Citas de HOY
-    today_qs = base_qs.filter(start_time__range=(start_day, end_day))
+@login_required
+@doctor_required
+def doctor_dashboard(request):
+    today = timezone.localdate()
+    now = timezone.now()
 
-    today_counts = today_qs.aggregate(
-        total=Count("id"),
-        pending=Count("id", filter=Q(status="PENDING")),
-        confirmed=Count("id", filter=Q(status="CONFIRMED")),
-        cancelled=Count("id", filter=Q(status="CANCELLED")),
-        done=Count("id", filter=Q(status="DONE")),
-    )
+    # Conteos precalculados (DoctorDailyStats), no se recorre el historial
+    today_counts, upcoming_counts = dashboard_counts(request.user.id, now)
 
-    # Próximas citas (desde ahora)
-    upcoming_qs = base_qs.filter(start_time__gte=now).order_by("start_time")
-    upcoming_counts = upcoming_qs.aggregate(
-        total=Count("id"),
-        pending=Count("id", filter=Q(status="PENDING")),
-        confirmed=Count("id", filter=Q(status="CONFIRMED")),
-        cancelled=Count("id", filter=Q(status="CANCELLED")),
-        done=Count("id", filter=Q(status="DONE")),
+    next_appointments = (
+        Appointment.objects.filter(doctor=request.user, start_time__gte=now)
+        .select_related("patient__user")
+        .order_by("start_time")[:10]
     )
 
-    next_appointments = upcoming_qs[:10]
-
     return render(
         request,
         "appointments/doctor_dashboard.html",
@@ -157,20 +185,14 @@ def doctor_dashboard(request):
 # ---------------------------
 @login_required
 def appointment_detail(request, pk):
-    appointment = get_object_or_404(Appointment, pk=pk)
-    is_patient = _is_patient(request.user)
+    appointment = get_object_or_404(Appointment.objects.select_related("patient__user"), pk=pk)
+    is_patient = request.role.is_patient
 
     # Si es paciente, solo puede ver SU cita
-    if is_patient and appointment.patient.user_id != request.user.id:
+    if is_patient and appointment.patient_id != request.role.patient_id:
         messages.error(request, "No tienes permiso para ver esta cita.")
         return redirect("my_appointments")
 
-    notes_qs = appointment.notes.all()
-
-    # ✅ seguros
-    prescriptions = Prescription.objects.filter(appointment=appointment)
-    files = AppointmentFile.objects.filter(appointment=appointment)
-
     form = None
     prescription_form = None
     file_form = None
@@ -194,7 +216,7 @@ def appointment_detail(request, pk):
                     n.author = request.user
                     n.save()
 
-                    _safe_log_action(
+                    log_action(
                         request,
                         appointment=appointment,
                         action="CREATE",
@@ -213,7 +235,7 @@ def appointment_detail(request, pk):
                     p.appointment = appointment
                     p.save()
 
-                    _safe_log_action(
+                    log_action(
                         request,
                         appointment=appointment,
                         action="CREATE",
@@ -230,9 +252,12 @@ def appointment_detail(request, pk):
                 if file_form.is_valid():
                     f = file_form.save(commit=False)
                     f.appointment = appointment
-                    f.save()
+                    # Mismo contenido = mismo blob (no se guarda dos veces)
+                    with transaction.atomic():
+                        attach_blob(f, store_uploaded_file(file_form.cleaned_data["file"]))
+                        f.save()
 
-                    _safe_log_action(
+                    log_action(
                         request,
                         appointment=appointment,
                         action="CREATE",
@@ -244,19 +269,15 @@ def appointment_detail(request, pk):
                     messages.success(request, "Archivo subido.")
                     return redirect("appointment_detail", pk=appointment.id)
 
-    if is_patient:
-        notes_qs = notes_qs.filter(visible_to_patient=True)
-
+    # Notas, recetas y archivos salen de caché (ver fragments.py)
     return render(
         request,
         "appointments/appointment_detail.html",
         {
             "appointment": appointment,
             "is_patient": is_patient,
-            "notes": notes_qs,
+            "sections": detail_sections(request, appointment, is_patient),
             "form": form,
-            "prescriptions": prescriptions,
-            "files": files,
             "prescription_form": prescription_form,
             "file_form": file_form,
         },
@@ -268,19 +289,15 @@ def appointment_detail(request, pk):
 # ---------------------------
 
 @login_required
+@doctor_required(message="No tienes permiso para crear citas.")
 def appointment_create(request):
-    if _is_patient(request.user):
-        messages.error(request, "No tienes permiso para crear citas.")
-        return redirect("my_appointments")
-
     if request.method == "POST":
         form = AppointmentForm(request.POST, doctor=request.user)
         if form.is_valid():
-            appt = form.save(commit=False)
-            appt.doctor = request.user
-            appt.save()
-            messages.success(request, "Cita creada correctamente.")
-            return redirect("appointment_detail", pk=appt.pk)
+            appt = form.save_booking()
+            if appt is not None:
+                messages.success(request, "Cita creada correctamente.")
+                return redirect("appointment_detail", pk=appt.pk)
     else:
         form = AppointmentForm(doctor=request.user)
 
@@ -292,10 +309,8 @@ def appointment_create(request):
 
 
 @login_required
+@doctor_required
 def appointment_edit(request, pk):
-    if _is_patient(request.user):
-        return redirect("my_appointments")
-
     appt = get_object_or_404(Appointment, pk=pk)
 
     if appt.doctor_id != request.user.id:
@@ -305,21 +320,19 @@ def appointment_edit(request, pk):
     if request.method == "POST":
         form = AppointmentForm(request.POST, instance=appt, doctor=request.user)
         if form.is_valid():
-            appt = form.save(commit=False)
-            appt.doctor = request.user
-            appt.save()
-
-            _safe_log_action(
-                request,
-                appointment=appt,
-                action="UPDATE",
-                object_type="Appointment",
-                object_id=appt.id,
-                message="Editó la cita",
-            )
-
-            messages.success(request, "Cita actualizada correctamente.")
-            return redirect("appointment_detail", pk=appt.pk)
+            saved = form.save_booking()
+            if saved is not None:
+                log_action(
+                    request,
+                    appointment=saved,
+                    action="UPDATE",
+                    object_type="Appointment",
+                    object_id=saved.id,
+                    message="Editó la cita",
+                )
+
+                messages.success(request, "Cita actualizada correctamente.")
+                return redirect("appointment_detail", pk=saved.pk)
 
         messages.error(request, "Revisa los campos del formulario.")
     else:
@@ -332,6 +345,109 @@ def appointment_edit(request, pk):
     )
 
 
+# ---------------------------
+# SERIES (CITAS RECURRENTES)
+# ---------------------------
+
+def _series_conflict_errors(form, exc):
+    for start, found in exc.conflicts:
+        form.add_error(None, f"{timezone.localtime(start):%d/%m/%Y %H:%M}: {' '.join(found)}")
+
+
+@login_required
+@doctor_required(message="No tienes permiso para crear citas.")
+def appointment_series_create(request):
+    if request.method == "POST":
+        form = AppointmentSeriesForm(request.POST)
+        if form.is_valid():
+            series = form.save(commit=False)
+            series.doctor = request.user
+            try:
+                created, skipped = create_series(series, skip_conflicts=form.cleaned_data["skip_conflicts"])
+            except SeriesConflict as exc:
+                _series_conflict_errors(form, exc)
+            except OverlapError:
+                form.add_error(None, OVERLAP_ERROR)
+            else:
+                for appt in created:
+                    log_action(
+                        request,
+                        appointment=appt.pk,
+                        action="CREATE",
+                        object_type="Appointment",
+                        object_id=appt.pk,
+                        message=f"Creó la cita (serie #{series.pk})",
+                    )
+
+                text = f"Serie creada: {len(created)} cita(s)."
+                if skipped:
+                    text += f" {len(skipped)} omitida(s) por choques."
+                messages.success(request, text)
+                return redirect("appointment_detail", pk=created[0].pk)
+    else:
+        form = AppointmentSeriesForm()
+
+    return render(request, "appointments/series_form.html", {"form": form})
+
+
+@login_required
+@doctor_required
+def appointment_series_following(request, pk):
+    """
+    Editar o cancelar esta ocurrencia de la serie y las siguientes.
+    """
+    appt = get_object_or_404(Appointment.objects.select_related("series"), pk=pk, series__isnull=False)
+
+    if appt.doctor_id != request.user.id:
+        messages.error(request, "No tienes permiso para editar esta cita.")
+        return redirect("doctor_agenda")
+
+    if request.method == "POST" and request.POST.get("action") == "cancel":
+        count = cancel_following(appt)
+        log_action(
+            request,
+            appointment=appt,
+            action="STATUS",
+            object_type="AppointmentSeries",
+            object_id=appt.series_id,
+            message=f"Canceló esta cita y las siguientes de la serie ({count})",
+        )
+        messages.success(request, f"{count} cita(s) canceladas.")
+        return redirect("appointment_detail", pk=appt.pk)
+
+    if request.method == "POST":
+        form = SeriesFollowingForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            try:
+                new_series, count = edit_following(appt, data["start_time"], data["end_time"], data["reason"])
+            except SeriesConflict as exc:
+                _series_conflict_errors(form, exc)
+            except OverlapError:
+                form.add_error(None, OVERLAP_ERROR)
+            else:
+                log_action(
+                    request,
+                    appointment=appt,
+                    action="UPDATE",
+                    object_type="AppointmentSeries",
+                    object_id=new_series.pk,
+                    message=f"Editó esta cita y las siguientes de la serie ({count})",
+                )
+                messages.success(request, f"{count} cita(s) actualizadas.")
+                return redirect("appointment_detail", pk=appt.pk)
+    else:
+        form = SeriesFollowingForm(
+            initial={
+                "start_time": timezone.localtime(appt.start_time).strftime("%Y-%m-%dT%H:%M"),
+                "end_time": timezone.localtime(appt.end_time).strftime("%Y-%m-%dT%H:%M"),
+                "reason": appt.reason,
+            }
+        )
+
+    return render(request, "appointments/series_following.html", {"form": form, "appt": appt})
+
+
 # ---------------------------
 # CAMBIAR ESTADO (DOCTOR)
 # (Backend queda, pero templates NO lo muestran)
@@ -339,18 +455,20 @@ def appointment_edit(request, pk):
 
 @require_POST
 @login_required
+@doctor_required
 def appointment_set_status(request, pk, status):
-    if _is_patient(request.user):
-        return redirect("my_appointments")
-
     appt = get_object_or_404(Appointment, pk=pk, doctor=request.user)
     allowed = {"PENDING", "CONFIRMED", "CANCELLED", "DONE"}
 
     if status in allowed:
         appt.status = status
-        appt.save()
+        try:
+            save_appointment(appt)
+        except OverlapError:
+            messages.error(request, OVERLAP_ERROR)
+            return redirect("appointment_detail", pk=appt.pk)
 
-        _safe_log_action(
+        log_action(
             request,
             appointment=appt,
             action="STATUS",
@@ -366,6 +484,46 @@ def appointment_set_status(request, pk, status):
     return redirect("appointment_detail", pk=appt.pk)
 
 
+@require_POST
+@login_required
+@doctor_required
+def doctor_agenda_bulk_status(request):
+    """
+    Cambio de estado de las citas marcadas en la agenda del día: un solo
+    UPDATE; las que no están en un estado de origen permitido se omiten.
+    """
+    day = parse_date_or_none(request.POST.get("date"))
+    back = reverse("doctor_agenda") + (f"?date={day.isoformat()}" if day else "")
+
+    status = request.POST.get("status")
+    ids = [int(pk) for pk in request.POST.getlist("ids") if pk.isdigit()]
+    if status not in bulk.TRANSITIONS:
+        messages.error(request, "Estado inválido.")
+        return redirect(back)
+    if not ids:
+        messages.error(request, "Selecciona al menos una cita.")
+        return redirect(back)
+
+    changed, skipped = bulk.transition(request.user.id, ids, status)
+
+    for pk, old in changed:
+        log_action(
+            request,
+            appointment=pk,
+            action="STATUS",
+            object_type="Appointment",
+            object_id=pk,
+            message=f"Cambió el estado de {old} a {status} (agenda)",
+        )
+
+    label = dict(Appointment.STATUS_CHOICES)[status]
+    if changed:
+        messages.success(request, f"{len(changed)} cita(s) marcadas como {label}.")
+    if skipped:
+        messages.warning(request, f"{len(skipped)} cita(s) omitidas: su estado no permite pasar a {label}.")
+    return redirect(back)
+
+
 # ---------------------------
 # DELETE: Prescriptions / Notes / Files
 # ---------------------------
@@ -373,7 +531,7 @@ def appointment_set_status(request, pk, status):
 @require_POST
 @login_required
 def prescription_delete(request, pk, prescription_id):
-    if _is_patient(request.user):
+    if request.role.is_patient:
         messages.error(request, "No tienes permiso para hacer esto.")
         return redirect("appointment_detail", pk=pk)
 
@@ -388,7 +546,7 @@ def prescription_delete(request, pk, prescription_id):
     )
     prescription.delete()
 
-    _safe_log_action(
+    log_action(
         request,
         appointment=appointment,
         action="DELETE",
@@ -404,7 +562,7 @@ def prescription_delete(request, pk, prescription_id):
 @require_POST
 @login_required
 def clinical_note_delete(request, pk, note_id):
-    if _is_patient(request.user):
+    if request.role.is_patient:
         messages.error(request, "No tienes permiso para hacer esto.")
         return redirect("appointment_detail", pk=pk)
 
@@ -417,7 +575,7 @@ def clinical_note_delete(request, pk, note_id):
     note = get_object_or_404(ClinicalNote, pk=note_id, appointment=appointment)
     note.delete()
 
-    _safe_log_action(
+    log_action(
         request,
         appointment=appointment,
         action="DELETE",
@@ -433,7 +591,7 @@ def clinical_note_delete(request, pk, note_id):
 @require_POST
 @login_required
 def appointment_file_delete(request, pk, file_id):
-    if _is_patient(request.user):
+    if request.role.is_patient:
         messages.error(request, "No tienes permiso para hacer esto.")
         return redirect("appointment_detail", pk=pk)
 
@@ -445,11 +603,13 @@ def appointment_file_delete(request, pk, file_id):
 
     f = get_object_or_404(AppointmentFile, pk=file_id, appointment=appointment)
 
-    if f.file:
+    # Los archivos con blob se liberan en la señal post_delete
+    if f.file and not f.blob_id:
+        delete_previews(f.file.name)
         f.file.delete(save=False)
     f.delete()
 
-    _safe_log_action(
+    log_action(
         request,
         appointment=appointment,
         action="DELETE",
@@ -468,10 +628,10 @@ def appointment_file_delete(request, pk, file_id):
 
 @login_required
 def appointment_prescriptions_pdf(request, pk):
-    appointment = get_object_or_404(Appointment, pk=pk)
-    is_patient = _is_patient(request.user)
+    appointment = get_object_or_404(Appointment.objects.select_related("patient__user"), pk=pk)
+    is_patient = request.role.is_patient
 
-    if is_patient and appointment.patient.user_id != request.user.id:
+    if is_patient and appointment.patient_id != request.role.patient_id:
         messages.error(request, "No tienes permiso para descargar esta receta.")
         return redirect("my_appointments")
 
@@ -479,9 +639,9 @@ def appointment_prescriptions_pdf(request, pk):
         messages.error(request, "No tienes permiso.")
         return redirect("doctor_agenda")
 
-    pdf_bytes = build_prescriptions_pdf(appointment)
+    fh = open_prescriptions_pdf(appointment)
 
-    _safe_log_action(
+    log_action(
         request,
         appointment=appointment,
         action="PDF",
@@ -490,19 +650,68 @@ def appointment_prescriptions_pdf(request, pk):
         message="Descargó receta en PDF",
     )
 
-    response = HttpResponse(pdf_bytes, content_type="application/pdf")
-    response["Content-Disposition"] = (
-        f'attachment; filename="receta_cita_{appointment.id}.pdf"'
+    return FileResponse(
+        fh,
+        as_attachment=True,
+        filename=f"receta_cita_{appointment.id}.pdf",
+        content_type="application/pdf",
+    )
+
+
+@login_required
+@doctor_required
+def doctor_day_pdf(request):
+    """
+    Recetas de todas las citas del día en un solo PDF. Con muchas citas lo
+    arma Celery y esta vista muestra una página que se recarga hasta que
+    está listo.
+    """
+    day = parse_date_or_none(request.GET.get("date")) or timezone.localdate()
+    datas = print_day.day_data(request.user.id, day)
+    if not datas:
+        messages.info(request, "No hay citas para imprimir ese día.")
+        return redirect(f"{reverse('doctor_agenda')}?date={day.isoformat()}")
+
+    fh = None
+    if len(datas) >= print_day.async_threshold():
+        name = print_day.cache_name(request.user.id, day, datas)
+        try:
+            # Sin exists() antes: evict() puede borrarlo entre las dos llamadas
+            fh = default_storage.open(name, "rb")
+        except FileNotFoundError:
+            if print_day.queue_day(name, request.user.id, day):
+                return render(
+                    request,
+                    "appointments/print_day_pending.html",
+                    {"day": day, "count": len(datas)},
+                    status=202,
+                )
+            # Sin broker: se arma en esta misma petición
+
+    if fh is None:
+        fh = render_prescriptions(datas)
+
+    log_action(
+        request,
+        action="PDF",
+        object_type="Appointment",
+        message=f"Imprimió las recetas del {day.isoformat()} ({len(datas)} citas)",
+    )
+
+    return FileResponse(
+        fh,
+        as_attachment=True,
+        filename=f"recetas_{day.isoformat()}.pdf",
+        content_type="application/pdf",
     )
-    return response
 
 
 @require_POST
 @login_required
 def appointment_prescriptions_email(request, pk):
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_object_or_404(Appointment.objects.select_related("patient__user"), pk=pk)
 
-    if _is_patient(request.user) or appointment.doctor_id != request.user.id:
+    if request.role.is_patient or appointment.doctor_id != request.user.id:
         messages.error(request, "No tienes permiso para enviar esta receta.")
         return redirect("appointment_detail", pk=pk)
 
@@ -513,8 +722,6 @@ def appointment_prescriptions_email(request, pk):
         messages.error(request, "El paciente no tiene correo registrado.")
         return redirect("appointment_detail", pk=pk)
 
-    pdf_bytes = build_prescriptions_pdf(appointment)
-
     subject = f"Receta médica - Cita #{appointment.id}"
     body = (
         f"Hola {appointment.patient},\n\n"
@@ -522,20 +729,19 @@ def appointment_prescriptions_email(request, pk):
         "Saludos,\nClínica"
     )
 
-    email = EmailMessage(subject=subject, body=body, to=[to_email])
-    email.attach(f"receta_cita_{appointment.id}.pdf", pdf_bytes, "application/pdf")
-    email.send(fail_silently=False)
+    # El PDF se genera y se envía en segundo plano (appointments.outbox)
+    enqueue_email(to_email, subject, body, appointment=appointment, attach_prescriptions=True)
 
-    _safe_log_action(
+    log_action(
         request,
         appointment=appointment,
         action="EMAIL",
         object_type="Appointment",
         object_id=appointment.id,
-        message=f"Envió receta por correo a {to_email}",
+        message=f"Encoló receta por correo a {to_email}",
     )
 
-    messages.success(request, "Receta enviada por correo.")
+    messages.success(request, "La receta se enviará por correo en unos momentos.")
     return redirect("appointment_detail", pk=pk)
 
 
@@ -548,7 +754,7 @@ def appointment_prescriptions_email(request, pk):
 def patient_confirm_appointment(request, pk):
     appt = get_object_or_404(Appointment, pk=pk)
 
-    if not _patient_can_touch(appt, request.user):
+    if not _patient_can_touch(appt, request.role):
         messages.error(request, "No tienes permiso para confirmar esta cita.")
         return redirect("my_appointments")
 
@@ -557,7 +763,11 @@ def patient_confirm_appointment(request, pk):
         return redirect("appointment_detail", pk=pk)
 
     appt.status = "CONFIRMED"
-    appt.save()
+    try:
+        save_appointment(appt)
+    except OverlapError:
+        messages.error(request, OVERLAP_ERROR)
+        return redirect("appointment_detail", pk=pk)
     messages.success(request, "Cita confirmada correctamente.")
     return redirect("appointment_detail", pk=pk)
 
@@ -567,7 +777,7 @@ def patient_confirm_appointment(request, pk):
 def patient_cancel_appointment(request, pk):
     appt = get_object_or_404(Appointment, pk=pk)
 
-    if not _patient_can_touch(appt, request.user):
+    if not _patient_can_touch(appt, request.role):
         messages.error(request, "No tienes permiso para cancelar esta cita.")
         return redirect("my_appointments")
 
@@ -576,62 +786,435 @@ def patient_cancel_appointment(request, pk):
         return redirect("appointment_detail", pk=pk)
 
     appt.status = "CANCELLED"
-    appt.save()
+    save_appointment(appt)
     messages.success(request, "Cita cancelada.")
     return redirect("appointment_detail", pk=pk)
 
 @login_required
+@patient_required
 def patient_history(request):
-    # Solo pacientes
-    if not hasattr(request.user, "patient_profile"):
-        return redirect("doctor_dashboard")
-
-    patient = request.user.patient_profile
     now = timezone.now()
 
     # ---- filtros (GET) ----
-    status = (request.GET.get("status") or "").upper().strip()
-    q = (request.GET.get("q") or "").strip()
-    date_from = parse_date(request.GET.get("from") or "")
-    date_to = parse_date(request.GET.get("to") or "")
-
-    allowed_status = {"PENDING", "CONFIRMED", "CANCELLED", "DONE"}
+    filters = history_filters(request)
 
     qs = (
         Appointment.objects
-        .filter(patient=patient, start_time__lt=now)  # solo pasadas
+        .filter(patient_id=request.role.patient_id, start_time__lt=now)  # solo pasadas
         .select_related("doctor")
         .prefetch_related("prescriptions")
         .annotate(rx_count=Count("prescriptions"))
-        .order_by("-start_time")
+    )
+    qs = apply_history_filters(qs, filters)
+
+    page = paginate_keyset(qs, request.GET.get(CURSOR_PARAM), per_page=10)
+
+    return render(
+        request,
+        "appointments/patient_history.html",
+        {
+            "appointments": page.object_list,
+            "page": page,
+            "filters": filters,
+        },
+    )
+
+
+@login_required
+def appointment_history_export(request):
+    """
+    Historial completo (citas pasadas) en CSV o NDJSON, con los mismos
+    filtros que patient_history. El paciente exporta sus citas; el doctor
+    las suyas, opcionalmente de un solo paciente (?patient=<id>).
+    """
+    fmt = (request.GET.get("format") or CSV).lower()
+    if fmt not in CONTENT_TYPES:
+        return JsonResponse({"error": "Formato no soportado (csv o ndjson)."}, status=400)
+
+    qs = Appointment.objects.filter(start_time__lt=timezone.now())
+    if request.role.is_patient:
+        qs = qs.filter(patient_id=request.role.patient_id)
+    else:
+        qs = qs.filter(doctor=request.user)
+        patient_id = request.GET.get("patient")
+        if patient_id:
+            if not patient_id.isdigit():
+                return JsonResponse({"error": "Paciente inválido."}, status=400)
+            qs = qs.filter(patient_id=int(patient_id))
+
+    qs = apply_history_filters(qs, history_filters(request))
+
+    log_action(
+        request,
+        action="EXPORT",
+        object_type="Appointment",
+        message=f"Exportó el historial de citas ({fmt})",
     )
 
-    if status in allowed_status:
-        qs = qs.filter(status=status)
+    response = StreamingHttpResponse(stream_rows(qs, fmt), content_type=CONTENT_TYPES[fmt])
+    filename = f"historial_{timezone.localdate():%Y%m%d}.{fmt}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
 
-    if q:
-        qs = qs.filter(reason__icontains=q)
 
-    if date_from:
-        qs = qs.filter(start_time__date__gte=date_from)
+# ---------------------------
+# BÚSQUEDA
+# ---------------------------
 
-    if date_to:
-        qs = qs.filter(start_time__date__lte=date_to)
+@login_required
+def appointment_search(request):
+    """
+    Búsqueda en motivos, notas y recetas, ordenada por relevancia. El
+    paciente solo ve sus citas y las notas marcadas como visibles.
+    """
+    query = (request.GET.get("q") or "").strip()
+    try:
+        page_number = max(int(request.GET.get("page") or 1), 1)
+    except ValueError:
+        page_number = 1
 
-    paginator = Paginator(qs, 10)
-    page_obj = paginator.get_page(request.GET.get("page"))
+    is_patient = request.role.is_patient
+    page = search_entries(request.role, query, page=page_number)
 
     return render(
         request,
-        "appointments/patient_history.html",
+        "appointments/search.html",
         {
-            "page_obj": page_obj,
-            "filters": {
-                "status": status,
-                "q": q,
-                "from": request.GET.get("from", ""),
-                "to": request.GET.get("to", ""),
-            }
+            "query": query,
+            "page": page,
+            "results": page.object_list,
+            "is_patient": is_patient,
         },
     )
 
+
+# ---------------------------
+# DISPONIBILIDAD (JSON)
+# ---------------------------
+
+MAX_AVAILABILITY_DAYS = 62
+MAX_AVAILABILITY_SLOTS = 100
+
+
+@login_required
+def doctor_availability(request):
+    """
+    GET ?doctor=<id>&from=YYYY-MM-DD&to=YYYY-MM-DD&length=<min>&limit=<n>
+    Primeros huecos libres del doctor en el rango.
+    """
+    default_doctor = "" if request.role.is_patient else request.user.id
+    try:
+        doctor_id = int(request.GET.get("doctor") or default_doctor or 0)
+        length = int(request.GET.get("length") or 30)
+        limit = min(int(request.GET.get("limit") or 10), MAX_AVAILABILITY_SLOTS)
+    except ValueError:
+        return JsonResponse({"error": "Parámetros inválidos."}, status=400)
+
+    date_from = parse_date_or_none(request.GET.get("from")) or timezone.localdate()
+    date_to = parse_date_or_none(request.GET.get("to")) or date_from + timedelta(days=13)
+
+    if not doctor_id or length <= 0 or limit <= 0:
+        return JsonResponse({"error": "Parámetros inválidos."}, status=400)
+    if date_to < date_from or (date_to - date_from).days >= MAX_AVAILABILITY_DAYS:
+        return JsonResponse({"error": "Rango de fechas inválido."}, status=400)
+
+    slots = find_free_slots(doctor_id, date_from, date_to, length, limit=limit)
+
+    return JsonResponse(
+        {
+            "doctor": doctor_id,
+            "length": length,
+            "slots": [
+                {"start": start.isoformat(), "end": end.isoformat()}
+                for start, end in slots
+            ],
+        }
+    )
+
+
+# ---------------------------
+# API JSON POR LOTES
+# ---------------------------
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+def _bulk_error(message, status=400):
+    return JsonResponse({"error": message}, status=status)
+
+
+def _api_login_required(view):
+    """
+    login_required para la API: sin sesión responde 401 en JSON en vez de
+    redirigir al formulario de login.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _bulk_error("Se requiere iniciar sesión.", status=401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@_api_login_required
+def api_appointments(request):
+    """
+    GET ?ids=1,2,3 o ?from=YYYY-MM-DD&to=YYYY-MM-DD: citas del usuario.
+    POST {"appointments": [...], "atomic": false}: alta por lote para el
+    doctor de la sesión (ver appointments.bulk). Responde los ids creados y
+    los errores por fila.
+    """
+    if request.method == "GET":
+        try:
+            rows, truncated = bulk.read_appointments(request.role, request.GET)
+        except bulk.BulkError as exc:
+            return _bulk_error(str(exc), exc.status)
+        return JsonResponse({"appointments": rows, "truncated": truncated})
+
+    if request.method != "POST":
+        return _bulk_error("Método no permitido.", status=405)
+    if not request.role.is_doctor:
+        return _bulk_error("No tienes permiso para crear citas.", status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return _bulk_error("JSON inválido.")
+
+    try:
+        created, errors = bulk.create_appointments(request.user.id, data)
+    except bulk.BulkError as exc:
+        return _bulk_error(str(exc), exc.status)
+    except OverlapError:
+        return _bulk_error("Otra reserva cambió la agenda mientras tanto; reintenta el lote.", status=409)
+
+    for _, appt in created:
+        log_action(
+            request,
+            appointment=appt,
+            action="CREATE",
+            object_type="Appointment",
+            object_id=appt.id,
+            message="Creó la cita (lote)",
+        )
+
+    return JsonResponse(
+        {
+            "created": [{"row": row, "id": appt.id} for row, appt in created],
+            "errors": bulk.errors_list(errors),
+        },
+        status=201 if created else 400,
+    )
+
+
+@require_POST
+@_api_login_required
+def api_appointments_status(request):
+    """
+    POST {"updates": [{"id": 1, "status": "DONE"}, ...]}: un UPDATE por
+    estado destino. Solo citas del doctor de la sesión.
+    """
+    if not request.role.is_doctor:
+        return _bulk_error("No tienes permiso para cambiar estados.", status=403)
+
+    data = _json_body(request)
+    if data is None:
+        return _bulk_error("JSON inválido.")
+
+    try:
+        updated, errors = bulk.update_statuses(request.user.id, data)
+    except bulk.BulkError as exc:
+        return _bulk_error(str(exc), exc.status)
+
+    for pk, old, new in updated:
+        if old != new:
+            log_action(
+                request,
+                appointment=pk,
+                action="STATUS",
+                object_type="Appointment",
+                object_id=pk,
+                message=f"Cambió el estado a {new} (lote)",
+            )
+
+    return JsonResponse(
+        {
+            "updated": [{"id": pk, "status": new} for pk, _, new in updated],
+            "errors": bulk.errors_list(errors),
+        },
+        status=200 if updated else 400,
+    )
+
+
+# ---------------------------
+# DESCARGA PROTEGIDA DE ARCHIVOS
+# ---------------------------
+
+def _file_for_user(request, kind, file_id):
+    """
+    AppointmentFile o MedicalFile con las mismas reglas que
+    appointment_detail: el paciente solo los de sus citas, el doctor solo
+    los de las suyas. None si no tiene permiso.
+    """
+    obj = get_object_or_404(FILE_MODELS[kind].objects.select_related("appointment", "blob"), pk=file_id)
+    appointment = obj.appointment
+
+    if request.role.is_patient:
+        allowed = appointment.patient_id == request.role.patient_id
+    else:
+        allowed = appointment.doctor_id == request.user.id
+    return obj if allowed and obj.file else None
+
+
+@login_required
+def file_download(request, file_id, kind):
+    # 404 y no redirección: los clientes de descarga (Range) no siguen a una página
+    obj = _file_for_user(request, kind, file_id)
+    if obj is None:
+        raise Http404
+
+    etag = f'"{obj.blob.sha256}"' if obj.blob_id else None
+    return serve_file(
+        request,
+        obj.file,
+        download_filename(obj),
+        etag=etag,
+        as_attachment=request.GET.get("download") == "1",
+    )
+
+
+@login_required
+def file_preview(request, file_id, kind, size):
+    """
+    Miniatura o vista previa WebP; si falta se regenera aquí mismo.
+    """
+    obj = _file_for_user(request, kind, file_id)
+    if obj is None:
+        raise Http404
+
+    name = ensure_preview(obj, size)
+    if not name:
+        raise Http404
+
+    root = os.path.splitext(download_filename(obj))[0]
+    return serve_file(request, getattr(obj, size), f"{root}.webp")
+
+
+# ---------------------------
+# SUBIDAS POR PARTES (API JSON)
+# ---------------------------
+
+UPLOAD_OBJECT_TYPES = {"appointment_file": "AppointmentFile", "medical_file": "MedicalFile"}
+
+
+def _upload_state(session):
+    return {
+        "id": str(session.id),
+        "url": reverse("upload_session", args=[session.id]),
+        "offset": session.offset,
+        "size": session.size,
+        "chunk_size": max_chunk_bytes(),
+        "complete": False,
+    }
+
+
+def _upload_error(exc):
+    data = {"error": str(exc)}
+    if exc.offset is not None:
+        data["offset"] = exc.offset
+    return JsonResponse(data, status=exc.status)
+
+
+@login_required
+@require_POST
+def upload_start(request, pk):
+    """
+    Inicia una subida por partes. Body JSON: kind (appointment_file |
+    medical_file), filename, size y opcionalmente title.
+    """
+    appointment = get_object_or_404(Appointment, pk=pk)
+    if request.role.is_patient or appointment.doctor_id != request.user.id:
+        return JsonResponse({"error": "No tienes permiso para subir archivos a esta cita."}, status=403)
+
+    try:
+        data = json.loads(request.body or b"{}")
+        size = int(data.get("size") or 0)
+    except (ValueError, TypeError):
+        return JsonResponse({"error": "JSON inválido."}, status=400)
+
+    try:
+        session = start_session(
+            appointment,
+            request.user,
+            kind=data.get("kind") or "appointment_file",
+            filename=str(data.get("filename") or ""),
+            size=size,
+            title=str(data.get("title") or ""),
+        )
+    except UploadError as exc:
+        return _upload_error(exc)
+
+    return JsonResponse(_upload_state(session), status=201)
+
+
+@login_required
+def upload_session(request, upload_id):
+    """
+    GET: estado (para reanudar). PUT: una parte, con el header Upload-Offset
+    y opcionalmente X-Chunk-SHA256; una PUT vacía en offset == size reintenta
+    el cierre si falló tras la última parte. DELETE: cancela la subida.
+    """
+    session = get_object_or_404(UploadSession, pk=upload_id, created_by=request.user)
+
+    if request.method in ("GET", "HEAD"):
+        return JsonResponse(_upload_state(session))
+
+    if request.method == "DELETE":
+        abort_session(session)
+        return JsonResponse({"deleted": True})
+
+    if request.method != "PUT":
+        return JsonResponse({"error": "Método no permitido."}, status=405)
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+        # Sin cuerpo algunos clientes no mandan Content-Length
+        length = int(request.headers.get("Content-Length") or 0)
+    except ValueError:
+        return JsonResponse({"error": "Falta el header Upload-Offset o Content-Length es inválido."}, status=400)
+
+    try:
+        if not (length == 0 and offset == session.offset == session.size):
+            # Se lee del request de a bloques: nunca request.body
+            write_chunk(session, offset, request, length, request.headers.get("X-Chunk-SHA256", ""))
+        if session.offset < session.size:
+            return JsonResponse(_upload_state(session))
+        obj, blob, deduplicated = finish_session(session)
+    except UploadError as exc:
+        return _upload_error(exc)
+
+    log_action(
+        request,
+        appointment=obj.appointment_id,
+        action="CREATE",
+        object_type=UPLOAD_OBJECT_TYPES[session.kind],
+        object_id=obj.id,
+        message=f"Subió un archivo por partes ({session.filename})",
+    )
+
+    return JsonResponse(
+        {
+            "complete": True,
+            "file_id": obj.id,
+            "kind": session.kind,
+            "sha256": blob.sha256,
+            "size": blob.size,
+            "deduplicated": deduplicated,
+        },
+        status=201,
+    )
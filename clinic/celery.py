@@ -5,3 +5,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clinic.settings")
 app = Celery("clinic")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+from .metrics import connect_celery_signals  # noqa: E402
+
+connect_celery_signals()
@@ -0,0 +1,366 @@
+"""
+Métricas en formato de texto de Prometheus.
+
+Cada proceso (workers de gunicorn, workers de Celery) acumula sus contadores
+en memoria y los vuelca cada METRICS_FLUSH_SECONDS a METRICS_DIR/<host>-<pid>.json.
+La vista /metrics suma los archivos de todos los procesos, así el resultado
+es el mismo sin importar qué worker atienda la petición. Los archivos de
+procesos muertos de este host se suman a <host>-archive.json y se borran,
+así los contadores no bajan y el directorio no crece con cada reinicio.
+
+Se mide:
+- latencia por vista (histograma), cantidad de consultas SQL y tiempo en BD
+- duración y resultado de cada tarea de Celery
+- tiempo de render del PDF de recetas
+"""
+import atexit
+import fcntl
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    "clinic_http_requests_total": ("counter", "Peticiones HTTP por vista, método y estado."),
+    "clinic_http_request_duration_seconds": ("histogram", "Latencia de las peticiones HTTP por vista."),
+    "clinic_http_db_queries_total": ("counter", "Consultas SQL ejecutadas por vista."),
+    "clinic_http_db_seconds_total": ("counter", "Tiempo en base de datos por vista."),
+    "clinic_task_duration_seconds": ("histogram", "Duración de las tareas de Celery."),
+    "clinic_tasks_total": ("counter", "Tareas de Celery por resultado."),
+    "clinic_pdf_render_seconds": ("histogram", "Tiempo de render de PDFs de recetas."),
+}
+
+
+# ---------------------------
+# Registro por proceso
+# ---------------------------
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.last_flush = 0.0
+
+    def inc(self, name, labels, amount=1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] += amount
+        self.maybe_flush()
+
+    def observe(self, name, labels, value, buckets=DEFAULT_BUCKETS):
+        base = tuple(sorted(labels.items()))
+        with self.lock:
+            for bound in buckets:
+                if value <= bound:
+                    self.values[(f"{name}_bucket", base + (("le", repr(bound)),))] += 1
+            self.values[(f"{name}_bucket", base + (("le", "+Inf"),))] += 1
+            self.values[(f"{name}_sum", base)] += value
+            self.values[(f"{name}_count", base)] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < getattr(settings, "METRICS_FLUSH_SECONDS", 1.0):
+            return
+        self.last_flush = now
+
+        with self.lock:
+            rows = [[name, dict(labels), value] for (name, labels), value in self.values.items()]
+
+        directory = _metrics_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{socket.gethostname()}-{os.getpid()}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(rows))
+        os.replace(tmp, path)
+
+
+_registry = _Registry()
+atexit.register(lambda: _registry.values and _registry.maybe_flush(force=True))
+
+
+def _metrics_dir():
+    return Path(getattr(settings, "METRICS_DIR", Path(settings.BASE_DIR) / "metrics"))
+
+
+def inc(name, amount=1.0, **labels):
+    _registry.inc(name, labels, amount)
+
+
+def observe(name, value, **labels):
+    _registry.observe(name, labels, value)
+
+
+def timed(name, **labels):
+    """
+    Decorador: registra en el histograma `name` lo que tarda la función.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+# ---------------------------
+# HTTP
+# ---------------------------
+
+class _QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    En una respuesta por partes (StreamingHttpResponse, p. ej. la exportación
+    del historial) las consultas corren mientras el servidor la recorre, ya
+    fuera de __call__: se miden envolviendo el iterador y la petición se
+    registra cuando termina de enviarse (la latencia incluye el envío).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with _timing(timer):
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        labels = {
+            "view": (match.view_name if match else None) or "unresolved",
+            "method": request.method,
+            "status": str(response.status_code),
+        }
+
+        if response.streaming and not response.is_async:
+            response.streaming_content = _timed_stream(response.streaming_content, timer, start, labels)
+        else:
+            _record(timer, time.perf_counter() - start, **labels)
+        return response
+
+
+def _timing(timer):
+    stack = ExitStack()
+    for conn in connections.all():
+        stack.enter_context(conn.execute_wrapper(timer))
+    return stack
+
+
+def _timed_stream(content, timer, start, labels):
+    iterator = iter(content)
+    try:
+        while True:
+            # Solo durante cada next(): entre partes el hilo es del servidor
+            with _timing(timer):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+            yield chunk
+    finally:
+        _record(timer, time.perf_counter() - start, **labels)
+
+
+def _record(timer, elapsed, view, method, status):
+    inc("clinic_http_requests_total", view=view, method=method, status=status)
+    observe("clinic_http_request_duration_seconds", elapsed, view=view)
+    inc("clinic_http_db_queries_total", timer.count, view=view)
+    inc("clinic_http_db_seconds_total", timer.seconds, view=view)
+
+
+# ---------------------------
+# Celery
+# ---------------------------
+
+_task_started = {}
+
+
+def task_prerun(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+def task_postrun(task_id=None, task=None, state=None, **kwargs):
+    start = _task_started.pop(task_id, None)
+    name = getattr(task, "name", "unknown")
+    if start is not None:
+        observe("clinic_task_duration_seconds", time.perf_counter() - start, task=name)
+    inc("clinic_tasks_total", task=name, outcome=(state or "UNKNOWN").lower())
+
+
+def connect_celery_signals():
+    from celery.signals import task_postrun as postrun_signal
+    from celery.signals import task_prerun as prerun_signal
+
+    prerun_signal.connect(task_prerun, weak=False)
+    postrun_signal.connect(task_postrun, weak=False)
+
+
+# ---------------------------
+# Exposición
+# ---------------------------
+
+def _read_rows(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return []
+
+
+def _sum_rows(totals, rows):
+    for name, labels, value in rows:
+        totals[(name, tuple(sorted(labels.items())))] += value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _archive_dead_processes(directory):
+    """
+    Suma a <host>-archive.json los archivos de los procesos de este host que
+    ya no existen y los borra. Los de otros hosts no se tocan.
+    """
+    host = socket.gethostname()
+    prefix = f"{host}-"
+
+    def dead_files():
+        return [
+            path
+            for path in directory.glob(f"{prefix}*.json")
+            if path.stem[len(prefix):].isdigit() and not _pid_alive(int(path.stem[len(prefix):]))
+        ]
+
+    if not dead_files():
+        return
+
+    with open(directory / f"{host}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Otro proceso pudo archivarlos mientras se esperaba el lock
+        dead = dead_files()
+        archive = directory / f"{prefix}archive.json"
+
+        totals = defaultdict(float)
+        for path in [archive, *dead]:
+            _sum_rows(totals, _read_rows(path))
+
+        tmp = archive.with_suffix(".tmp")
+        tmp.write_text(json.dumps([[name, dict(labels), value] for (name, labels), value in totals.items()]))
+        os.replace(tmp, archive)
+        for path in dead:
+            path.unlink(missing_ok=True)
+
+
+def _collect():
+    directory = _metrics_dir()
+    if directory.is_dir():
+        _archive_dead_processes(directory)
+
+    totals = defaultdict(float)
+    for path in directory.glob("*.json"):
+        _sum_rows(totals, _read_rows(path))
+    return totals
+
+
+def _base_name(name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and name[: -len(suffix)] in METRICS:
+            return name[: -len(suffix)]
+    return name
+
+
+def _sort_key(row):
+    # Buckets de un mismo histograma juntos y en orden creciente de "le"
+    name, labels, _ = row
+    le = dict(labels).get("le")
+    rest = tuple(item for item in labels if item[0] != "le")
+    return (rest, name, float(le) if le is not None else 0.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels, key=lambda item: item[0] == "le"):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_metrics(extra=()):
+    totals = _collect()
+    grouped = defaultdict(list)
+    for (name, labels), value in totals.items():
+        grouped[_base_name(name)].append((name, labels, value))
+
+    lines = []
+    for base in sorted(grouped):
+        kind, help_text = METRICS.get(base, ("untyped", ""))
+        lines.append(f"# HELP {base} {help_text}")
+        lines.append(f"# TYPE {base} {kind}")
+        for name, labels, value in sorted(grouped[base], key=_sort_key):
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for name, kind, help_text, value in extra:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    /metrics: solo staff (sesión) o con el token METRICS_TOKEN
+    (Authorization: Bearer <token>) para el scraper de Prometheus.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    auth = request.headers.get("Authorization", "")
+    if not (request.user.is_staff or (token and hmac.compare_digest(auth, f"Bearer {token}"))):
+        return HttpResponseForbidden("Forbidden")
+
+    _registry.maybe_flush(force=True)
+
+    from appointments import pdf_cache
+
+    pdf_stats = pdf_cache.stats()
+    extra = [
+        ("clinic_pdf_cache_hits_total", "counter", "Aciertos de la caché de PDFs.", pdf_stats["hits"]),
+        ("clinic_pdf_cache_misses_total", "counter", "Fallos de la caché de PDFs.", pdf_stats["misses"]),
+    ]
+
+    return HttpResponse(render_metrics(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -58,6 +58,7 @@ INSTALLED_APPS = [
 # MIDDLEWARE
 # =====================================================
 MIDDLEWARE = [
+    "clinic.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
 
@@ -65,6 +66,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "accounts.roles.RoleMiddleware",
+    "appointments.middleware.AuditMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -111,9 +114,57 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # Cada transacción toma el lock de escritura al iniciar: evita que
+            # dos reservas simultáneas pasen la validación de choques.
+            "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+            # En archivo (no en memoria) para que los tests con hilos usen
+            # conexiones reales, como en producción.
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
         }
     }
 
+# =====================================================
+# CACHE / SESIONES
+# =====================================================
+# Redis compartido por todos los workers; sin CACHE_URL / REDIS_URL (dev,
+# tests) una caché en memoria por proceso.
+CACHE_URL = os.getenv("CACHE_URL", os.getenv("REDIS_URL", ""))
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "clinic",
+            "TIMEOUT": 300,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "clinic",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# La caché locmem es de cada proceso: lo que se borra en un worker (logout,
+# usuario desactivado, cambio de contraseña) seguiría vivo en los demás. Sin
+# caché compartida, sesiones y usuario de la sesión salen siempre de la base.
+AUTH_USER_CACHE = bool(CACHE_URL)
+
+if AUTH_USER_CACHE:
+    # La sesión se lee de la caché y se escribe también en la base (django_session)
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# El usuario de la sesión (con su perfil de paciente) sale de la caché.
+# ModelBackend sigue en la lista para las sesiones iniciadas antes con él:
+# sin su ruta aquí Django las cerraría todas.
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
 # =====================================================
 # PASSWORD VALIDATION
 # =====================================================
@@ -144,6 +195,66 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# =====================================================
+# CORREO / CELERY
+# =====================================================
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+CELERY_TIMEZONE = TIME_ZONE
+
+CELERY_BEAT_SCHEDULE = {
+    # Respaldo por si un correo se encoló sin que el broker respondiera
+    "send-outbound-emails": {
+        "task": "appointments.tasks.send_outbound_emails",
+        "schedule": 60.0,
+    },
+    "purge-stale-uploads": {
+        "task": "appointments.tasks.purge_stale_uploads",
+        "schedule": 60.0 * 60,
+    },
+    # Cierra las citas de días pasados (el primer run después de medianoche)
+    "rollover-past-appointments": {
+        "task": "appointments.tasks.rollover_past_appointments",
+        "schedule": 60.0 * 60,
+    },
+}
+
+# Bandeja de salida (appointments.outbox)
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 60
+
+# Bitácora: True = los eventos se escriben desde Celery (write_audit_events)
+AUDIT_ASYNC = os.getenv("AUDIT_ASYNC", "False").lower() == "true"
+
+# Tamaño máximo de la caché de PDFs de recetas (media/pdf_cache)
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# "Imprimir el día" (appointments.print_day): desde cuántas citas el PDF lo
+# arma Celery en vez de la petición.
+PRINT_DAY_ASYNC_THRESHOLD = int(os.getenv("PRINT_DAY_ASYNC_THRESHOLD", "80"))
+
+# Subidas por partes (appointments.uploads). El directorio temporal debe
+# ser compartido por los workers.
+CHUNKED_UPLOAD_DIR = Path(os.getenv("CHUNKED_UPLOAD_DIR", MEDIA_ROOT / "_uploads"))
+CHUNKED_UPLOAD_MAX_CHUNK = int(os.getenv("CHUNKED_UPLOAD_MAX_CHUNK", str(8 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_SIZE", str(2 * 1024 * 1024 * 1024)))
+
+# Descarga de archivos subidos (appointments.downloads): "" = la vista
+# envía el archivo (FileResponse + Range), "nginx" = X-Accel-Redirect a
+# MEDIA_ACCEL_PREFIX (location internal con alias a MEDIA_ROOT),
+# "sendfile" = X-Sendfile (Apache / lighttpd).
+MEDIA_ACCEL = os.getenv("MEDIA_ACCEL", "")
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+
+# Métricas (clinic.metrics): cada proceso vuelca sus contadores en METRICS_DIR,
+# que debe ser compartido por los workers de gunicorn y de Celery.
+METRICS_DIR = Path(os.getenv("METRICS_DIR", BASE_DIR / "metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+# Token opcional para que Prometheus lea /metrics sin sesión de staff
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Los tests escriben las métricas en un directorio temporal
+TEST_RUNNER = "clinic.test_runner.TestRunner"
+
 # =====================================================
 # PRODUCTION SECURITY
 # =====================================================
@@ -0,0 +1,27 @@
+"""
+Runner de tests: las métricas (clinic.metrics) van a un directorio temporal
+en vez de METRICS_DIR, que en desarrollo está dentro del repositorio.
+"""
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.mkdtemp(prefix="clinic-metrics-")
+        self.metrics_settings = override_settings(METRICS_DIR=Path(self.metrics_dir))
+        self.metrics_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        from . import metrics
+
+        # Sin esto el volcado de atexit escribiría en el METRICS_DIR real
+        metrics._registry.values.clear()
+        self.metrics_settings.disable()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
+from .metrics import metrics_view
 from .views import home
 
 urlpatterns = [
@@ -10,6 +11,7 @@ urlpatterns = [
     path("accounts/", include("accounts.urls")),
     path("appointments/", include("appointments.urls")),
     path("", home, name="home"),
+    path("metrics", metrics_view, name="metrics"),
 
     # ✅ Alias para links viejos /login
     path("login", RedirectView.as_view(url="/accounts/login/", permanent=False)),
@@ -1,16 +1,21 @@
 from django.contrib import admin
+from appointments.pagination import KeysetPaginationMixin
 from .models import Prescription, AppointmentFile
 
 
 @admin.register(Prescription)
-class PrescriptionAdmin(admin.ModelAdmin):
+class PrescriptionAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = "created_at"
+    list_select_related = ("appointment__patient__user",)
     list_display = ("id", "appointment", "medication", "created_at")
     list_filter = ("created_at",)
     search_fields = ("medication", "appointment__id")
 
 
 @admin.register(AppointmentFile)
-class AppointmentFileAdmin(admin.ModelAdmin):
+class AppointmentFileAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = "created_at"
+    list_select_related = ("appointment__patient__user",)
     list_display = ("id", "appointment", "title", "created_at")
     list_filter = ("created_at",)
     search_fields = ("title", "appointment__id")
@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_storedblob_uploadsession'),
+        ('prescriptions', '0003_alter_appointmentfile_appointment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointmentfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='appointments.storedblob'),
+        ),
+    ]
@@ -30,6 +30,13 @@ class AppointmentFile(models.Model):
     )
     title = models.CharField(max_length=120, blank=True)
     file = models.FileField(upload_to="appointments/")
+    # Contenido deduplicado (subidas por partes); el archivo es blob.file
+    blob = models.ForeignKey(
+        "appointments.StoredBlob", on_delete=models.PROTECT, null=True, blank=True, related_name="+"
+    )
+    # Miniatura y vista previa WebP (appointments.previews)
+    thumbnail = models.FileField(max_length=255, blank=True, editable=False)
+    preview = models.FileField(max_length=255, blank=True, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from appointments import pdf_cache
+
+from .models import Prescription
+
+
+@receiver(post_save, sender=Prescription)
+@receiver(post_delete, sender=Prescription)
+def invalidate_prescriptions_pdf(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pdf_cache.invalidate(instance.appointment_id)
@@ -1,9 +1,12 @@
 from django.contrib import admin
+from appointments.pagination import KeysetPaginationMixin
 from .models import MedicalFile
 
 
 @admin.register(MedicalFile)
-class MedicalFileAdmin(admin.ModelAdmin):
+class MedicalFileAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = "created_at"
+    list_select_related = ("appointment__patient__user",)
     list_display = ("id", "appointment", "title", "created_at")
     list_filter = ("created_at",)
     search_fields = ("title", "appointment__id")